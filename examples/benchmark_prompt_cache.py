@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/06
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: examples/benchmark_prompt_cache.py
+# Description: 对比旧版 (缩进 JSON) 与紧凑提示词的 token 数、可缓存前缀以及预填充耗时
+
+from course_graph.llm import ExamplePromptGenerator, VLLM, LLM_CONFIG
+from course_graph.llm.tokenizer import estimate_tokens
+import argparse
+import json
+import os
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', '--model', default=None, help='VLLM 模型路径, 不指定时只统计 token')
+parser.add_argument('-n', '--num', type=int, default=20, help='请求次数')
+args = parser.parse_args()
+
+prompt = ExamplePromptGenerator()
+contents = [f'第{i}段: 神经网络的学习通过某个指标表示现在的状态, 这个指标称为损失函数。' * 5 for i in range(args.num)]
+
+for stage, get_prompt in [('ner', lambda c: prompt.get_ner_prompt(c)),
+                          ('re', lambda c: prompt.get_re_prompt(c, ['损失函数', '神经网络'])),
+                          ('ae', lambda c: prompt.get_ae_prompt(c, ['损失函数', '神经网络']))]:
+    compact = [get_prompt(c)[0] for c in contents]
+    indented = [json.dumps(json.loads(p), indent=4, ensure_ascii=False) for p in compact]
+    for name, prompts in [('indent=4', indented), ('compact', compact)]:
+        prefix = len(os.path.commonprefix(prompts))
+        print(f'[{stage}] {name:>8}: 平均 {sum(map(estimate_tokens, prompts)) / len(prompts):.0f} tokens, '
+              f'公共前缀 {estimate_tokens(prompts[0][:prefix])} tokens')
+
+if args.model:
+    # 只生成 1 个 token, 耗时近似为预填充耗时; 第一次请求之后前缀缓存生效
+    LLM_CONFIG.max_tokens = 1
+    with VLLM(args.model) as model:
+        for name, build in [('indent=4', lambda c: json.dumps(json.loads(prompt.get_ner_prompt(c)[0]), indent=4, ensure_ascii=False)),
+                            ('compact', lambda c: prompt.get_ner_prompt(c)[0])]:
+            latencies = []
+            for content in contents:
+                start = time.time()
+                model.chat(build(content), tag=f'bench_{name}')
+                latencies.append(time.time() - start)
+            print(f'{name:>8}: 首次 {latencies[0]:.3f}s, 其余平均 {sum(latencies[1:]) / max(1, len(latencies) - 1):.3f}s')
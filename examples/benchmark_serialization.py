@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/13
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: examples/benchmark_serialization.py
+# Description: 对比 pickle 与紧凑格式的文件大小和加载耗时 (包括只加载书签树和单个章节)
+
+from course_graph.parser import Document, DocumentFile, PDFParser
+import argparse
+import os
+import pickle
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-f', '--file', default='assets/深度学习入门：基于Python的理论与实现.pdf', help='pdf 文件')
+parser.add_argument('-d', '--document', required=True, help='已经完成抽取并使用 pickle 保存的 Document')
+parser.add_argument('-n', '--num', type=int, default=5, help='重复次数')
+args = parser.parse_args()
+
+
+def timeit(func) -> float:
+    start = time.time()
+    for _ in range(args.num):
+        func()
+    return (time.time() - start) / args.num
+
+
+with PDFParser(args.file) as pdf:
+    document = Document.load(args.document, pdf)
+    pickle_path, compact_path = '.cache/document.pkl', '.cache/document.cgdoc'
+    os.makedirs('.cache', exist_ok=True)
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(document, f)
+    document.dump(compact_path)
+
+    leaf = next(bookmark for bookmark in document.flatten_bookmarks() if bookmark.get_kps())
+    print(f'{len(document.knowledgepoints)} 个知识点, {sum(1 for _ in document.knowledgepoints.relations())} 个关系')
+    print(f'文件大小: pickle {os.path.getsize(pickle_path) / 1024:.1f}KB, 紧凑格式 {os.path.getsize(compact_path) / 1024:.1f}KB')
+    print(f'完整加载: pickle {timeit(lambda: Document.load(pickle_path, pdf)):.3f}s, '
+          f'紧凑格式 {timeit(lambda: Document.load(compact_path, pdf)):.3f}s')
+    print(f'只加载书签树: {timeit(lambda: DocumentFile(compact_path).get_bookmarks()):.3f}s')
+    print(f'只加载章节 "{leaf.title}": {timeit(lambda: DocumentFile(compact_path).get_chapter(leaf.id)):.3f}s')
@@ -56,4 +56,18 @@ def optimize_string_lengths(strings: list[str], n: int) -> list[str]:
     Returns:
         list[str]: 调整后的字符串数组
     """
-    pass
\ No newline at end of file
+    pass
+
+def chunk_by_tokens(chapters: list[list[str]], max_tokens: int, overlap: int = 0) -> list[list[str]]:
+    """ 按 token 预算切分多个章节 (并行执行, 释放 GIL): 在句子边界 (。！？；.!? 以及换行) 处切分,
+    token 数按中日韩字符约 1 个 token、其余字符约每 4 个为 1 个 token 估算, 超过预算的句子按字符切开
+
+    Args:
+        chapters (list[list[str]]): 每个章节的内容列表
+        max_tokens (int): 每个片段的最大 token 数
+        overlap (int, optional): 相邻片段重叠的最大 token 数, 以整句为单位. Defaults to 0.
+
+    Returns:
+        list[list[str]]: 每个章节的片段
+    """
+    pass
@@ -1,5 +1,6 @@
 use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
+use rayon::prelude::*;
 use regex::Regex;
 
 #[pyfunction]
@@ -88,17 +89,22 @@ pub fn find_longest_consecutive_sequence(nums: Vec<i32>) -> PyResult<(i32, i32)>
 
 #[pyfunction]
 pub fn optimize_string_lengths(s: Vec<String>, n: i32) -> PyResult<Vec<String>> {
+    let n = n as usize;
     let mut result: Vec<String> = Vec::new();
     let mut buffer = String::new();
+    let mut buffer_len = 0; // buffer 的字符数, 避免每次重新计数
 
     for string in s {
-        if string.chars().count() < n as usize {
+        let len = string.chars().count();
+        if len < n {
             buffer.push_str(&string);
             buffer.push_str("\n");
-            if buffer.chars().count() >= n as usize {
+            buffer_len += len + 1;
+            if buffer_len >= n {
                 let trimmed = buffer.trim_end().to_string();
                 result.push(trimmed);
                 buffer.clear();
+                buffer_len = 0;
             }
         } else {
             let sentences: Vec<&str> = string.split('。').collect();
@@ -107,11 +113,14 @@ pub fn optimize_string_lengths(s: Vec<String>, n: i32) -> PyResult<Vec<String>>
                 if i < sentences.len() - 1 {
                     current.push('。');
                 }
-                if current.chars().count() < n as usize {
+                let current_len = current.chars().count();
+                if current_len < n {
                     buffer.push_str(&current);
-                    if buffer.chars().count() >= n as usize {
+                    buffer_len += current_len;
+                    if buffer_len >= n {
                         result.push(buffer.clone());
                         buffer.clear();
+                        buffer_len = 0;
                     }
                 } else {
                     result.push(current);
@@ -125,3 +134,212 @@ pub fn optimize_string_lengths(s: Vec<String>, n: i32) -> PyResult<Vec<String>>
 
     Ok(result)
 }
+
+/// 中日韩字符及全角标点, 与 course_graph.llm.tokenizer 中的估算保持一致
+fn is_cjk(c: char) -> bool {
+    matches!(c, '\u{3000}'..='\u{303f}' | '\u{3400}'..='\u{4dbf}' | '\u{4e00}'..='\u{9fff}' | '\u{ff00}'..='\u{ffef}')
+}
+
+/// 估算的 token 计数: 中日韩字符约 1 个 token, 其余字符约每 4 个为 1 个 token
+#[derive(Clone, Copy, Default)]
+struct TokenCount {
+    cjk: usize,
+    other: usize,
+}
+
+impl TokenCount {
+    fn of(text: &str) -> Self {
+        let mut count = TokenCount::default();
+        for c in text.chars() {
+            count.push(c);
+        }
+        count
+    }
+
+    fn push(&mut self, c: char) {
+        if is_cjk(c) {
+            self.cjk += 1;
+        } else {
+            self.other += 1;
+        }
+    }
+
+    fn add(&mut self, other: TokenCount) {
+        self.cjk += other.cjk;
+        self.other += other.other;
+    }
+
+    fn sub(&mut self, other: TokenCount) {
+        self.cjk -= other.cjk;
+        self.other -= other.other;
+    }
+
+    fn tokens(&self) -> usize {
+        self.cjk + (self.other + 3) / 4
+    }
+}
+
+/// 按句子边界 (。！？；.!? 以及换行) 切分, 句子保留结尾的标点; 英文句号后需要是空白字符, 避免切分小数和缩写
+fn split_sentences(text: &str) -> Vec<&str> {
+    let mut sentences = Vec::new();
+    let mut start = 0;
+    let mut chars = text.char_indices().peekable();
+    while let Some((i, c)) = chars.next() {
+        let boundary = match c {
+            '。' | '！' | '？' | '；' | '!' | '?' | '\n' => true,
+            '.' => chars.peek().map_or(true, |(_, next)| next.is_whitespace()),
+            _ => false,
+        };
+        if boundary {
+            let end = i + c.len_utf8();
+            sentences.push(&text[start..end]);
+            start = end;
+        }
+    }
+    if start < text.len() {
+        sentences.push(&text[start..]);
+    }
+    sentences
+}
+
+/// 将超过预算的句子切开: 优先在逗号、顿号、冒号和空白字符处切分, 仍然超出预算的部分按字符切开
+fn split_long(sentence: &str, max_tokens: usize) -> Vec<(String, TokenCount)> {
+    let mut pieces = Vec::new();
+    let mut piece = String::new();
+    let mut count = TokenCount::default();
+    let mut clause = String::new();
+    let mut clause_count = TokenCount::default();
+    let mut flush = |clause: &mut String, clause_count: &mut TokenCount, piece: &mut String, count: &mut TokenCount| {
+        let mut next = *count;
+        next.add(*clause_count);
+        if next.tokens() > max_tokens && !piece.is_empty() {
+            pieces.push((std::mem::take(piece), *count));
+            *count = TokenCount::default();
+        }
+        if clause_count.tokens() > max_tokens {
+            // 单个子句超出预算, 按字符切开
+            for c in clause.chars() {
+                let mut next = *count;
+                next.push(c);
+                if next.tokens() > max_tokens && !piece.is_empty() {
+                    pieces.push((std::mem::take(piece), *count));
+                    *count = TokenCount::default();
+                }
+                piece.push(c);
+                count.push(c);
+            }
+        } else {
+            piece.push_str(clause);
+            count.add(*clause_count);
+        }
+        clause.clear();
+        *clause_count = TokenCount::default();
+    };
+    for c in sentence.chars() {
+        clause.push(c);
+        clause_count.push(c);
+        if matches!(c, '，' | '、' | '：' | ',' | ':') || c.is_whitespace() {
+            flush(&mut clause, &mut clause_count, &mut piece, &mut count);
+        }
+    }
+    flush(&mut clause, &mut clause_count, &mut piece, &mut count);
+    if !piece.is_empty() {
+        pieces.push((piece, count));
+    }
+    pieces
+}
+
+/// 切分一个章节: 依次加入句子直到超出 token 预算, 下一个片段以上一个片段末尾不超过 overlap 个 token 的句子开头
+fn chunk_contents(contents: &[String], max_tokens: usize, overlap: usize) -> Vec<String> {
+    let mut units: Vec<(String, TokenCount)> = Vec::new();
+    for content in contents {
+        let content = content.trim();
+        if content.is_empty() {
+            continue;
+        }
+        let sentences = split_sentences(content);
+        let last = sentences.len() - 1;
+        for (i, sentence) in sentences.into_iter().enumerate() {
+            // 不同内容之间使用换行分隔
+            let sentence = if i == last && !sentence.ends_with('\n') {
+                format!("{}\n", sentence)
+            } else {
+                sentence.to_string()
+            };
+            let count = TokenCount::of(&sentence);
+            if count.tokens() > max_tokens {
+                units.extend(split_long(&sentence, max_tokens));
+            } else {
+                units.push((sentence, count));
+            }
+        }
+    }
+
+    let mut chunks = Vec::new();
+    let mut window: std::collections::VecDeque<(String, TokenCount)> = std::collections::VecDeque::new();
+    let mut count = TokenCount::default(); // window 的 token 计数
+    let mut fresh = false; // window 中是否有尚未输出的句子
+    for (sentence, sentence_count) in units {
+        let mut next = count;
+        next.add(sentence_count);
+        if next.tokens() > max_tokens && fresh {
+            chunks.push(window.iter().map(|(s, _)| s.as_str()).collect::<String>().trim().to_string());
+            // 保留末尾的句子作为重叠部分
+            let mut kept = 0;
+            let mut kept_count = TokenCount::default();
+            for (_, c) in window.iter().rev() {
+                let mut next = kept_count;
+                next.add(*c);
+                if next.tokens() > overlap {
+                    break;
+                }
+                kept_count = next;
+                kept += 1;
+            }
+            while window.len() > kept {
+                window.pop_front();
+            }
+            count = kept_count;
+        }
+        // 重叠部分加上当前句子仍然超出预算时去掉重叠部分开头的句子
+        loop {
+            let mut next = count;
+            next.add(sentence_count);
+            if next.tokens() <= max_tokens || window.is_empty() {
+                break;
+            }
+            let (_, c) = window.pop_front().unwrap();
+            count.sub(c);
+        }
+        count.add(sentence_count);
+        window.push_back((sentence, sentence_count));
+        fresh = true;
+    }
+    if fresh {
+        chunks.push(window.iter().map(|(s, _)| s.as_str()).collect::<String>().trim().to_string());
+    }
+    chunks.retain(|chunk| !chunk.is_empty());
+    chunks
+}
+
+#[pyfunction]
+#[pyo3(signature = (chapters, max_tokens, overlap = 0))]
+pub fn chunk_by_tokens(
+    py: Python<'_>,
+    chapters: Vec<Vec<String>>,
+    max_tokens: usize,
+    overlap: usize,
+) -> PyResult<Vec<Vec<String>>> {
+    if max_tokens == 0 || overlap >= max_tokens {
+        return Err(PyValueError::new_err(
+            "max_tokens must be positive and greater than overlap",
+        ));
+    }
+    // 释放 GIL, 多个章节并行切分
+    Ok(py.allow_threads(|| {
+        chapters
+            .par_iter()
+            .map(|contents| chunk_contents(contents, max_tokens, overlap))
+            .collect()
+    }))
+}
@@ -13,5 +13,6 @@ fn course_graph_ext(m: &Bound<'_, PyModule>) -> PyResult<()> {
         m
     )?)?;
     m.add_function(wrap_pyfunction!(ext::common::optimize_string_lengths, m)?)?;
+    m.add_function(wrap_pyfunction!(ext::common::chunk_by_tokens, m)?)?;
     Ok(())
 }
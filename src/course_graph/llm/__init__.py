@@ -5,7 +5,9 @@
 # Description: 大模型接口
 
 from .ontology import ONTOLOGY
-from .llm import LLM, VLLM, Qwen, Ollama, OpenAI
-from .config import LLM_CONFIG, VLM_CONFIG
+from .llm import LLM, VLLM, Qwen, Ollama, OpenAI, LLMPool
+from .config import LLM_CONFIG, VLM_CONFIG, RATE_LIMIT_CONFIG
+from .limiter import RateLimiter, set_rate_limiter
 from .type import Database
 from .vlm import VLM
+from .usage import USAGE, UsageTracker, UsageSummary
@@ -27,3 +27,17 @@ class VLMConfig:
     temperature: int = 0.6  # 温度
 
 VLM_CONFIG = VLMConfig()
+
+@dataclass
+class RateLimitConfig:
+    requests_per_minute: float = 0  # 每个服务地址每分钟最多请求数, 0 表示不限制
+    tokens_per_minute: float = 0  # 每个服务地址每分钟最多 token 数 (输入+输出), 0 表示不限制
+    max_retries: int = 6  # 限流/服务端错误/超时的最大重试次数
+    retry_min_wait: float = 1  # 重试最短等待时间 (秒)
+    retry_max_wait: float = 60  # 重试最长等待时间 (秒), 实际等待时间为带随机抖动的指数退避
+    timeout: float = 120  # 单次请求超时时间 (秒)
+    max_concurrency: int = 16  # 最大并发请求数
+    min_concurrency: int = 1  # 最小并发请求数
+    latency_target: float = 30  # 请求延迟超过该值 (秒) 时视为过载, 减小并发
+
+RATE_LIMIT_CONFIG = RateLimitConfig()
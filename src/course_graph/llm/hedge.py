@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/05
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/llm/hedge.py
+# Description: 对冲请求 (hedged requests) 相关的延迟统计
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+@dataclass
+class HedgeStats:
+    """ 对冲统计
+    """
+    requests: int = 0  # 总请求数
+    hedged: int = 0  # 发出对冲请求的次数
+    hedge_wins: int = 0  # 对冲请求先返回的次数
+    saved: float = 0  # 对冲节省的时间 (秒), 以近期延迟中超过对冲返回时刻的均值估计原请求的完成时间
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0
+
+
+class Hedging:
+
+    def __init__(self,
+                 quantile: float = 0.95,
+                 window: int = 200,
+                 min_samples: int = 20,
+                 max_workers: int = 64) -> None:
+        """ 对冲配置: 请求超过近期延迟的 quantile 分位数仍未返回时, 再发出一个相同请求, 先返回者胜出
+
+        Args:
+            quantile (float, optional): 触发对冲的延迟分位数. Defaults to 0.95.
+            window (int, optional): 统计最近多少次请求的延迟. Defaults to 200.
+            min_samples (int, optional): 样本数不足时不对冲. Defaults to 20.
+            max_workers (int, optional): 发送请求的线程数. Defaults to 64.
+        """
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.stats = HedgeStats()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def observe(self, latency: float) -> None:
+        """ 记录单次请求的延迟, 对冲请求胜出时为原请求延迟的下界 (对冲返回时原请求已经等待的时间)
+
+        Args:
+            latency (float): 延迟 (秒)
+        """
+        with self.lock:
+            self.latencies.append(latency)
+
+    def delay(self) -> float | None:
+        """ 当前的对冲等待时间
+
+        Returns:
+            float | None: 等待时间, 样本不足时为 None
+        """
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.quantile))]
+
+    def record(self, hedged: bool, won: bool = False) -> None:
+        """ 记录一次请求
+
+        Args:
+            hedged (bool): 是否发出了对冲请求
+            won (bool, optional): 对冲请求是否先返回. Defaults to False.
+        """
+        with self.lock:
+            self.stats.requests += 1
+            self.stats.hedged += int(hedged)
+            self.stats.hedge_wins += int(won)
+
+    def record_saved(self, elapsed: float) -> None:
+        """ 对冲请求胜出时记录节省的时间。原请求已被中止, 其完成时间以近期延迟中超过 elapsed 的样本均值估计,
+        没有这样的样本时不计入
+
+        Args:
+            elapsed (float): 对冲请求返回时原请求已经等待的时间 (秒), 即对冲等待时间加上对冲请求的延迟
+        """
+        with self.lock:
+            slower = [latency for latency in self.latencies if latency > elapsed]
+            if slower:
+                self.stats.saved += sum(slower) / len(slower) - elapsed
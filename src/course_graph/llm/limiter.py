@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/02
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/llm/limiter.py
+# Description: 定义客户端限流与自适应并发控制
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from .config import RATE_LIMIT_CONFIG
+
+
+class TokenBucket:
+
+    def __init__(self, rate_per_minute: float) -> None:
+        """ 令牌桶, 容量为一分钟的配额
+
+        Args:
+            rate_per_minute (float): 每分钟补充的令牌数, 0 表示不限制
+        """
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1) -> None:
+        """ 获取令牌, 不足时阻塞等待
+
+        Args:
+            amount (float, optional): 令牌数量. Defaults to 1.
+        """
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)  # 超过容量的请求最多等待一个完整周期
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """ 按实际消耗修正令牌数 (正数为补扣, 负数为返还)
+
+        Args:
+            amount (float): 修正量
+        """
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+
+    def __init__(self,
+                 max_concurrency: int,
+                 min_concurrency: int = 1,
+                 latency_target: float = 30) -> None:
+        """ AIMD 自适应并发: 请求成功时加性增加并发上限, 出现限流、错误或延迟过高时乘性减小
+
+        Args:
+            max_concurrency (int): 最大并发数
+            min_concurrency (int, optional): 最小并发数. Defaults to 1.
+            latency_target (float, optional): 目标延迟 (秒). Defaults to 30.
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.limit: float = max_concurrency
+        self.inflight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.inflight >= max(int(self.limit), self.min_concurrency):
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self, latency: float, overload: bool = False) -> None:
+        """ 释放并发槽位并调整并发上限
+
+        Args:
+            latency (float): 本次请求耗时
+            overload (bool, optional): 是否出现限流、服务端错误或超时. Defaults to False.
+        """
+        with self.condition:
+            self.inflight -= 1
+            now = time.monotonic()
+            if overload or latency > self.latency_target:
+                # 同一批并发请求同时失败时只减小一次
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateLimiter:
+
+    def __init__(self,
+                 requests_per_minute: float = RATE_LIMIT_CONFIG.requests_per_minute,
+                 tokens_per_minute: float = RATE_LIMIT_CONFIG.tokens_per_minute,
+                 max_concurrency: int = RATE_LIMIT_CONFIG.max_concurrency,
+                 min_concurrency: int = RATE_LIMIT_CONFIG.min_concurrency,
+                 latency_target: float = RATE_LIMIT_CONFIG.latency_target) -> None:
+        """ 单个服务地址的限流器, 同时限制请求数、token 数和并发数
+
+        Args:
+            requests_per_minute (float, optional): 每分钟请求数. Defaults to RATE_LIMIT_CONFIG.requests_per_minute.
+            tokens_per_minute (float, optional): 每分钟 token 数. Defaults to RATE_LIMIT_CONFIG.tokens_per_minute.
+            max_concurrency (int, optional): 最大并发数. Defaults to RATE_LIMIT_CONFIG.max_concurrency.
+            min_concurrency (int, optional): 最小并发数. Defaults to RATE_LIMIT_CONFIG.min_concurrency.
+            latency_target (float, optional): 目标延迟 (秒). Defaults to RATE_LIMIT_CONFIG.latency_target.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, latency_target)
+
+    @contextmanager
+    def acquire(self, tokens: int) -> Iterator[dict]:
+        """ 获取一次请求的配额, 退出时根据结果调整并发与 token 配额
+
+        Args:
+            tokens (int): 预估消耗的 token 数
+
+        Yields:
+            dict: 请求状态, 可写入 `usage` (实际 token 数) 与 `overload` (是否过载)
+        """
+        self.requests.acquire()
+        self.tokens.acquire(tokens)
+        self.concurrency.acquire()
+        state = {'usage': None, 'overload': False}
+        start = time.monotonic()
+        try:
+            yield state
+        finally:
+            self.concurrency.release(time.monotonic() - start, state['overload'])
+            if state['usage'] is not None:
+                self.tokens.adjust(state['usage'] - tokens)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint: str) -> RateLimiter:
+    """ 获取服务地址对应的限流器, 访问同一地址的模型对象共享配额
+
+    Args:
+        endpoint (str): 服务地址
+
+    Returns:
+        RateLimiter: 限流器
+    """
+    with _limiters_lock:
+        if endpoint not in _limiters:
+            _limiters[endpoint] = RateLimiter()
+        return _limiters[endpoint]
+
+
+def set_rate_limiter(endpoint: str, limiter: RateLimiter) -> None:
+    """ 为服务地址单独设置限流器 (例如不同服务商的配额不同)
+
+    Args:
+        endpoint (str): 服务地址
+        limiter (RateLimiter): 限流器
+    """
+    with _limiters_lock:
+        _limiters[endpoint] = limiter
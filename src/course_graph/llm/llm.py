@@ -8,13 +8,26 @@ import openai
 from openai.types.chat import *
 from openai import NOT_GIVEN, NotGiven
 from abc import ABC
-from .config import LLM_CONFIG
+from .config import LLM_CONFIG, RATE_LIMIT_CONFIG
+from .limiter import RateLimiter, get_rate_limiter
+from .tokenizer import estimate_messages_tokens
+from .usage import USAGE
+from .hedge import Hedging, HedgeStats
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from loguru import logger
 import os
 import requests
 import subprocess
 import time
 import shlex
 import ollama
+import threading
+import random
+import contextvars
+from dataclasses import dataclass
 
 
 class LLM(ABC):
@@ -28,10 +41,13 @@ class LLM(ABC):
 
         self.model: str | None = None  # 需要在子类中额外初始化
         self.client: openai.OpenAI | None = None
+        self.limiter: RateLimiter | None = None  # 默认使用服务地址对应的共享限流器
+        self.hedging: Hedging | None = None  # 对冲请求, 默认关闭
 
         self.json: bool = False
         self.stop = None
         self.instruction = 'You are a helpful assistant.'
+        self.supports_n: bool = False  # 服务是否支持一次请求返回多个回答 (n 参数)
 
     def chat_completion(
         self,
@@ -39,7 +55,10 @@ class LLM(ABC):
         tools: list[ChatCompletionToolParam] | NotGiven = NOT_GIVEN,
         tool_choice: ChatCompletionToolChoiceOptionParam
         | NotGiven = NOT_GIVEN,
-        parallel_tool_calls: bool | NotGiven = NOT_GIVEN
+        parallel_tool_calls: bool | NotGiven = NOT_GIVEN,
+        tag: str = None,
+        schema: dict = None,
+        instruction: str = None
     ) -> ChatCompletionMessage:
         """ 基于message中保存的历史消息进行对话, 请在外部保存历史记录, LLM 对象不负责保存
 
@@ -48,14 +67,35 @@ class LLM(ABC):
             tools (list[ChatCompletionToolParam] | NotGiven, optional): 外部tools. Defaults to NOT_GIVEN.
             tool_choice: (ChatCompletionToolChoiceOptionParam | NotGiven, optional): 强制使用外部工具. Defaults to NOT_GIVEN.
             parallel_tool_calls: (bool | NotGiven, optional): 允许工具并行调用. Defaults to NOT_GIVEN.
+            tag (str, optional): 调用方标记, 用于统计用量, 默认使用 USAGE.scope 中的值. Defaults to None.
+            schema (dict, optional): 返回结果需要满足的 JSON schema, 由服务端约束解码. Defaults to None.
+            instruction (str, optional): 本次请求的系统指令, 多线程共享同一 LLM 对象时使用, 默认使用 self.instruction. Defaults to None.
 
         Returns:
             ChatCompletionMessage: 模型返回结果
         """
+        kwargs = self._chat_kwargs(messages, tools, tool_choice, parallel_tool_calls, schema, instruction)
+        return self._request(tag=tag, **kwargs).choices[0].message
+
+    def _chat_kwargs(
+        self,
+        messages: list[ChatCompletionMessageParam],
+        tools: list[ChatCompletionToolParam] | NotGiven = NOT_GIVEN,
+        tool_choice: ChatCompletionToolChoiceOptionParam
+        | NotGiven = NOT_GIVEN,
+        parallel_tool_calls: bool | NotGiven = NOT_GIVEN,
+        schema: dict = None,
+        instruction: str = None
+    ) -> dict:
+        """ 组合请求参数, 指令在此时读取
+
+        Returns:
+            dict: 请求参数
+        """
         # functions 废弃
         # 参考: https://platform.openai.com/docs/api-reference/chat/create
-        messages = [{'role': 'system', 'content': self.instruction}] + messages
-        return self.client.chat.completions.create(
+        messages = [{'role': 'system', 'content': instruction or self.instruction}] + messages
+        kwargs = dict(
             model=self.model,
             messages=messages,
             top_p=LLM_CONFIG.top_p,
@@ -74,20 +114,214 @@ class LLM(ABC):
             stop=self.stop,
             extra_body={
                 'top_k': LLM_CONFIG.top_k
-            }).choices[0].message
+            })
+        if schema is not None:
+            self._set_schema(kwargs, schema)
+        return kwargs
+
+    def _set_schema(self, kwargs: dict, schema: dict) -> None:
+        """ 设置约束解码参数, 不同服务的参数不同
+
+        Args:
+            kwargs (dict): 请求参数
+            schema (dict): JSON schema
+        """
+        kwargs['response_format'] = {
+            'type': 'json_schema',
+            'json_schema': {
+                'name': 'response',
+                'schema': schema
+            }
+        }
+
+    def _request(self, tag: str = None, **kwargs) -> ChatCompletion:
+        """ 发送请求, 负责限流/服务端错误/超时的带抖动指数退避重试, 并记录用量
+
+        Args:
+            tag (str, optional): 调用方标记. Defaults to None.
+
+        Returns:
+            ChatCompletion: 模型返回结果
+        """
+        start = time.time()
+        for attempt in Retrying(
+                stop=stop_after_attempt(RATE_LIMIT_CONFIG.max_retries + 1),
+                wait=wait_random_exponential(multiplier=RATE_LIMIT_CONFIG.retry_min_wait,
+                                             max=RATE_LIMIT_CONFIG.retry_max_wait),
+                retry=retry_if_exception(_is_retryable),
+                before_sleep=lambda state: logger.warning(
+                    f'请求失败, 第{state.attempt_number}次重试: {state.outcome.exception()!r}'),
+                reraise=True):
+            with attempt:
+                response = self._create_hedged(**kwargs) if self.hedging else self._create(**kwargs)
+        USAGE.record(model=kwargs['model'],
+                     prompt_tokens=response.usage.prompt_tokens if response.usage else 0,
+                     completion_tokens=response.usage.completion_tokens if response.usage else 0,
+                     latency=time.time() - start,  # 包含重试等待
+                     tag=tag)
+        return response
+
+    def _create(self, **kwargs) -> ChatCompletion:
+        """ 单次请求, 子类可以重写以改变请求发往的服务地址
+
+        Returns:
+            ChatCompletion: 模型返回结果
+        """
+        return self._send(self.client, **kwargs)
+
+    def set_hedging(self, quantile: float = 0.95, window: int = 200, min_samples: int = 20) -> 'LLM':
+        """ 开启对冲请求: 请求超过近期延迟的 quantile 分位数仍未返回时, 向另一个连接 (LLMPool 中为另一个副本) 发出相同请求, 先返回者胜出
+
+        Args:
+            quantile (float, optional): 触发对冲的延迟分位数. Defaults to 0.95.
+            window (int, optional): 统计最近多少次请求的延迟. Defaults to 200.
+            min_samples (int, optional): 样本数不足时不对冲. Defaults to 20.
+
+        Returns:
+            LLM: 模型自身
+        """
+        self.hedging = Hedging(quantile=quantile, window=window, min_samples=min_samples)
+        return self
+
+    @property
+    def hedge_stats(self) -> HedgeStats | None:
+        """ 对冲统计: 对冲率、对冲胜出次数与节省的时间
+        """
+        return self.hedging.stats if self.hedging else None
+
+    def _create_hedged(self, **kwargs) -> ChatCompletion:
+        """ 带对冲的单次请求, 原请求和对冲请求各自使用独立的连接, 落后的一方被关闭连接以中止生成
+
+        Returns:
+            ChatCompletion: 先返回的结果
+        """
+        hedging = self.hedging
+        delay = hedging.delay()
+        start = time.time()
+        send, cancel = self._hedge_target(**kwargs)
+        primary = hedging.executor.submit(send)
+        try:
+            response = primary.result(timeout=delay)
+            hedging.observe(time.time() - start)
+            hedging.record(hedged=False)
+            return response
+        except FutureTimeoutError:
+            pass
+
+        hedge_send, hedge_cancel = self._hedge_target(**kwargs)
+        secondary = hedging.executor.submit(hedge_send)
+        done, _ = wait([primary, secondary], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None:  # 先返回的失败了则等待另一个
+            winner = secondary if winner is primary else primary
+            wait([winner])
+        elapsed = time.time() - start
+        if winner is primary:
+            hedge_cancel()
+            hedging.record(hedged=True)
+        else:
+            cancel()
+            hedging.record_saved(elapsed)
+            hedging.record(hedged=True, won=True)
+        if winner.exception() is None:
+            # 对冲胜出时以此作为被中止的原请求延迟的下界, 否则最慢的请求永远不会进入统计, 对冲等待时间会越来越短
+            hedging.observe(elapsed)
+        return winner.result()
+
+    def _hedge_target(self, **kwargs) -> tuple[Callable[[], ChatCompletion], Callable[[], None]]:
+        """ 构造使用独立连接的请求, 关闭连接即可中止, 请求完成后连接随之关闭
+
+        Returns:
+            tuple[Callable[[], ChatCompletion], Callable[[], None]]: 发送函数, 取消函数
+        """
+        client = _client(str(self.client.base_url), self.client.api_key)
+
+        def send() -> ChatCompletion:
+            try:
+                return self._send(client, **kwargs)
+            finally:
+                client.close()
+
+        return send, client.close
+
+    def _send(self, client: openai.OpenAI, **kwargs) -> ChatCompletion:
+        """ 使用指定客户端发送单次请求, 负责限流与自适应并发
+
+        Args:
+            client (openai.OpenAI): 客户端
 
-    def chat(self, message: str) -> str:
+        Returns:
+            ChatCompletion: 模型返回结果
+        """
+        limiter = self.limiter or get_rate_limiter(str(client.base_url))
+        tokens = estimate_messages_tokens(kwargs['messages']) + kwargs.get('max_tokens', 0) * kwargs.get('n', 1)
+        with limiter.acquire(tokens) as state:
+            try:
+                response = client.chat.completions.create(**kwargs)
+            except Exception as e:
+                state['overload'] = _is_retryable(e) and not client.is_closed()  # 被取消的对冲请求不算过载
+                raise e
+            if response.usage:
+                state['usage'] = response.usage.total_tokens
+        return response
+
+    def chat(self, message: str, tag: str = None, schema: dict = None, instruction: str = None) -> str:
         """ 模型的单轮对话
 
         Args:
             message (str): 用户输入
+            tag (str, optional): 调用方标记, 用于统计用量. Defaults to None.
+            schema (dict, optional): 返回结果需要满足的 JSON schema. Defaults to None.
+            instruction (str, optional): 本次请求的系统指令, 默认使用 self.instruction. Defaults to None.
 
         Returns:
             str | ChatCompletionMessage: 模型输出
         """
-        response = self.chat_completion(messages=[{'role': 'user', 'content': message}])
+        response = self.chat_completion(messages=[{'role': 'user', 'content': message}],
+                                        tag=tag,
+                                        schema=schema,
+                                        instruction=instruction)
         return response.content
 
+    def chat_n(self, message: str, n: int, tag: str = None, schema: dict = None, instruction: str = None) -> list[str]:
+        """ 对同一输入采样 n 个回答。服务支持 n 参数时只发送一次请求 (只需一次预填充), 否则并发发送 n 次请求
+
+        Args:
+            message (str): 用户输入
+            n (int): 采样数量
+            tag (str, optional): 调用方标记, 用于统计用量. Defaults to None.
+            schema (dict, optional): 返回结果需要满足的 JSON schema. Defaults to None.
+            instruction (str, optional): 本次请求的系统指令, 默认使用 self.instruction. Defaults to None.
+
+        Returns:
+            list[str]: n 个模型输出
+        """
+        kwargs = self._chat_kwargs([{'role': 'user', 'content': message}], schema=schema, instruction=instruction)
+        if n == 1:
+            return [self._request(tag=tag, **kwargs).choices[0].message.content]
+        if self.supports_n:
+            response = self._request(tag=tag, n=n, **kwargs)
+            return [choice.message.content for choice in response.choices]
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self._request, tag, **kwargs) for _ in range(n)]
+            return [future.result().choices[0].message.content for future in futures]
+
+
+def _is_retryable(e: BaseException) -> bool:
+    """ 限流 (429)、服务端错误 (5xx)、超时与连接错误可以重试
+    """
+    return isinstance(e, (openai.RateLimitError, openai.InternalServerError,
+                          openai.APITimeoutError, openai.APIConnectionError))
+
+
+def _client(base_url: str | None, api_key: str | None) -> openai.OpenAI:
+    """ 创建客户端, 重试交给 LLM._request 处理
+    """
+    return openai.OpenAI(api_key=api_key,
+                         base_url=base_url,
+                         timeout=RATE_LIMIT_CONFIG.timeout,
+                         max_retries=0)
+
 
 class OpenAI(LLM):
 
@@ -106,10 +340,8 @@ class OpenAI(LLM):
         super().__init__()
 
         self.model = name
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-        )
+        self.client = _client(base_url, api_key)
+        self.supports_n = True
 
 
 class Qwen(OpenAI):
@@ -128,6 +360,20 @@ class Qwen(OpenAI):
             name=name,
             base_url='https://dashscope.aliyuncs.com/compatible-mode/v1',
             api_key=api_key)
+        self.supports_n = False  # DashScope 兼容接口不支持 n
+
+    def _set_schema(self, kwargs: dict, schema: dict) -> None:
+        # DashScope 兼容接口只支持 json_object, schema 需要在提示词中说明
+        kwargs['response_format'] = {'type': 'json_object'}
+
+
+def _probe(url: str, timeout: float = 2) -> bool:
+    """ 健康检查, 返回 200 视为服务可用
+    """
+    try:
+        return requests.get(url, timeout=timeout).status_code == 200
+    except requests.RequestException:
+        return False
 
 
 class Serve:
@@ -136,39 +382,73 @@ class Serve:
                  command_list: list[str],
                  test_url: str,
                  log: bool = True,
-                 timeout: int = 30):
-        """ 启动服务
+                 timeout: int = 30,
+                 models_url: str = None,
+                 model: str = None,
+                 attach: bool = True,
+                 detach: bool = False):
+        """ 启动服务, 如果地址上已有健康的服务则直接复用
 
         Args:
             command_list (list[str]): 命令列表
             test_url (str): 测试地址
             log (bool, optional): 输出控制台日志. Defaults to True.
             timeout (int, optional): 超时时间. Defaults to 30.
+            models_url (str, optional): 模型列表地址 (/v1/models), 就绪时需包含 model. Defaults to None.
+            model (str, optional): 服务需要加载的模型. Defaults to None.
+            attach (bool, optional): 已有健康服务时复用而不启动新进程. Defaults to True.
+            detach (bool, optional): 服务进程脱离当前 Python 进程, close() 时不关闭, 后续运行可以直接复用. Defaults to False.
 
         Raises:
             TimeoutError: 服务启动超时
+            RuntimeError: 端口被加载了其它模型的服务占用, 或服务进程启动后退出
         """
+        self.process: subprocess.Popen | None = None
+        self.detach = detach
+        self.test_url = test_url
+        self.models_url = models_url
+        self.served_model = model
+
+        if attach and _probe(test_url, timeout=1):
+            if self._ready():
+                logger.info(f'复用已启动的服务: {test_url}')
+                return
+            raise RuntimeError(f'{test_url} 上的服务未加载模型 {model}')
+
         self.process = subprocess.Popen(
             command_list,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        ) if not log else subprocess.Popen(command_list) 
+            stdout=None if log else subprocess.DEVNULL,
+            stderr=None if log else subprocess.DEVNULL,
+            start_new_session=detach)
 
+        # 指数退避探测, 模型加载完成后可以尽快检测到
         start_time = time.time()
+        interval = 0.05
         while time.time() - start_time < timeout:
-            try:
-                response = requests.get(test_url)
-                if response.status_code == 200:
-                    return
-            except requests.ConnectionError:
-                pass
-            time.sleep(1)
+            if self.process.poll() is not None:
+                raise RuntimeError(f'服务进程已退出, 返回码 {self.process.returncode}')
+            if _probe(test_url, timeout=1) and self._ready():
+                return
+            time.sleep(interval)
+            interval = min(interval * 2, 1)
         raise TimeoutError
 
+    def _ready(self) -> bool:
+        """ 检查模型列表中是否包含需要的模型
+        """
+        if self.models_url is None or self.served_model is None:
+            return True
+        try:
+            response = requests.get(self.models_url, timeout=2)
+            return response.status_code == 200 and any(
+                m.get('id') == self.served_model for m in response.json().get('data', []))
+        except (requests.RequestException, ValueError):
+            return False
+
     def close(self):
-        """ 关闭服务
+        """ 关闭服务, 复用的服务与脱离的服务不会被关闭
         """
-        if self.process:
+        if self.process and not self.detach:
             self.process.terminate()
             self.process.wait()
 
@@ -188,7 +468,9 @@ class VLLM(LLM, Serve):
                  port: int = 9017,
                  starting_command: str = None,
                  timeout: int = 60,
-                 log: bool = True):
+                 log: bool = True,
+                 attach: bool = True,
+                 detach: bool = False):
         """ 使用VLLM加载模型
 
         Args:
@@ -198,6 +480,8 @@ class VLLM(LLM, Serve):
             port (int, optional): 服务端口. Defaults to 9017.
             log (bool, optional): 输出控制台日志. Defaults to True.
             starting_command (str, optional): VLLM启动命令 (适合于需要自定义template的情况), 也可以使用默认命令, LLMConfig中的配置会自动加入. Defaults to None.
+            attach (bool, optional): 端口上已有加载了该模型的健康服务时直接复用. Defaults to True.
+            detach (bool, optional): 服务进程在 Python 进程退出后继续运行, 后续运行可以在数秒内复用. Defaults to False.
         """
         LLM.__init__(self)
 
@@ -214,6 +498,7 @@ class VLLM(LLM, Serve):
                                             --max-model-len {str(LLM_CONFIG.max_model_len)}\
                                             --enable-auto-tool-choice\
                                             --tool-call-parser hermes\
+                                            --enable-prefix-caching\
                                             --disable-log-requests""")
         else:
             command_list = shlex.split(starting_command)
@@ -231,6 +516,8 @@ class VLLM(LLM, Serve):
                 command_list.extend(
                     ["--max-model-len",
                      str(LLM_CONFIG.max_model_len)])
+            if "--enable-prefix-caching" not in command_list:
+                command_list.append("--enable-prefix-caching")
             try:
                 idx = command_list.index('--host')
                 self.host = command_list[idx + 1]
@@ -246,10 +533,17 @@ class VLLM(LLM, Serve):
                        command_list=command_list,
                        timeout=timeout,
                        log=log,
-                       test_url=f'http://{self.host}:{self.port}/health')
+                       test_url=f'http://{self.host}:{self.port}/health',
+                       models_url=f'http://{self.host}:{self.port}/v1/models',
+                       model=self.model,
+                       attach=attach,
+                       detach=detach)
+
+        self.client = _client(f'http://{self.host}:{self.port}/v1', 'EMPTY')
+        self.supports_n = True
 
-        self.client = openai.OpenAI(
-            api_key='EMPTY', base_url=f'http://{self.host}:{self.port}/v1')
+    def _set_schema(self, kwargs: dict, schema: dict) -> None:
+        kwargs['extra_body'] = {**kwargs['extra_body'], 'guided_json': schema}
 
 
 class Ollama(LLM, Serve):
@@ -259,7 +553,9 @@ class Ollama(LLM, Serve):
                  *,
                  host: str = 'localhost',
                  port: int = 9017,
-                 timeout: int = 60):
+                 timeout: int = 60,
+                 attach: bool = True,
+                 detach: bool = False):
         """ ollama模型服务
 
         Args:
@@ -267,6 +563,8 @@ class Ollama(LLM, Serve):
             timeout (int, optional): 启动服务超时时间. Defaults to 60.
             host (str, optional): 服务地址. Defaults to 'localhost'.
             port (int, optional): 服务端口. Defaults to 9017.
+            attach (bool, optional): 端口上已有健康服务时直接复用. Defaults to True.
+            detach (bool, optional): 服务进程在 Python 进程退出后继续运行. Defaults to False.
         """
         LLM.__init__(self)
         self.model = name
@@ -281,8 +579,140 @@ class Ollama(LLM, Serve):
         Serve.__init__(self,
                        command_list=['ollama', 'serve'],
                        timeout=timeout,
-                       test_url=f'http://{self.host}:{self.port}')
-        self.client = openai.OpenAI(
-            api_key='EMPTY',
-            base_url=f'http://{self.host}:{self.port}/v1',
-        )
+                       test_url=f'http://{self.host}:{self.port}',
+                       attach=attach,
+                       detach=detach)
+        self.client = _client(f'http://{self.host}:{self.port}/v1', 'EMPTY')
+
+
+@dataclass
+class Replica:
+    """ 服务副本
+    """
+    base_url: str
+    client: openai.OpenAI
+    health_url: str
+    inflight: int = 0  # 正在处理的请求数
+    failures: int = 0  # 连续失败次数
+    healthy: bool = True
+
+
+class LLMPool(LLM):
+
+    def __init__(self,
+                 name: str,
+                 base_urls: list[str],
+                 *,
+                 api_key: str = 'EMPTY',
+                 health_interval: float = 10,
+                 max_failures: int = 3):
+        """ 多副本模型服务 (例如多个 VLLM 实例), 每个请求发往正在处理请求数最少的健康副本
+
+        Args:
+            name (str): 模型名称
+            base_urls (list[str]): 各副本的地址, 例如 http://localhost:9017/v1
+            api_key (str, optional): API key. Defaults to 'EMPTY'.
+            health_interval (float, optional): 健康检查间隔 (秒), 0 表示不检查. Defaults to 10.
+            max_failures (int, optional): 连续失败多少次后剔除副本, 剔除的副本在健康检查通过后恢复. Defaults to 3.
+        """
+        super().__init__()
+        self.model = name
+        self.replicas = [
+            Replica(base_url=url,
+                    client=_client(url, api_key),
+                    health_url=url.rstrip('/').removesuffix('/v1') + '/health')
+            for url in base_urls
+        ]
+        self.client = self.replicas[0].client
+        self.supports_n = True
+        self.max_failures = max_failures
+        self.lock = threading.Lock()
+
+        self._closed = threading.Event()
+        if health_interval > 0:
+            threading.Thread(target=self._health_check, args=(health_interval, ), daemon=True).start()
+
+    def _health_check(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            for replica in self.replicas:
+                healthy = _probe(replica.health_url)
+                with self.lock:
+                    if healthy and not replica.healthy:
+                        logger.info(f'副本已恢复: {replica.base_url}')
+                    elif not healthy and replica.healthy:
+                        logger.warning(f'副本健康检查失败, 已剔除: {replica.base_url}')
+                    replica.healthy = healthy
+                    if healthy:
+                        replica.failures = 0
+
+    def _acquire(self, exclude: set[str] = None) -> Replica:
+        """ 选择正在处理请求数最少的健康副本, 没有健康副本时在全部副本中选择
+
+        Args:
+            exclude (set[str], optional): 尽量避开的副本地址. Defaults to None.
+
+        Returns:
+            Replica: 副本
+        """
+        with self.lock:
+            candidates = [r for r in self.replicas if r.healthy] or self.replicas
+            candidates = [r for r in candidates if r.base_url not in (exclude or ())] or candidates
+            least = min(r.inflight for r in candidates)
+            replica = random.choice([r for r in candidates if r.inflight == least])
+            replica.inflight += 1
+            return replica
+
+    def _release(self, replica: Replica, error: BaseException | None) -> None:
+        with self.lock:
+            replica.inflight -= 1
+            if error is None:
+                replica.failures = 0
+            elif isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+                replica.failures += 1
+                if replica.failures >= self.max_failures and replica.healthy:
+                    replica.healthy = False
+                    logger.warning(f'副本连续失败 {replica.failures} 次, 已剔除: {replica.base_url}')
+
+    def _create(self, **kwargs) -> ChatCompletion:
+        replica = self._acquire()
+        error = None
+        try:
+            return self._send(replica.client, **kwargs)
+        except Exception as e:
+            error = e
+            raise e
+        finally:
+            self._release(replica, error)
+
+    def _hedge_target(self, **kwargs) -> tuple[Callable[[], ChatCompletion], Callable[[], None]]:
+        # 原请求所在副本的请求数已经加一, 对冲请求自然会被路由到其它副本
+        clients: list[openai.OpenAI] = []
+        cancelled = threading.Event()
+
+        def send() -> ChatCompletion:
+            replica = self._acquire()
+            client = _client(replica.base_url, replica.client.api_key)
+            clients.append(client)
+            if cancelled.is_set():  # 发送之前已被取消
+                client.close()
+            error = None
+            try:
+                return self._send(client, **kwargs)
+            except Exception as e:
+                error = e
+                raise e
+            finally:
+                self._release(replica, None if client.is_closed() else error)
+                client.close()
+
+        def cancel() -> None:
+            cancelled.set()
+            for client in clients:
+                client.close()
+
+        return send, cancel
+
+    def close(self) -> None:
+        """ 停止健康检查
+        """
+        self._closed.set()
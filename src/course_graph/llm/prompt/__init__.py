@@ -1,4 +1,4 @@
-from .extract_prompt import ExamplePromptGenerator, ExtractPromptGenerator
+from .extract_prompt import ExamplePromptGenerator, ExtractPromptGenerator, JSONSchemaPromptGenerator
 from .prompt_strategy import ExamplePromptStrategy, SentenceEmbeddingStrategy
 from .vl_prompt import VLPromptGenerator
 from .parser_prompt import ParserPromptGenerator
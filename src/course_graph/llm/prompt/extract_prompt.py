@@ -9,6 +9,9 @@ import re
 import json
 from .prompt_strategy import ExamplePromptStrategy
 from ..ontology import ONTOLOGY
+from ..config import LLM_CONFIG
+from ..tokenizer import estimate_tokens
+from loguru import logger
 
 
 class ExtractPromptGenerator(ABC):
@@ -73,6 +76,83 @@ class ExtractPromptGenerator(ABC):
         """
         raise NotImplementedError
 
+    def get_best_attrs_prompt(self, items: list[tuple[str, str, list[str]]]) -> tuple[str, str]:
+        """ 要求模型一次为多个 (实体, 属性) 分别总结一个最佳的值, 返回 {"序号": "属性值"}
+
+        Args:
+            items (list[tuple[str, str, list[str]]]): (实体名称, 属性, 属性值列表) 列表, 序号从 0 开始
+
+        Raises:
+            NotImplementedError: 子类需要实现该方法才能批量总结
+
+        Returns:
+            tuple[str, str]: 组合后的提示词, 指令
+        """
+        raise NotImplementedError
+
+    def get_best_attrs_schema(self, n: int) -> dict | None:
+        """ 批量属性总结返回结果的 JSON schema
+
+        Args:
+            n (int): 批量大小
+
+        Returns:
+            dict | None: JSON schema, 不使用约束解码时为 None
+        """
+        return None
+
+    def get_joint_prompt(self, content: str) -> tuple[str, str]:
+        """ 获取一次性抽取实体、属性和关系的提示词, 返回 {"entities": {}, "attributes": {}, "relations": []}
+
+        Args:
+            content (str): 待抽取的文本内容
+
+        Raises:
+            NotImplementedError: 子类需要实现该方法才能使用联合抽取
+
+        Returns:
+            tuple[str, str]: 组合后的提示词, 指令
+        """
+        raise NotImplementedError
+
+    def get_joint_schema(self) -> dict | None:
+        """ 联合抽取返回结果的 JSON schema, 用于约束解码
+
+        Returns:
+            dict | None: JSON schema, None 表示不约束
+        """
+        return None
+
+    def get_ner_schema(self) -> dict | None:
+        """ 实体抽取返回结果的 JSON schema, 用于约束解码
+
+        Returns:
+            dict | None: JSON schema, None 表示不约束
+        """
+        return None
+
+    def get_re_schema(self, entities: list[str]) -> dict | None:
+        """ 关系抽取返回结果的 JSON schema, 用于约束解码
+
+        Args:
+            entities: (list[str]): 实体列表
+
+        Returns:
+            dict | None: JSON schema, None 表示不约束
+        """
+        return None
+
+    def get_ae_schema(self, entities: list[str]) -> dict | None:
+        """ 属性抽取返回结果的 JSON schema, 用于约束解码
+
+        Args:
+            entities: (list[str]): 实体列表
+
+        Returns:
+            dict | None: JSON schema, None 表示不约束
+        """
+        return None
+
     @abstractmethod
     def post_process(self, response: str) -> list | dict:
         """ 将模型返回处理成列表或字典格式
@@ -129,7 +209,7 @@ class ExamplePromptGenerator(ExtractPromptGenerator):
             "examples": examples,
             "input": content
         }
-        return json.dumps(prompt, indent=4, ensure_ascii=False), "你是专门进行实体抽取的专家"
+        return self._build(self._customize(prompt, 'ner'), "你是专门进行实体抽取的专家")
 
     def get_re_prompt(self, content: str,
                       entities: list[str]) -> tuple[str, str]:
@@ -163,7 +243,7 @@ class ExamplePromptGenerator(ExtractPromptGenerator):
             "examples": examples,
             "input": f"实体列表为: {entities}, 文本片段为: '{content}'"
         }
-        return json.dumps(prompt, indent=4, ensure_ascii=False), "你是专门进行关系判别的专家"
+        return self._build(self._customize(prompt, 're'), "你是专门进行关系判别的专家")
 
     def get_ae_prompt(self, content: str,
                       entities: list[str]) -> tuple[str, str]:
@@ -185,7 +265,24 @@ class ExamplePromptGenerator(ExtractPromptGenerator):
             "examples": examples,
             "input": f"实体列表为: {entities}, 文本片段为: '{content}'"
         }
-        return json.dumps(prompt, indent=4, ensure_ascii=False), "你是专门进行属性抽取的专家"
+        return self._build(self._customize(prompt, 'ae'), "你是专门进行属性抽取的专家")
+
+    def get_joint_prompt(self, content: str) -> tuple[str, str]:
+        prompt = {
+            "instruction":
+                "请对input的内容进行总结, 从中抽取出符合schema类型的实体, 再根据文本片段抽取这些实体的属性值 (属性范围只能来源于attributes) 以及实体两两之间的关系 (关系范围只能来源于relations, 头尾实体不应该相同)。最后请给出你的总结和抽取结果, 返回的格式为 ```json\n{\"entities\": {\"entity_type1\": [\"entity1\", \"entity2\"]}, \"attributes\": {\"entity1\": {\"attribute1\": \"value\"}}, \"relations\": [{\"head\": \"\", \"relation\": \"\", \"tail\": \"\"}]}\n```",
+            "schema": ONTOLOGY.entities,
+            "attributes": ONTOLOGY.attributes,
+            "relations": ONTOLOGY.relations,
+            "examples": [{
+                "input":
+                    "神经网络的学习的目的是找到使损失函数的值尽可能小的参数。这是寻找最优参数的问题, 解决这个问题的过程称为最优化（optimization）。遗憾的是, 神经网络的最优化问题非常难。这是因为参数空间非常复杂, 无法轻易找到最优解（无法使用那种通过解数学式一下子就求得最小值的方法）。\n而且, 在深度神经网络中, 参数的数量非常庞大, 导致最优化问题更加复杂。在前几章中, 为了找到最优参数, 我们将参数的梯度（导数）作为了线索。使用参数的梯度, 沿梯度方向更新参数, 并重复这个步骤多次, 从而逐渐靠近最优参数, 这个过程称为随机梯度下降法（stochastic gradient descent）, 简称SGD。\nSGD是一个简单的方法, 不过比起胡乱地搜索参数空间, 也算是“聪明”的方法。但是, 根据不同的问题, 也存在比SGD更加聪明的方法。本节我们将指出SGD的缺点, 并介绍SGD以外的其他最优化方法。",
+                "output":
+                    "这段文字介绍了神经网络的学习就是参数最优化的过程, 并且通常使用随机梯度下降法来寻找最优参数, 随机梯度下降法是最优化的一种方法。抽取结果为```json\n{\"entities\": {\"知识点\": [\"最优化\", \"随机梯度下降法\"]}, \"attributes\": {\"最优化\": {\"定义\": \"寻找神经网络最优参数的过程\"}, \"随机梯度下降法\": {\"定义\": \"使用参数的梯度, 沿梯度方向更新参数, 并重复这个步骤多次, 从而逐渐靠近最优参数\"}}, \"relations\": [{\"head\": \"最优化\", \"relation\": \"包含\", \"tail\": \"随机梯度下降法\"}]}\n```"
+            }],
+            "input": content
+        }
+        return self._build(self._customize(prompt, 'joint'), "你是专门进行知识抽取的专家")
 
     def get_best_attr_prompt(self, entity: str, attr: str,
                              values: list[str]) -> tuple[str, str]:
@@ -203,7 +300,77 @@ class ExamplePromptGenerator(ExtractPromptGenerator):
             "input":
                 f"实体为: '{entity}', 属性为: '{attr}', 属性值列表为: {values}"
         }
-        return json.dumps(prompt, indent=4, ensure_ascii=False), "你是专门进行属性判别的专家"
+        return self._build(self._customize(prompt, 'best_attr'), "你是专门进行属性判别的专家")
+
+    def get_best_attrs_prompt(self, items: list[tuple[str, str, list[str]]]) -> tuple[str, str]:
+        prompt = {
+            "instruction":
+                "请根据每个实体的属性对应的值列表, 分别总结出一个最佳的属性值。返回的格式为 ```json\n{\"id1\": \"value\", \"id2\": \"value\"}\n```, 每个id都需要返回",
+            "examples": [{
+                "input": [{
+                    "id": 0,
+                    "entity": "Numpy",
+                    "attribute": "定义",
+                    "values": [
+                        "NumPy提供了许多用于操作多维数组的便捷方法, 常与Python一起用于数据分析和科学计算。",
+                        "NumPy是一个用于Python编程语言的科学计算库, 它提供了强大的N维数组对象, 以及大量的数学函数来操作这些数组。"
+                    ]
+                }, {
+                    "id": 1,
+                    "entity": "损失函数",
+                    "attribute": "定义",
+                    "values": ["表示神经网络性能的“恶劣程度”的指标", "神经网络的学习中所用的指标"]
+                }],
+                "output":
+                    "```json\n{\"0\": \"NumPy是一个用于Python编程语言的科学计算库, 提供了强大的N维数组对象以及操作多维数组的便捷方法, 常用于数据分析和科学计算。\", \"1\": \"神经网络的学习中所用的指标, 表示神经网络性能的“恶劣程度”\"}\n```"
+            }],
+            "input": [{"id": i, "entity": entity, "attribute": attr, "values": values}
+                      for i, (entity, attr, values) in enumerate(items)]
+        }
+        return self._build(self._customize(prompt, 'best_attrs'), "你是专门进行属性判别的专家")
+
+    def _customize(self, prompt: dict, stage: str) -> dict:
+        """ 子类可以在序列化之前修改提示词
+
+        Args:
+            prompt (dict): 提示词
+            stage (str): ner/re/ae/best_attr/best_attrs/joint
+
+        Returns:
+            dict: 修改后的提示词
+        """
+        return prompt
+
+    @staticmethod
+    def _build(prompt: dict, instruction: str) -> tuple[str, str]:
+        """ 紧凑序列化提示词。input 位于最后, 使 input 之前的指令、schema 与静态示例逐字节相同, 可以命中前缀缓存;
+        超出 token 预算 (上下文长度减去生成长度) 时依次去掉最后的示例, 仍然超出则截断输入
+
+        Args:
+            prompt (dict): 提示词, 必须包含 examples 和 input 并以 input 结尾
+            instruction (str): 指令
+
+        Returns:
+            tuple[str, str]: 组合后的提示词, 指令
+        """
+        budget = LLM_CONFIG.max_model_len - LLM_CONFIG.max_tokens - estimate_tokens(instruction)
+        prompt = dict(prompt)
+        text = _dumps(prompt)
+        while prompt['examples'] and estimate_tokens(text) > budget:
+            prompt['examples'] = prompt['examples'][:-1]
+            text = _dumps(prompt)
+        if estimate_tokens(text) > budget:
+            input_: str = prompt['input']
+            low, high = 0, len(input_)
+            while low < high:  # 二分查找能放下的最长输入
+                mid = (low + high + 1) // 2
+                if estimate_tokens(_dumps({**prompt, 'input': input_[:mid]})) <= budget:
+                    low = mid
+                else:
+                    high = mid - 1
+            logger.warning(f'提示词超出 token 预算 {budget}, 输入被截断为 {low}/{len(input_)} 个字符')
+            text = _dumps({**prompt, 'input': input_[:low]})
+        return text, instruction
 
     def post_process(self, response: str) -> list | dict | None:
         """ 将模型返回处理成列表或字典格式
@@ -225,3 +392,150 @@ class ExamplePromptGenerator(ExtractPromptGenerator):
                 return res
             except json.decoder.JSONDecodeError:
                 return None
+
+
+def _dumps(prompt: dict) -> str:
+    """ 紧凑且确定的序列化, 相同内容总是得到相同的字节
+    """
+    return json.dumps(prompt, ensure_ascii=False, separators=(',', ':'))
+
+
+class JSONSchemaPromptGenerator(ExamplePromptGenerator):
+
+    instructions = {
+        'ner': "请从input中抽取出符合schema类型的实体。直接返回JSON, 格式为 {\"entity_type1\": [\"entity1\", \"entity2\"]}",
+        're': "请根据文本片段判断实体列表中两两实体间的关系, 关系只能来源于relations, 头尾实体不应该相同, 无关系则不返回。直接返回JSON, 格式为 {\"relations\": [{\"head\": \"\", \"relation\": \"\", \"tail\": \"\"}]}",
+        'ae': "请对输入的实体列表根据已有文本片段各自抽取他们的属性值。属性范围只能来源于提供的attributes, 属性值可以是你根据原文进行的总结, 如果实体没有能够总结的属性值则不返回。直接返回JSON, 格式为 {\"entity1\": {\"attribute1\": \"value\"}}",
+        'best_attrs': "请根据每个实体的属性对应的值列表, 分别总结出一个最佳的属性值。直接返回JSON, 格式为 {\"id1\": \"value\", \"id2\": \"value\"}, 每个id都需要返回",
+        'joint': "请从input中抽取出符合schema类型的实体, 以及这些实体的属性值 (属性范围只能来源于attributes) 和实体两两之间的关系 (关系范围只能来源于relations, 头尾实体不应该相同)。直接返回JSON, 格式为 {\"entities\": {\"entity_type1\": [\"entity1\"]}, \"attributes\": {\"entity1\": {\"attribute1\": \"value\"}}, \"relations\": [{\"head\": \"\", \"relation\": \"\", \"tail\": \"\"}]}"
+    }
+
+    def __init__(self, strategy: ExamplePromptStrategy = None, max_entities: int = 7) -> None:
+        """ 约束解码的抽取提示词: 返回结果的 JSON schema 由 ONTOLOGY 生成并交给服务端约束解码 (VLLM guided_json / OpenAI json_schema),
+        不再输出思考过程, 也不会出现无法解析的返回
+
+        Args:
+            strategy (ExamplePromptStrategy, optional): 动态检索提示词策略. Defaults to None.
+            max_entities (int, optional): 每种类型最多抽取的实体数量. Defaults to 7.
+        """
+        super().__init__(strategy)
+        self.max_entities = max_entities
+
+    def _customize(self, prompt: dict, stage: str) -> dict:
+        if stage not in self.instructions:
+            return prompt
+        examples = []
+        for example in prompt['examples']:
+            # 示例中的思考过程和代码块去掉, 只保留 JSON
+            output = ExamplePromptGenerator.post_process(self, example['output'])
+            if output is None:
+                continue
+            if stage == 're':
+                output = {'relations': output}
+            examples.append({'input': example['input'], 'output': _dumps(output)})
+        return {**prompt, 'instruction': self.instructions[stage], 'examples': examples}
+
+    def get_ner_schema(self) -> dict:
+        return {
+            'type': 'object',
+            'properties': {
+                entity_type: {
+                    'type': 'array',
+                    'items': {'type': 'string'},
+                    'maxItems': self.max_entities
+                } for entity_type in ONTOLOGY.entities
+            },
+            'additionalProperties': False
+        }
+
+    def get_joint_schema(self) -> dict:
+        return {
+            'type': 'object',
+            'properties': {
+                'entities': self.get_ner_schema(),
+                'attributes': {
+                    'type': 'object',
+                    'additionalProperties': {
+                        'type': 'object',
+                        'properties': {attr: {'type': 'string'} for attr in ONTOLOGY.attributes},
+                        'additionalProperties': False
+                    }
+                },
+                'relations': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'head': {'type': 'string'},
+                            'relation': {'type': 'string', 'enum': list(ONTOLOGY.relations)},
+                            'tail': {'type': 'string'}
+                        },
+                        'required': ['head', 'relation', 'tail'],
+                        'additionalProperties': False
+                    }
+                }
+            },
+            'required': ['entities', 'attributes', 'relations'],
+            'additionalProperties': False
+        }
+
+    def get_best_attrs_schema(self, n: int) -> dict:
+        return {
+            'type': 'object',
+            'properties': {str(i): {'type': 'string'} for i in range(n)},
+            'required': [str(i) for i in range(n)],
+            'additionalProperties': False
+        }
+
+    def get_re_schema(self, entities: list[str]) -> dict:
+        # 根对象必须是 object (OpenAI json_schema 的要求)
+        return {
+            'type': 'object',
+            'properties': {
+                'relations': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'head': {'type': 'string', 'enum': entities},
+                            'relation': {'type': 'string', 'enum': list(ONTOLOGY.relations)},
+                            'tail': {'type': 'string', 'enum': entities}
+                        },
+                        'required': ['head', 'relation', 'tail'],
+                        'additionalProperties': False
+                    }
+                }
+            },
+            'required': ['relations'],
+            'additionalProperties': False
+        }
+
+    def get_ae_schema(self, entities: list[str]) -> dict:
+        return {
+            'type': 'object',
+            'properties': {
+                entity: {
+                    'type': 'object',
+                    'properties': {attr: {'type': 'string'} for attr in ONTOLOGY.attributes},
+                    'additionalProperties': False
+                } for entity in entities
+            },
+            'additionalProperties': False
+        }
+
+    def post_process(self, response: str) -> list | dict | None:
+        """ 解析约束解码的 JSON 返回, 服务端不支持约束解码时退回到从代码块中提取
+
+        Args:
+            response (str): 模型输出
+
+        Returns:
+            list | dict | None: 格式输出
+        """
+        try:
+            res = json.loads(response)
+        except json.decoder.JSONDecodeError:
+            res = super().post_process(response)
+        if isinstance(res, dict) and set(res.keys()) == {'relations'} and isinstance(res['relations'], list):
+            return res['relations']
+        return res
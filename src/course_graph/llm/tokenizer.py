@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/02
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/llm/tokenizer.py
+# Description: token 数量估算
+
+import re
+
+_CJK = re.compile('[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """ 不加载分词器快速估算 token 数: 中日韩字符及全角标点约 1 个 token, 其余字符约每 4 个为 1 个 token
+
+    Args:
+        text (str): 文本
+
+    Returns:
+        int: 估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_messages_tokens(messages: list[dict]) -> int:
+    """ 估算对话消息的 token 数 (包含每条消息的模板开销)
+
+    Args:
+        messages (list[dict]): 消息列表
+
+    Returns:
+        int: 估算的 token 数
+    """
+    total = 0
+    for message in messages:
+        content = message.get('content') or ''
+        if not isinstance(content, str):  # 多模态消息
+            content = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+        total += estimate_tokens(content) + 4
+    return total
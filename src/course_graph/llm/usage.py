@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/03
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/llm/usage.py
+# Description: 统计大模型调用的 token、延迟与费用
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+_document: ContextVar[str | None] = ContextVar('usage_document', default=None)
+_tag: ContextVar[str | None] = ContextVar('usage_tag', default=None)
+
+
+@dataclass
+class UsageRecord:
+    """ 单次调用记录
+    """
+    model: str
+    tag: str  # 调用方: ner/ae/re/best_attr/ocr_fix/outline/agent ...
+    document: str | None
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    time: float = field(default_factory=time.time)
+
+
+@dataclass
+class UsageSummary:
+    """ 汇总结果
+    """
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0  # 累计耗时
+    cost: float = 0
+
+    def add(self, record: UsageRecord, cost: float) -> None:
+        self.calls += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.latency += record.latency
+        self.cost += cost
+
+    def merge(self, other: 'UsageSummary', cost: float) -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.latency += other.latency
+        self.cost += cost
+
+
+class UsageTracker:
+
+    def __init__(self, max_records: int = 1000) -> None:
+        """ 统计所有 LLM/VLM 调用, 可按文档、调用方、模型汇总, 并导出为 Prometheus 文本格式。
+        每次调用累加到 (模型, 调用方, 文档) 的计数中, 只保留最近的若干条调用记录, 长时间运行时内存占用不随调用次数增长
+
+        Args:
+            max_records (int, optional): 保留的最近调用记录数. Defaults to 1000.
+        """
+        self.records: deque[UsageRecord] = deque(maxlen=max_records)  # 最近的调用记录
+        self.counters: dict[tuple[str, str, str | None], UsageSummary] = {}  # (模型, 调用方, 文档) -> 累计计数, 不含费用
+        self.prices: dict[str, tuple[float, float]] = {}
+        self.lock = threading.Lock()
+
+    def set_price(self, model: str, prompt: float, completion: float) -> None:
+        """ 设置模型价格, 用于估算费用
+
+        Args:
+            model (str): 模型名称
+            prompt (float): 每千输入 token 价格
+            completion (float): 每千输出 token 价格
+        """
+        self.prices[model] = (prompt, completion)
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt, completion = self.prices.get(model, (0, 0))
+        return (prompt_tokens * prompt + completion_tokens * completion) / 1000
+
+    def record(self,
+               model: str,
+               prompt_tokens: int,
+               completion_tokens: int,
+               latency: float,
+               tag: str | None = None) -> UsageRecord:
+        """ 记录一次调用, 未指定调用方时使用当前 scope 中的值
+
+        Args:
+            model (str): 模型名称
+            prompt_tokens (int): 输入 token 数
+            completion_tokens (int): 输出 token 数
+            latency (float): 耗时 (秒)
+            tag (str, optional): 调用方. Defaults to None.
+
+        Returns:
+            UsageRecord: 调用记录
+        """
+        record = UsageRecord(model=model,
+                             tag=tag or _tag.get() or 'other',
+                             document=_document.get(),
+                             prompt_tokens=prompt_tokens,
+                             completion_tokens=completion_tokens,
+                             latency=latency)
+        with self.lock:
+            self.records.append(record)
+            self.counters.setdefault((record.model, record.tag, record.document), UsageSummary()).add(record, 0)
+        return record
+
+    @contextmanager
+    def scope(self, document: str = None, tag: str = None) -> Iterator[None]:
+        """ 在作用域内的调用自动带上文档名称和调用方
+
+        Args:
+            document (str, optional): 文档名称. Defaults to None.
+            tag (str, optional): 调用方. Defaults to None.
+        """
+        tokens = []
+        if document is not None:
+            tokens.append((_document, _document.set(document)))
+        if tag is not None:
+            tokens.append((_tag, _tag.set(tag)))
+        try:
+            yield
+        finally:
+            for var, token in reversed(tokens):
+                var.reset(token)
+
+    def summary(self, by: tuple[str, ...] = ('document', 'tag'), **filters) -> dict[tuple, UsageSummary]:
+        """ 按指定字段汇总所有调用 (不限于保留的调用记录), 费用按当前价格计算
+
+        Args:
+            by (tuple[str, ...], optional): 分组字段, 可选 model/tag/document. Defaults to ('document', 'tag').
+            **filters: 字段过滤条件, 可选 model/tag/document, 例如 document='深度学习入门'
+
+        Returns:
+            dict[tuple, UsageSummary]: 分组键到汇总结果
+        """
+        res: dict[tuple, UsageSummary] = {}
+        with self.lock:
+            counters = [(key, replace(counter)) for key, counter in self.counters.items()]
+        for (model, tag, document), counter in counters:
+            fields = {'model': model, 'tag': tag, 'document': document}
+            if any(fields[k] != v for k, v in filters.items()):
+                continue
+            key = tuple(fields[k] for k in by)
+            res.setdefault(key, UsageSummary()).merge(
+                counter, self.cost(model, counter.prompt_tokens, counter.completion_tokens))
+        return res
+
+    def total(self, **filters) -> UsageSummary:
+        """ 总计
+
+        Returns:
+            UsageSummary: 汇总结果
+        """
+        return self.summary(by=(), **filters).get((), UsageSummary())
+
+    def reset(self) -> None:
+        """ 清空记录和计数
+        """
+        with self.lock:
+            self.records.clear()
+            self.counters.clear()
+
+    def to_prometheus(self) -> str:
+        """ 导出为 Prometheus 文本格式
+
+        Returns:
+            str: 指标文本
+        """
+        metrics = [
+            ('calls_total', 'LLM/VLM calls', lambda s: s.calls),
+            ('prompt_tokens_total', 'Prompt tokens', lambda s: s.prompt_tokens),
+            ('completion_tokens_total', 'Completion tokens', lambda s: s.completion_tokens),
+            ('latency_seconds_total', 'Accumulated call latency in seconds', lambda s: s.latency),
+            ('cost_total', 'Estimated cost', lambda s: s.cost),
+        ]
+        by = ('model', 'tag', 'document')
+        groups = self.summary(by=by)
+        lines = []
+        for name, help_, value in metrics:
+            lines.append(f'# HELP course_graph_llm_{name} {help_}')
+            lines.append(f'# TYPE course_graph_llm_{name} counter')
+            for key, s in groups.items():
+                labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(by, key))
+                lines.append(f'course_graph_llm_{name}{{{labels}}} {value(s)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump_prometheus(self, path: str) -> None:
+        """ 写入文件 (可用于 node_exporter textfile collector)
+
+        Args:
+            path (str): 文件路径
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+
+    def serve_prometheus(self, port: int = 9108, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """ 在后台线程启动 /metrics 接口
+
+        Args:
+            port (int, optional): 端口. Defaults to 9108.
+            host (str, optional): 地址. Defaults to '0.0.0.0'.
+
+        Returns:
+            ThreadingHTTPServer: 服务对象, 调用 shutdown() 关闭
+        """
+        tracker = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = tracker.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+USAGE = UsageTracker()
@@ -5,6 +5,8 @@
 # Description: 定义图文理解模型类
 
 from .config import VLM_CONFIG
+from .usage import USAGE
+import time
 import torch
 from modelscope import AutoModel, AutoTokenizer
 from PIL import Image
@@ -29,6 +31,7 @@ class VLM:
         Args:
             path (str, optional): 模型名称或路径
         """
+        self.path = path
         self.model = AutoModel.from_pretrained(
             path, trust_remote_code=True,
             torch_dtype=torch.float16).eval().cuda()
@@ -36,20 +39,29 @@ class VLM:
                                                        trust_remote_code=True)
         self.instruction = 'You are a helpful assistant.'
 
-    def chat(self, image_paths: str | list[str], message: str) -> str:
+    def chat(self, image_paths: str | list[str], message: str, tag: str = None) -> str:
         """ 图片问答
 
         Args:
             image_paths (str | list[str]): 多张图片
             message (str): 用户输入
+            tag (str, optional): 调用方标记, 用于统计用量. Defaults to None.
 
 
         Returns:
             str: 模型输出
         """
-        return self.model.chat(image=None,
-                               msgs=get_msgs(image_paths, message),
-                               tokenizer=self.tokenizer,
-                               sampling=True,
-                               temperature=VLM_CONFIG.temperature,
-                               sys_prompt=self.instruction)
+        start = time.time()
+        response = self.model.chat(image=None,
+                                   msgs=get_msgs(image_paths, message),
+                                   tokenizer=self.tokenizer,
+                                   sampling=True,
+                                   temperature=VLM_CONFIG.temperature,
+                                   sys_prompt=self.instruction)
+        # 只统计文本部分, 图片 token 数取决于模型的切图策略
+        USAGE.record(model=self.path,
+                     prompt_tokens=len(self.tokenizer.encode(self.instruction + message)),
+                     completion_tokens=len(self.tokenizer.encode(response)),
+                     latency=time.time() - start,
+                     tag=tag)
+        return response
@@ -7,6 +7,9 @@
 from .pdf_parser import PDFParser
 from .docx_parser import DOCXParser
 from .document import Document
+from .storage import DocumentFile
+from .dedup import NearDuplicateIndex
+from .canonical import KPCanonicalizer
 from .type import BookMark
 from .parser import Parser
 from .type import Page
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/17
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/canonical.py
+# Description: 基于句嵌入近邻检索的知识点规范化 (合并同义知识点)
+
+import faiss
+from loguru import logger
+from sentence_transformers import SentenceTransformer
+from .entity import KPEntity
+from .registry import KPRegistry
+
+
+class KPCanonicalizer:
+
+    def __init__(self,
+                 embed_model: SentenceTransformer | str,
+                 threshold: float = 0.9,
+                 k: int = 5,
+                 attribute: str = '定义',
+                 batch_size: int = 64,
+                 hnsw_m: int = 32) -> None:
+        """ 知识点规范化: 批量计算知识点名称和定义的句嵌入, 使用 faiss HNSW 索引查找近邻,
+        余弦相似度不低于阈值且类型相同的知识点合并到先出现的知识点中。
+        索引在多次调用之间保留, 每次只嵌入和检索新出现的知识点, 可以在多个文档之间共享
+
+        Args:
+            embed_model (SentenceTransformer | str): 嵌入模型或模型路径
+            threshold (float, optional): 余弦相似度阈值. Defaults to 0.9.
+            k (int, optional): 每个知识点检索的近邻数量. Defaults to 5.
+            attribute (str, optional): 作为定义与名称一起嵌入的属性. Defaults to '定义'.
+            batch_size (int, optional): 嵌入的批大小. Defaults to 64.
+            hnsw_m (int, optional): HNSW 索引每个节点的连接数. Defaults to 32.
+        """
+        self.embed_model = SentenceTransformer(embed_model) if isinstance(embed_model, str) else embed_model
+        self.threshold = threshold
+        self.k = k
+        self.attribute = attribute
+        self.batch_size = batch_size
+        self.hnsw_m = hnsw_m
+        self.index: faiss.Index | None = None
+        self.ids: list[str] = []  # 索引中的行号 -> 知识点 id
+        self.indexed: set[str] = set()
+        self.canonical: dict[str, str] = {}  # 已合并的知识点 id -> 保留的知识点 id
+
+    def _text(self, kp: KPEntity) -> str:
+        definition = kp.best_attributes.get(self.attribute) or next(iter(kp.attributes.get(self.attribute, [])), '')
+        return f'{kp.name}: {definition}' if definition else kp.name
+
+    def _resolve(self, id_: str) -> str:
+        while id_ in self.canonical:
+            id_ = self.canonical[id_]
+        return id_
+
+    def find_duplicates(self, registry: KPRegistry) -> dict[str, KPEntity]:
+        """ 查找注册表中新出现的知识点与已有知识点 (包括同一批中先出现的知识点) 的重复
+
+        Args:
+            registry (KPRegistry): 知识点注册表
+
+        Returns:
+            dict[str, KPEntity]: 重复知识点 id -> 保留的知识点, 可以直接传给 KPRegistry.merge
+        """
+        new = [kp for kp in registry if kp.id not in self.indexed]
+        if not new:
+            return {}
+        vectors = self.embed_model.encode([self._text(kp) for kp in new],
+                                          batch_size=self.batch_size,
+                                          normalize_embeddings=True,
+                                          convert_to_numpy=True).astype('float32')
+        if self.index is None:
+            self.index = faiss.IndexHNSWFlat(vectors.shape[1], self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        start = len(self.ids)
+        # 先加入索引再检索, 同一批中的重复也能找到; 只合并到行号更小 (先出现) 的知识点
+        self.index.add(vectors)
+        self.ids.extend(kp.id for kp in new)
+        self.indexed.update(kp.id for kp in new)
+        similarities, rows = self.index.search(vectors, self.k + 1)
+
+        by_id = {kp.id: kp for kp in registry}
+        mapping: dict[str, KPEntity] = {}
+        for offset, kp in enumerate(new):
+            for similarity, row in sorted(zip(similarities[offset], rows[offset]), key=lambda pair: -pair[0]):
+                if row < 0 or row >= start + offset or similarity < self.threshold:
+                    continue
+                target = by_id.get(self._resolve(self.ids[row]))
+                if target is not None and target.id != kp.id and target.type == kp.type:
+                    mapping[kp.id] = target
+                    self.canonical[kp.id] = target.id
+                    logger.info(f'合并知识点: {kp.name} -> {target.name} (相似度 {similarity:.3f})')
+                    break
+        return mapping
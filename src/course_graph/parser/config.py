@@ -9,6 +9,8 @@ from dataclasses import dataclass, field
 
 @dataclass
 class Config:
+    chunk_tokens: int = 400  # 知识抽取时每个片段的最大 token 数 (估算值)
+    chunk_overlap: int = 0  # 相邻片段重叠的最大 token 数
     ignore_page: list[str] = field(default_factory=lambda: [
         '封面', 
         '封面页', 
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/10
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/consistency.py
+# Description: 自我一致性采样与投票, 支持序贯提前停止
+
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+
+
+@dataclass
+class SamplingStats:
+    """ 采样统计
+    """
+    votes: int = 0  # 投票次数
+    budget: int = 0  # 固定采样时需要的采样数
+    drawn: int = 0  # 实际采样数
+
+    @property
+    def saved(self) -> int:
+        return self.budget - self.drawn
+
+
+class SelfConsistencySampler:
+
+    def __init__(self,
+                 samples: int = 5,
+                 top: float = 0.5,
+                 early_stop: bool = True,
+                 max_samples: int = None,
+                 margin: float = 0.1) -> None:
+        """ 自我一致性采样: 出现次数超过 top * samples 的候选被采纳。
+        开启提前停止时分批采样, 所有候选 (包括尚未出现的) 是否被采纳都已确定时停止;
+        指定 max_samples 时, samples 次采样后仍有候选的得票率与 top 相差不超过 margin 则继续采样直到 max_samples
+
+        Args:
+            samples (int, optional): 采样次数. Defaults to 5.
+            top (float, optional): 采纳比例, 范围为 [0, 1]. Defaults to 0.5.
+            early_stop (bool, optional): 是否提前停止. Defaults to True.
+            max_samples (int, optional): 投票接近时最多采样次数. Defaults to None.
+            margin (float, optional): 判断投票接近的范围. Defaults to 0.1.
+        """
+        self.samples = samples
+        self.top = top
+        self.early_stop = early_stop
+        self.max_samples = max_samples
+        self.margin = margin
+        self.stats = SamplingStats()
+        self.lock = threading.Lock()
+
+    def sample(self,
+               draw: Callable[[int], list[Any]],
+               candidates: Callable[[Any], list[Hashable]]) -> tuple[list[Hashable], list[Any]]:
+        """ 采样并投票
+
+        Args:
+            draw (Callable[[int], list[Any]]): 采样 k 次, 返回每次的解析结果
+            candidates (Callable[[Any], list[Hashable]]): 单次结果中的候选, 重复的候选只计一票
+
+        Returns:
+            tuple[list[Hashable], list[Any]]: 采纳的候选 (按首次出现顺序), 所有采样结果
+        """
+        threshold = self.samples * self.top
+        counts: Counter = Counter()
+        results: list = []
+        # 至少需要 int(threshold) + 1 票才可能被采纳
+        k = min(self.samples, int(threshold) + 1) if self.early_stop else self.samples
+        while k > 0:
+            for result in draw(k):
+                results.append(result)
+                counts.update(dict.fromkeys(candidates(result), 1))
+            remaining = self.samples - len(results)
+            if remaining <= 0 or not self.early_stop:
+                break
+            undecided = [n for n in counts.values() if n <= threshold < n + remaining]
+            if undecided:
+                k = min(remaining, min(int(threshold) + 1 - n for n in undecided))
+            else:
+                # 尚未出现的候选剩余采样全部投票也无法被采纳时停止
+                k = max(0, remaining - int(threshold))
+
+        while self.max_samples and len(results) < self.max_samples and any(
+                abs(n / len(results) - self.top) <= self.margin for n in counts.values()):
+            for result in draw(1):
+                results.append(result)
+                counts.update(dict.fromkeys(candidates(result), 1))
+
+        bar = threshold if len(results) <= self.samples else self.top * len(results)
+        with self.lock:
+            self.stats.votes += 1
+            self.stats.budget += self.samples
+            self.stats.drawn += len(results)
+        return [c for c, n in counts.items() if n > bar], results
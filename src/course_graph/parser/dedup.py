@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/16
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/dedup.py
+# Description: 基于 MinHash LSH 的近似重复片段检测
+
+import threading
+import zlib
+from typing import Any
+import numpy as np
+from .registry import normalize_name
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK = np.uint64((1 << 32) - 1)
+
+
+def _optimal_bands(threshold: float, num_perm: int) -> tuple[int, int]:
+    """ 选择 LSH 的分段数和每段行数, 使相似度阈值两侧的加权误判概率最小。
+    候选会再用签名确认, 假阳性只多一次比较, 假阴性则多一次抽取, 所以假阴性的权重更高
+
+    Args:
+        threshold (float): 相似度阈值
+        num_perm (int): 签名长度
+
+    Returns:
+        tuple[int, int]: 分段数, 每段行数
+    """
+    xs = np.linspace(0, 1, 201)
+    best, best_error = (num_perm, 1), float('inf')
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        probability = 1 - (1 - xs ** rows) ** bands  # 相似度为 x 的两个片段成为候选的概率
+        error = np.mean(np.where(xs < threshold, 0.1 * probability, 0.9 * (1 - probability)))
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateIndex:
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle: int = 5, seed: int = 0) -> None:
+        """ 片段的 MinHash LSH 索引: 片段规范化后按字符 shingle 计算 MinHash 签名, 分段分桶查找候选,
+        再用签名估计的 Jaccard 相似度确认。可以在多个文档之间共享, 线程安全
+
+        Args:
+            threshold (float, optional): 相似度阈值, 估计的 Jaccard 相似度不低于该值视为近似重复. Defaults to 0.8.
+            num_perm (int, optional): 签名长度, 越长估计越准确. Defaults to 128.
+            shingle (int, optional): 字符 shingle 长度. Defaults to 5.
+            seed (int, optional): 随机数种子. Defaults to 0.
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.bands, self.rows = _optimal_bands(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        # 哈希函数族 (a * x + b) mod p, x 为 32 位, a 和 b 小于 2^29 时乘积不会溢出
+        self.a = rng.integers(1, 1 << 29, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 29, num_perm, dtype=np.uint64)
+        self.buckets: list[dict[bytes, list[int]]] = [{} for _ in range(self.bands)]
+        self.signatures: list[np.ndarray] = []
+        self.values: list[Any] = []
+        self.queries = 0  # 查询次数
+        self.hits = 0  # 找到近似重复的次数
+        self.lock = threading.Lock()
+
+    def signature(self, text: str) -> np.ndarray:
+        """ 计算 MinHash 签名
+
+        Args:
+            text (str): 文本
+
+        Returns:
+            np.ndarray: 签名
+        """
+        text = normalize_name(text)
+        n = max(1, len(text) - self.shingle + 1)
+        shingles = {text[i:i + self.shingle] for i in range(n)}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % _PRIME & _MASK).min(axis=1)
+
+    def _keys(self, signature: np.ndarray) -> list[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def get_or_add(self, text: str, value: Any) -> Any | None:
+        """ 查找近似重复的片段, 找到时返回其对应的值, 否则将片段和值加入索引
+
+        Args:
+            text (str): 片段内容
+            value (Any): 片段对应的值, 例如抽取结果
+
+        Returns:
+            Any | None: 最相似的近似重复片段对应的值, 不存在时为 None
+        """
+        signature = self.signature(text)
+        keys = self._keys(signature)
+        with self.lock:
+            self.queries += 1
+            candidates = {row for band, key in zip(self.buckets, keys) for row in band.get(key, ())}
+            best, similarity = None, self.threshold
+            for row in sorted(candidates):  # 相似度相同时取最先加入的片段
+                if (estimate := float(np.mean(self.signatures[row] == signature))) >= similarity:
+                    best, similarity = row, estimate + 1e-9
+            if best is not None:
+                self.hits += 1
+                return self.values[best]
+            row = len(self.signatures)
+            self.signatures.append(signature)
+            self.values.append(value)
+            for band, key in zip(self.buckets, keys):
+                band.setdefault(key, []).append(row)
+            return None
+
+    def discard(self, value: Any) -> bool:
+        """ 从索引中移除值对应的片段, 例如抽取失败的片段, 之后的近似重复片段不再复用它
+
+        Args:
+            value (Any): get_or_add 时传入的值
+
+        Returns:
+            bool: 是否找到并移除
+        """
+        with self.lock:
+            # 移除的多是最近加入的片段, 从后向前查找
+            row = next((row for row in range(len(self.values) - 1, -1, -1) if self.values[row] is value), None)
+            if row is None:
+                return False
+            for band, key in zip(self.buckets, self._keys(self.signatures[row])):
+                band[key].remove(row)
+                if not band[key]:
+                    del band[key]
+            self.values[row] = None
+            return True
+
+    @property
+    def skip_rate(self) -> float:
+        """ 找到近似重复的查询比例
+        """
+        return self.hits / self.queries if self.queries else 0
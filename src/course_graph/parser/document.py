@@ -4,22 +4,33 @@
 # File Name: course_graph/parser/document.py
 # Description: 定义文档以及抽取知识图谱相关方法
 
-from ..llm import LLM, ONTOLOGY
+from ..llm import LLM, ONTOLOGY, USAGE
+from ..llm.usage import UsageSummary
 from ..llm.prompt import ExtractPromptGenerator, ExamplePromptGenerator
-import shortuuid
 from loguru import logger
-from collections import Counter
 from typing import TYPE_CHECKING, Union
-import random
 import pickle
 import os
 from .config import config
 from .utils import instance_method_transactional
 from ..resource import ResourceMap
-from .type import BookMark
+from .type import BookMark, BookmarkIndex, ChunkFailure, Extraction, ExtractionReport
 from .entity import KPEntity, KPRelation
+from .registry import KPRegistry, normalize_name
+from .storage import dump_document, load_document, is_document_file
+from .extract import extract_chunk
+from .consistency import SelfConsistencySampler
+from .journal import ExtractionJournal, content_hash
+from .estimate import ExtractionEstimate, ExtractionEstimator
+from .pipeline import ChunkScheduler
+from .dedup import NearDuplicateIndex
+from .canonical import KPCanonicalizer
+from .ids import document_id, entity_id, relation_id
 from tqdm import tqdm
-from course_graph_ext import optimize_string_lengths
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from course_graph_ext import chunk_by_tokens
 
 if TYPE_CHECKING:
     from .parser import Parser
@@ -32,72 +43,93 @@ class Document:
         Args:
             parser (Parser): 对应的解析器
         """
-        self.id ='0:' + str(shortuuid.uuid())
+        self.id = document_id(parser.file_path)
         self.name = os.path.basename(parser.file_path).split('.')[0]
         self.parser = parser
         self.file_path = parser.file_path
         self.bookmarks = parser.get_bookmarks()
 
-        self.knowledgepoints: list[KPEntity] = []  # 全局共享状态
+        self.knowledgepoints: KPRegistry = KPRegistry()  # 全局共享状态
+        self.chunk_records: dict[str, list[tuple[str, Extraction]]] = {}  # 书签 id -> 每个片段的 (内容哈希, 抽取结果)
         self.checkpoint = {
             'extract_index': 0
         }
 
     def dump(self, path: str) -> None:
-        """ 序列化 Document 对象
+        """ 序列化 Document 对象, 使用带版本号的紧凑格式 (见 storage.py), 不包含 parser 属性
 
         Args:
             path: 保存路径
         """
-        with open(path, 'wb') as f:
-            pickle.dump(self, f)
+        dump_document(self, path)
 
     def __getstate__(self):
         """ 自定义序列化方法
         """
         state = self.__dict__.copy()
-        # 移除 parser 属性
+        # 移除 parser 属性和书签索引
         del state['parser']
+        state.pop('_bookmark_index', None)
         return state
 
+    def __setstate__(self, state):
+        """ 自定义反序列化方法, 兼容旧版本保存的 bookmarks 属性以及没有片段记录的文档
+        """
+        if 'bookmarks' in state:
+            state['_bookmarks'] = state.pop('bookmarks')
+        state.setdefault('chunk_records', {})
+        self.__dict__.update(state)
+
     @staticmethod
     def load(path: str, parser: 'Parser') -> 'Document':
-        """ 反序列化 Document 对象，不包含parser属性
+        """ 反序列化 Document 对象，不包含parser属性。兼容旧版本使用 pickle 保存的文件。
+        只需要书签树或者单个章节时使用 DocumentFile 按需加载
 
         Args:
             path: 文件路径
         """
+        if is_document_file(path):
+            return load_document(path, parser)
         with open(path, 'rb') as f:
             document: Document = pickle.load(f)
             document.parser = parser
+            if isinstance(document.knowledgepoints, list):  # 兼容旧版本保存的列表
+                document.knowledgepoints = KPRegistry(document.knowledgepoints)
             return document
 
+    @property
+    def bookmarks(self) -> list[BookMark]:
+        return self._bookmarks
+
+    @bookmarks.setter
+    def bookmarks(self, bookmarks: list[BookMark]) -> None:
+        self._bookmarks = bookmarks
+        self._bookmark_index = None
+
+    @property
+    def bookmark_index(self) -> BookmarkIndex:
+        """ 书签索引, 第一次使用时构建。直接修改书签树结构后需要调用 invalidate_bookmark_index
+
+        Returns:
+            BookmarkIndex: 书签索引
+        """
+        if getattr(self, '_bookmark_index', None) is None:
+            self._bookmark_index = BookmarkIndex(self.bookmarks)
+        return self._bookmark_index
+
+    def invalidate_bookmark_index(self) -> None:
+        """ 书签树结构改变后使书签索引失效
+        """
+        self._bookmark_index = None
+
     def flatten_bookmarks(self) -> list[BookMark]:
-        """ 将 bookmark 的树状结构扁平化，以便快速查找
+        """ 将 bookmark 的树状结构扁平化 (先序遍历)，以便快速查找
 
         Returns:
             list[BookMark]: 书签列表
         """
-        res: list[BookMark] = []
+        return list(self.bookmark_index.flat)
 
-        def get_bookmark(node:Union[Document, BookMark]):
-            match node:
-                case Document():
-                    for bookmark in node.bookmarks:
-                        res.append(bookmark)
-                        get_bookmark(bookmark)
-                case BookMark():
-                    for sub in node.subs:
-                        match sub:
-                            case BookMark():
-                                res.append(sub)
-                                get_bookmark(sub)
-                            case _:
-                                pass
-        get_bookmark(self)
-        return res
-
-    @logger.catch
     def set_knowledgepoints_by_llm(
             self,
             llm: LLM,
@@ -105,7 +137,19 @@ class Document:
             self_consistency: bool = False,
             samples: int = 5,
             top: float = 0.5,
-            checkpoint: bool = False) -> None:
+            early_stop: bool = True,
+            max_samples: int = None,
+            checkpoint: bool = False,
+            joint: bool = False,
+            workers: int = 1,
+            journal: str = None,
+            attr_batch_size: int = 20,
+            incremental: bool = False,
+            parse_workers: int = 0,
+            queue_size: int = None,
+            retry_workers: int = None,
+            dedup: NearDuplicateIndex = None,
+            canonicalizer: KPCanonicalizer = None) -> ExtractionReport:
         """ 使用 LLM 抽取知识点存储到 BookMark 中
 
         Args:
@@ -114,172 +158,434 @@ class Document:
             self_consistency (bool, optional): 是否采用自我一致性策略 (需要更多的模型推理次数). Defaults to False.
             samples (int, optional): 采用自我一致性策略的采样次数. Defaults to 5.
             top (float, optional): 采用自我一致性策略时，出现次数超过 top * samples 时才会被采纳，范围为 [0, 1]. Defaults to 0.5.
+            early_stop (bool, optional): 采用自我一致性策略时，所有候选是否被采纳都已确定则提前停止采样. Defaults to True.
+            max_samples (int, optional): 采用自我一致性策略时，投票接近的片段最多采样次数，不指定时不追加采样. Defaults to None.
             checkpoint (bool, optional): 如果保存有断点信息, 是否继续从断点处运行. Defaults to False.
+            joint (bool, optional): 一次调用同时抽取实体、属性和关系 (每个片段一次调用, 而不是依次进行三次). Defaults to False.
+            workers (int, optional): 并发抽取的线程数, 大于 1 时并发调用 LLM, 结果仍按书签顺序合并. Defaults to 1.
+            journal (str, optional): 抽取日志路径, 每个片段完成后立即追加写入; 再次运行时重放日志中的结果, 从未完成的片段继续. Defaults to None.
+            attr_batch_size (int, optional): 属性总结时每次调用总结的属性数量, 为 1 时逐个总结. Defaults to 20.
+            incremental (bool, optional): 增量抽取, 用于新版教材或修正了部分章节的 OCR 之后: 只重新抽取内容哈希发生变化的片段,
+                只由被删除片段贡献的知识点和关系会被移除, 其余知识点保留原来的 id. 此时忽略 checkpoint. Defaults to False.
+            parse_workers (int, optional): 大于 0 时解析与抽取重叠执行, 解析线程提前读取后续章节并将片段放入有界队列,
+                由 workers 个抽取线程消费; 大于 1 时要求解析器可以并发调用. 为 0 时先读取所有章节再抽取. Defaults to 0.
+            queue_size (int, optional): 重叠执行时队列中最多等待抽取的片段数, 默认为 workers 的 2 倍. Defaults to None.
+            retry_workers (int, optional): 抽取或合并失败的片段不会中断抽取, 在所有章节完成之后以该并发数重试,
+                默认为 workers 的一半. Defaults to None.
+            dedup (NearDuplicateIndex, optional): 近似重复片段索引, 与已抽取片段近似重复的片段直接复用其抽取结果,
+                不再调用 LLM; 多个文档共享同一个索引时可以跨文档复用. 片段按书签顺序登记, 先出现的片段作为原片段;
+                parse_workers 大于 1 时章节并发解析, 原片段取决于线程调度. 原片段抽取失败时从索引中移除, 重试成功后重新加入. Defaults to None.
+            canonicalizer (KPCanonicalizer, optional): 抽取完成之后、属性总结之前合并同义知识点. Defaults to None.
+
+        Returns:
+            ExtractionReport: 成功、重试和失败的片段数, 最终失败的片段, 以及总结失败的属性数
         """
+        sampler = SelfConsistencySampler(samples, top, early_stop, max_samples) if self_consistency else None
+        # 增量抽取: 之前的片段记录按内容哈希复用, 知识点重新合并, 同名知识点保留原来的 id、资源切片和最佳属性值
+        previous: KPRegistry | None = None
+        records: dict[str, Extraction] = {}
+        if incremental:
+            previous = self.knowledgepoints
+            records = {hash_: extraction for chunks in self.chunk_records.values() for hash_, extraction in chunks}
+        # 增量抽取完成之后才替换之前的片段记录, 中途出错时可以再次增量抽取
+        chunk_records = {} if incremental else self.chunk_records
+        targets = self._extract_targets(checkpoint, incremental)
+        subs = {bookmark.id: bookmark.subs for _, bookmark in targets}
+        report = ExtractionReport()
+        with USAGE.scope(document=self.name), \
+                (ExtractionJournal(journal) if journal is not None else nullcontext()) as journal_:
+            scheduler = ChunkScheduler(lambda content: extract_chunk(llm, prompt, content, sampler=sampler, joint=joint),
+                                       self._chunk_chapters, workers, parse_workers, queue_size, records, journal_, dedup)
+            if previous is not None:
+                self.knowledgepoints = KPRegistry()
+            try:
+                with scheduler:
+                    failures = self._merge_chapters(scheduler, targets, previous, chunk_records, report)
+                    if failures:
+                        self._retry_chunks(failures, scheduler, retry_workers or max(1, workers // 2),
+                                           previous, chunk_records, report)
+            except BaseException:
+                if previous is not None:  # 增量抽取失败时恢复之前的知识点
+                    self.knowledgepoints = previous
+                    for _, bookmark in targets:
+                        bookmark.subs = subs[bookmark.id]
+                raise
+            if incremental:
+                logger.info(f'增量抽取: {scheduler.changed} 个片段重新抽取')
+            logger.info(f'片段抽取: 成功 {report.succeeded} 个, 重试 {report.retried} 个, 失败 {report.failed} 个')
+            self.chunk_records = chunk_records
+            if sampler is not None:
+                logger.info(f'自我一致性: 投票 {sampler.stats.votes} 次, 采样 {sampler.stats.drawn} 次, '
+                            f'节省 {sampler.stats.saved} 次')
+
+            if canonicalizer is not None:
+                self.canonicalize_knowledgepoints(canonicalizer)
+
+            # 属性值总结
+            if previous is not None:
+                # 属性值列表没有变化的知识点沿用之前的最佳属性值
+                for entity in self.knowledgepoints:
+                    if (old := previous.get(entity.name)) is not None and old.attributes == entity.attributes:
+                        entity.best_attributes = dict(old.best_attributes)
+            self._summarize_attributes(llm, prompt, batch_size=attr_batch_size, workers=workers, report=report)
+        return report
+
+    def canonicalize_knowledgepoints(self, canonicalizer: KPCanonicalizer) -> int:
+        """ 合并同义的知识点 (例如 "随机梯度下降法" 与 "SGD"), 包括它们的属性值、资源切片和关系, 并更新书签中的知识点。
+        只检索上次规范化之后新出现的知识点
 
-        @instance_method_transactional('knowledgepoints')
-        def get_knowledgepoints(self,  # 这里需要传递self的原因是instance_method_transactional本来只能装饰实例方法
-                                content: str,
-                                self_consistency=False,
-                                samples: int = 5,
-                                top: float = 0.5) -> list[KPEntity]:
-            # 实体抽取
-            message, instruction = prompt.get_ner_prompt(content)
-            llm.instruction = instruction
-            if not self_consistency:
-                # 默认策略：实体生成数量过多则重试，否则随机选择5个
-                retry = 0
-                while True:
-                    resp = llm.chat(message)
-                    entities: dict = prompt.post_process(resp) or {}
-                    if all(len(value) < 8 for value in entities.values()) or retry >= 3:
-                        break
-                    retry += 1
-                for entity_type, entity_list in entities.items():
-                    if len(entity_list) > 10:
-                        entities[entity_type] = random.sample(entity_list, 5)
-            else:
-                # 自我一致性验证
-                all_entities: list[dict] = []
-                for idx in range(samples):
-                    resp = llm.chat(message)
-                    logger.info(f'第{idx}次采样: ' + resp)
-                    entities: dict = prompt.post_process(resp) or {}
-        
-                    logger.info(f'获取知识点实体: ' + str(entities))
-                    all_entities.append(entities)
-                
-                entities = {}
-                # 这里的自我一致性是要求每种类型中提及的实体超过一定数量
-                for entity_type in {k for d in all_entities for k in d}: # 所有的 keys
-                    elements = [item for d in all_entities if entity_type in d for item in d[entity_type]]
-                    entities[entity_type] = [point for point, count in Counter(elements).items() if count > (samples * top)]
-            logger.success(f'最终获取知识点实体: ' + str(entities))
-            # 分支结束得到 entities {'entity_type': ['entity1', 'entity2']}
-            
+        Args:
+            canonicalizer (KPCanonicalizer): 知识点规范化器
+
+        Returns:
+            int: 合并的知识点数量
+        """
+        mapping = canonicalizer.find_duplicates(self.knowledgepoints)
+        if not mapping:
+            return 0
+        self.knowledgepoints.merge(mapping)
+        for bookmark in self.bookmark_index.flat:
+            if any(isinstance(sub, KPEntity) and sub.id in mapping for sub in bookmark.subs):
+                subs = []
+                for sub in bookmark.subs:
+                    while isinstance(sub, KPEntity) and sub.id in mapping:
+                        sub = mapping[sub.id]
+                    subs.append(sub)
+                bookmark.subs = list({id(sub): sub for sub in subs}.values())  # 去重
+        logger.info(f'知识点规范化: 合并 {len(mapping)} 个知识点, 剩余 {len(self.knowledgepoints)} 个')
+        return len(mapping)
+
+    def _merge_chapters(self,
+                        scheduler: ChunkScheduler,
+                        targets: list[tuple[int, BookMark]],
+                        previous: KPRegistry | None,
+                        chunk_records: dict[str, list[tuple[str, Extraction | None]]],
+                        report: ExtractionReport) -> list[ChunkFailure]:
+        """ 按书签和片段顺序合并抽取结果, 结果与顺序执行一致。单个片段抽取或合并失败不影响其余片段,
+        读取失败的章节直接记录为最终失败 (片段序号为 -1), 不写入片段记录, 下次增量抽取时会重新读取
+
+        Args:
+            scheduler (ChunkScheduler): 片段调度
+            targets (list[tuple[int, BookMark]]): (书签序号, 书签)
+            previous (KPRegistry | None): 增量抽取之前的知识点
+            chunk_records (dict[str, list[tuple[str, Extraction | None]]]): 本次抽取的片段记录, 失败的片段为 None
+            report (ExtractionReport): 抽取结果统计
+
+        Returns:
+            list[ChunkFailure]: 失败的片段, 所有章节完成之后统一重试
+        """
+        failures: list[ChunkFailure] = []
+        for index, bookmark, replay, contents, results in tqdm(scheduler.run(targets), total=len(targets), desc='知识抽取'):
+            logger.info('子章节: ' + bookmark.title)
+            self.checkpoint['extract_index'] = index
+            if (error := scheduler.errors.get(index)) is not None:
+                report.failures.append(ChunkFailure(index, bookmark, -1, '', repr(error)))
+                report.failed += 1
+                chunk_records.pop(bookmark.id, None)
+                bookmark.subs = []
+                continue
             kps: list[KPEntity] = []
-            for entity_type, entity_list in entities.items():
-                for entity_name in entity_list:  # entity_type 不再作为单独出现而是作为属性
-                    # 复用知识点实体
-                    for kp in self.knowledgepoints:
-                        if entity_name == kp.name:  # 后续这里可能还有更多的判断 (共指消解)
-                            kps.append(kp)
-                            break
-                    else:
-                        kp = KPEntity(id='2:' + str(shortuuid.uuid()), name=entity_name, type=entity_type)
-                        self.knowledgepoints.append(kp)
-                        kps.append(kp)
-    
-            # 属性抽取
-            if len(kps) == 0:
-                pass
-            else:
-                message, instruction = prompt.get_ae_prompt(content, [kp.name for kp in kps])  # 只使用 name
-                llm.instruction = instruction
-                resp = llm.chat(message)
-                attrs: dict = prompt.post_process(resp) or {}
-                logger.success(f'获取知识点属性: ' + str(attrs))
-
-                for name, attr in attrs.items():
-                    # 使用 name 匹配
-                    if matching_kp := next((kp for kp in kps if kp.name == name), None):
-                        # 更新相应的属性值
-                        if isinstance(attr, dict):
-                            for attr_name, value in attr.items():
-                                matching_kp.attributes.setdefault(attr_name, []).append(value)
-
-            # 关系抽取
-            if len(kps) <= 1:
-                pass
-            else:
-                message, instruction = prompt.get_re_prompt(content, [kp.name for kp in kps])
-                llm.instruction = instruction
-                if not self_consistency:
-                    resp = llm.chat(message)
-                    relations: list = prompt.post_process(resp) or []
-                else:
-                    all_relations = []
-                    for idx in range(samples):
-                        resp = llm.chat(message)
-                        logger.info(f'第{idx}次采样: ' + resp)
-                        relations: list = prompt.post_process(resp) or []
-
-                        logger.info(f'获取知识点实体: ' + str(entities))
-                        all_relations.extend(relations)
-                    relations = [
-                        dict(relation)
-                        for relation, count in Counter(frozenset(relation.items()) for relation in all_relations).items()  if count > (samples * top)
-                    ]
-                
-                logger.success(f'最终获取关系三元组: ' + str(relations))
-                # 分支结束得到 relations [{'head':'', 'relation':'', 'tail':''}]
-
-                for rela in relations:
-                    head, tail = None, None
-                    for entity in kps:
-                        if entity.name == rela.get('head', None): # 使用 name 匹配
-                            head = entity
-                            break
-                    for entity in kps:
-                        if entity.name == rela.get('tail', None):
-                            tail = entity
-                            break
-                    if head and tail:
-                        for relation in head.relations:
-                            if relation.type == rela.get('relation', None) and relation.tail.name == tail.name:  # 确保没有重复的关系
-                                break
-                        else:
-                            head.relations.append(
-                                KPRelation(id='3:' + str(shortuuid.uuid()),
-                                           type=rela['relation'],
-                                           tail=tail))
-
-            return kps
-
-        # 知识抽取
-        for index, bookmark in tqdm(enumerate(self.flatten_bookmarks()), total=len(self.flatten_bookmarks()), desc='知识抽取'):
-            if not bookmark.subs:  # 表示最后一级书签 subs为空数组需要设置知识点
-                logger.info('子章节: ' + bookmark.title)
-                if index < self.checkpoint['extract_index'] and checkpoint:
-                    logger.info('已跳过')
+            chunks: list[tuple[str, Extraction | None]] = []  # 失败的片段为 None, 重试之后填入
+            if replay is not None:
+                logger.info(f'从抽取日志恢复 {len(replay)} 个片段')
+                chunks.extend(replay)
+                for _, extraction in replay:
+                    kps.extend(self._merge_extraction(extraction, previous))
+            for i, (content, result) in enumerate(zip(contents, results)):
+                logger.info('输入片段: \n' + content)
+                try:
+                    extraction = result()
+                    kps.extend(self._merge_extraction(extraction, previous))
+                except Exception as e:
+                    logger.warning(f'片段抽取失败, 稍后重试: {bookmark.title} 第 {i} 个片段: {e!r}')
+                    failures.append(ChunkFailure(index, bookmark, i, content, repr(e)))
+                    chunks.append((content_hash(content), None))
+                    continue
+                chunks.append((content_hash(content), extraction))
+            report.succeeded += sum(extraction is not None for _, extraction in chunks)
+            if replay is None:
+                scheduler.complete(index, bookmark, chunks)
+            chunk_records[bookmark.id] = chunks
+            bookmark.subs = list({kp.id: kp for kp in kps}.values())  # 去重
+        return failures
+
+    def _retry_chunks(self,
+                      failures: list[ChunkFailure],
+                      scheduler: ChunkScheduler,
+                      workers: int,
+                      previous: KPRegistry | None,
+                      chunk_records: dict[str, list[tuple[str, Extraction | None]]],
+                      report: ExtractionReport) -> None:
+        """ 以较低的并发数重新抽取失败的片段, 按书签和片段顺序合并。
+        重试之后仍然失败的片段记录在 report.failures 中, 不写入片段记录, 下次增量抽取或从日志恢复时会重新抽取
+
+        Args:
+            failures (list[ChunkFailure]): 失败的片段
+            scheduler (ChunkScheduler): 片段调度
+            workers (int): 并发线程数
+            previous (KPRegistry | None): 增量抽取之前的知识点
+            chunk_records (dict[str, list[tuple[str, Extraction | None]]]): 本次抽取的片段记录, 失败的片段为 None
+            report (ExtractionReport): 抽取结果统计
+        """
+        logger.info(f'重试 {len(failures)} 个失败的片段, 并发数 {workers}')
+        report.retried += len(failures)
+        for failure, future in scheduler.retry(failures, workers):
+            try:
+                extraction = future.result()
+                kps = self._merge_extraction(extraction, previous)
+            except Exception as e:
+                logger.error(f'片段重试失败: {failure.bookmark.title} 第 {failure.chunk} 个片段: {e!r}')
+                failure.error = repr(e)
+                report.failures.append(failure)
+                report.failed += 1
+                continue
+            report.succeeded += 1
+            chunks = chunk_records[failure.bookmark.id]
+            chunks[failure.chunk] = (content_hash(failure.content), extraction)
+            failure.bookmark.subs = list({kp.id: kp for kp in [*failure.bookmark.subs, *kps]}.values())
+            scheduler.complete(failure.index, failure.bookmark, chunks)
+        for failure in report.failures:  # 最终失败的片段不写入片段记录
+            if failure.chunk < 0:
+                continue
+            chunk_records[failure.bookmark.id] = [chunk for chunk in chunk_records[failure.bookmark.id] if chunk[1] is not None]
+
+    def _extract_targets(self, checkpoint: bool = False, incremental: bool = False) -> list[tuple[int, BookMark]]:
+        """ 需要抽取知识点的书签
+
+        Args:
+            checkpoint (bool, optional): 是否跳过断点之前的书签. Defaults to False.
+            incremental (bool, optional): 是否为增量抽取, 此时处理所有最后一级书签并忽略 checkpoint. Defaults to False.
+
+        Returns:
+            list[tuple[int, BookMark]]: (书签序号, 书签)
+        """
+        targets = []
+        leaves = {bookmark.id for bookmark in self.bookmark_index.leaves}
+        for index, bookmark in enumerate(self.flatten_bookmarks()):
+            # 表示最后一级书签 subs为空数组需要设置知识点, 增量抽取时处理所有最后一级书签
+            if (bookmark.id in leaves) if incremental else (not bookmark.subs):
+                if index < self.checkpoint['extract_index'] and checkpoint and not incremental:
+                    logger.info(f'已跳过: {bookmark.title}')
                     continue
                 if bookmark.title in config.ignore_page:
-                    logger.info('已跳过')
+                    logger.info(f'已跳过: {bookmark.title}')
                     continue
-                contents = self.parser.get_contents(bookmark)
-                kps: list[KPEntity] = []
-                contents = optimize_string_lengths([content.content for content in contents], n=400)
-                for content in contents:
-                    if len(content) != 0:
-                        logger.info('输入片段: \n' + content)
-                        try:
-                            entities: list[KPEntity] = get_knowledgepoints(
-                                self,
-                                content,
-                                self_consistency=self_consistency,
-                                samples=samples,
-                                top=top)
-                        except Exception as e:
-                            raise e
-                        else:
-                            kps.extend(entities)
-                self.checkpoint['extract_index'] = index
-                bookmark.subs = list({kp.id: kp for kp in kps}.values()) # 去重
+                targets.append((index, bookmark))
+        return targets
+
+    def _chunk_chapters(self, bookmarks: list[BookMark]) -> list[list[str]]:
+        """ 读取章节内容并切分为片段, 所有章节一次切分 (并行执行)
+
+        Args:
+            bookmarks (list[BookMark]): 书签
+
+        Returns:
+            list[list[str]]: 每个章节的片段
+        """
+        return chunk_by_tokens([[content.content for content in self.parser.get_contents(bookmark)] for bookmark in bookmarks],
+                               config.chunk_tokens, config.chunk_overlap)
+
+    def estimate_extraction(
+            self,
+            llm: LLM = None,
+            prompt: ExtractPromptGenerator = ExamplePromptGenerator(),
+            self_consistency: bool = False,
+            samples: int = 5,
+            top: float = 0.5,
+            early_stop: bool = True,
+            max_samples: int = None,
+            checkpoint: bool = False,
+            joint: bool = False,
+            workers: int = 1,
+            attr_batch_size: int = 20,
+            entities_per_chunk: int = 5,
+            attrs_per_entity: float = 0.5,
+            tokens_per_second: float = 30,
+            prefill_tokens_per_second: float = 2000,
+            requests_per_minute: float = None) -> ExtractionEstimate:
+        """ 不调用大模型估算 set_knowledgepoints_by_llm 的调用次数、token 数和耗时。
+        与真实抽取相同地遍历书签并切分内容, 按提示词模板估算输入 token 数, 抽取参数的含义与 set_knowledgepoints_by_llm 相同。
+        读取内容由解析器完成, 解析器设置了模型时 (例如 PDFParser 的 llm 用于 OCR 矫正、vlm 用于图文理解) 仍会调用这些模型,
+        且不计入估算结果, 此时会输出警告; 需要完全不调用模型时使用不设置 llm 和 vlm 的解析器
+
+        Args:
+            llm (LLM, optional): 将要使用的 LLM, 用于判断是否支持一次请求返回多个回答. Defaults to None.
+            prompt (ExtractPromptGenerator, optional): 使用的提示词类. Defaults to ExamplePromptGenerator().
+            self_consistency (bool, optional): 是否采用自我一致性策略. Defaults to False.
+            samples (int, optional): 采用自我一致性策略的采样次数. Defaults to 5.
+            top (float, optional): 采用自我一致性策略时的采纳比例. Defaults to 0.5.
+            early_stop (bool, optional): 采用自我一致性策略时是否提前停止采样. Defaults to True.
+            max_samples (int, optional): 采用自我一致性策略时，投票接近的片段最多采样次数. Defaults to None.
+            checkpoint (bool, optional): 是否从断点处运行. Defaults to False.
+            joint (bool, optional): 一次调用同时抽取实体、属性和关系. Defaults to False.
+            workers (int, optional): 并发抽取的线程数. Defaults to 1.
+            attr_batch_size (int, optional): 属性总结时每次调用总结的属性数量. Defaults to 20.
+            entities_per_chunk (int, optional): 每个片段平均抽取的实体数. Defaults to 5.
+            attrs_per_entity (float, optional): 平均每个抽取到的实体需要调用 LLM 总结的属性数. Defaults to 0.5.
+            tokens_per_second (float, optional): 单个请求的生成速度. Defaults to 30.
+            prefill_tokens_per_second (float, optional): 单个请求的预填充速度. Defaults to 2000.
+            requests_per_minute (float, optional): 服务的请求配额. Defaults to None.
+
+        Returns:
+            ExtractionEstimate: 估算结果
+        """
+        estimator = ExtractionEstimator(
+            prompt,
+            sampler=SelfConsistencySampler(samples, top, early_stop, max_samples) if self_consistency else None,
+            joint=joint,
+            supports_n=llm is not None and llm.supports_n,
+            entities_per_chunk=entities_per_chunk,
+            attrs_per_entity=attrs_per_entity,
+            attr_batch_size=attr_batch_size,
+            tokens_per_second=tokens_per_second,
+            prefill_tokens_per_second=prefill_tokens_per_second)
+        if models := [name for name in ('llm', 'vlm') if getattr(self.parser, name, None) is not None]:
+            logger.warning(f'解析器设置了 {", ".join(models)}, 读取章节内容时会调用模型, 这些调用不计入估算结果')
+        targets = self._extract_targets(checkpoint)
+        for contents in self._chunk_chapters([bookmark for _, bookmark in targets]):
+            for content in contents:
+                estimator.add_chunk(content)
+        estimator.add_attributes()
+        estimate = estimator.project(workers, requests_per_minute)
+        estimate.chapters = len(targets)
+        for stage, value in estimate.stages.items():
+            logger.info(f'{stage}: 调用 {value.min_calls}~{value.max_calls} 次, '
+                        f'输入 {value.max_prompt_tokens} tokens, 输出 {value.max_completion_tokens} tokens')
+        logger.info(f'预计: {estimate.chapters} 个章节, {estimate.chunks} 个片段, 最多调用 {estimate.max_calls} 次, '
+                    f'{estimate.max_tokens} tokens, 耗时 {estimate.seconds / 60:.1f} 分钟')
+        return estimate
+
+    def _summarize_attributes(self,
+                              llm: LLM,
+                              prompt: ExtractPromptGenerator,
+                              batch_size: int,
+                              workers: int,
+                              report: ExtractionReport = None) -> None:
+        """ 为每个知识点的每个属性选择最佳属性值。规范化后只有一个值的属性无需调用 LLM,
+        其余的每 batch_size 个合并为一次调用, 多个批次并发执行。
+        某个批次失败时不影响其余批次, 该批次的属性沿用第一个属性值
 
-        # 属性值总结
-        for entity in tqdm(self.knowledgepoints, desc='属性总结'):
+        Args:
+            llm (LLM): 指定 LLM
+            prompt (ExtractPromptGenerator): 使用的提示词类
+            batch_size (int): 每次调用总结的属性数量
+            workers (int): 并发线程数
+            report (ExtractionReport, optional): 抽取结果统计, 记录总结失败的属性数. Defaults to None.
+        """
+        pending: list[tuple[KPEntity, str, list[str]]] = []
+        skipped = 0
+        for entity in self.knowledgepoints:
             for attr, value_list in entity.attributes.items():
-                if len(value_list) == 1:
+                if not value_list or attr in entity.best_attributes:  # 已经有最佳属性值 (增量抽取时沿用)
+                    continue
+                values: dict[str, str] = {}
+                for value in value_list:
+                    values.setdefault(_normalize_value(value), value)
+                if len(values) == 1:
                     entity.best_attributes[attr] = value_list[0]
+                    skipped += len(value_list) > 1
                 else:
-                    prompt_, instruction = prompt.get_best_attr_prompt(
-                        entity.name, attr, value_list)
-                    llm.instruction = instruction
-                    resp = llm.chat(prompt_)
-                    entity.best_attributes[attr] = resp
-                logger.success(
-                    f'实体: {entity.name}, 属性: {attr}, 值: {entity.attributes[attr]}'
-                )
+                    pending.append((entity, attr, list(values.values())))
+
+        def summarize_one(entity: KPEntity, attr: str, values: list[str]) -> str:
+            prompt_, instruction = prompt.get_best_attr_prompt(entity.name, attr, values)
+            return llm.chat(prompt_, tag='best_attr', instruction=instruction)
+
+        def summarize(batch: list[tuple[KPEntity, str, list[str]]]) -> tuple[list[str], int]:
+            if len(batch) == 1:
+                return [summarize_one(*batch[0])], 1
+            try:
+                prompt_, instruction = prompt.get_best_attrs_prompt([(e.name, attr, values) for e, attr, values in batch])
+            except NotImplementedError:
+                return [summarize_one(*item) for item in batch], len(batch)
+            resp = llm.chat(prompt_, tag='best_attr', schema=prompt.get_best_attrs_schema(len(batch)), instruction=instruction)
+            res = prompt.post_process(resp)
+            res = res if isinstance(res, dict) else {}
+            calls, results = 1, []
+            for i, item in enumerate(batch):
+                if isinstance(value := res.get(str(i)), str) and value:
+                    results.append(value)
+                else:  # 批量结果中缺失的单独总结
+                    results.append(summarize_one(*item))
+                    calls += 1
+            return results, calls
+
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), max(1, batch_size))]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, summarize, batch) for batch in batches]
+            calls, failed = 0, 0
+            for batch, future in tqdm(zip(batches, futures), total=len(batches), desc='属性总结'):
+                try:
+                    results, calls_ = future.result()
+                except Exception as e:
+                    logger.warning(f'属性总结失败, {len(batch)} 个属性沿用第一个属性值: {e!r}')
+                    results, calls_ = [values[0] for _, _, values in batch], 0
+                    failed += len(batch)
+                calls += calls_
+                for (entity, attr, _), value in zip(batch, results):
+                    entity.best_attributes[attr] = value
+                    logger.success(f'实体: {entity.name}, 属性: {attr}, 值: {entity.attributes[attr]}')
+        logger.info(f'属性总结: {len(pending)} 个属性调用 LLM {calls} 次, {skipped} 个属性规范化后只有一个值, 跳过, '
+                    f'{failed} 个属性总结失败')
+        if report is not None:
+            report.attr_failed += failed
+
+    @instance_method_transactional('knowledgepoints')
+    def _merge_extraction(self, extraction: Extraction, previous: KPRegistry = None) -> list[KPEntity]:
+        """ 将片段的抽取结果合并到知识点实体中, 出错时通过注册表的撤销日志回滚
+
+        Args:
+            extraction (Extraction): 片段抽取结果
+            previous (KPRegistry, optional): 增量抽取之前的知识点, 新建的同名知识点和关系沿用其 id 和资源切片. Defaults to None.
+
+        Returns:
+            list[KPEntity]: 片段中提到的知识点实体
+        """
+        kps: list[KPEntity] = []
+        for entity_type, entity_list in extraction.entities.items():
+            for entity_name in entity_list:  # entity_type 不再作为单独出现而是作为属性
+                # 复用知识点实体, 按规范化名称匹配 (后续这里可能还有更多的判断, 如共指消解)
+                if (kp := self.knowledgepoints.get(entity_name)) is None:
+                    if previous is not None and (old := previous.get(entity_name)) is not None:
+                        # 规范化合并之后别名指向保留的实体, 保留的实体可能已经以其他名称加入了新的注册表
+                        if (kp := self.knowledgepoints.get_by_id(old.id)) is None:
+                            kp = KPEntity(id=old.id, name=old.name, type=old.type, resourceSlices=list(old.resourceSlices))
+                            self.knowledgepoints.add(kp)
+                    else:
+                        kp = KPEntity(id=entity_id(self.id, entity_name), name=entity_name, type=entity_type)
+                        self.knowledgepoints.add(kp)
+                kps.append(kp)
+        ids = {kp.id for kp in kps}
+
+        def match(name: str) -> KPEntity | None:
+            # 只匹配当前片段中的实体
+            kp = self.knowledgepoints.get(name)
+            return kp if kp is not None and kp.id in ids else None
+
+        for name, attr in extraction.attributes.items():
+            if matching_kp := match(name):
+                # 更新相应的属性值
+                if isinstance(attr, dict):
+                    for attr_name, value in attr.items():
+                        self.knowledgepoints.add_attribute(matching_kp, attr_name, value)
+
+        for rela in extraction.relations:
+            head, tail = match(rela.get('head', None)), match(rela.get('tail', None))
+            if head and tail and not self.knowledgepoints.has_relation(head, rela.get('relation', None), tail):  # 确保没有重复的关系
+                old = previous.get(head.name) if previous is not None else None
+                id_ = next((relation.id for relation in old.relations
+                            if relation.type == rela['relation'] and relation.tail.id == tail.id), None) if old else None
+                self.knowledgepoints.add_relation(
+                    head, KPRelation(id=id_ or relation_id(head.id, rela['relation'], tail.id), type=rela['relation'], tail=tail))
+        return kps
+
+    def usage(self) -> dict[str, UsageSummary]:
+        """ 获取本文档各阶段 (ner/ae/re/best_attr 等) 的大模型用量
+
+        Returns:
+            dict[str, UsageSummary]: 调用方到汇总结果
+        """
+        return {key[0]: summary for key, summary in USAGE.summary(by=('tag',), document=self.name).items()}
 
     def to_cyphers(self) -> list[str]:
         """ 将图谱转换为 cypher CREATE 语句
@@ -300,12 +606,11 @@ class Document:
                 f'CREATE (:知识点 {{id: "{entity.id}", name: "{entity.name}", type: "{entity.type}", resource: {res},  {",".join(attr_string)}}})'
             )
         # 创建所有知识点关联
-        for entity in self.knowledgepoints:
-            for relation in entity.relations:
-                if relation.type in relas:
-                    cyphers.append(
-                        f'MATCH (n1:知识点 {{id: "{entity.id}"}}) MATCH (n2:知识点 {{id: "{relation.tail.id}"}}) CREATE (n1)-[:{relation.type} {{id: "{relation.id}"}}]->(n2)'
-                    )
+        for entity, relation in self.knowledgepoints.relations():
+            if relation.type in relas:
+                cyphers.append(
+                    f'MATCH (n1:知识点 {{id: "{entity.id}"}}) MATCH (n2:知识点 {{id: "{relation.tail.id}"}}) CREATE (n1)-[:{relation.type} {{id: "{relation.id}"}}]->(n2)'
+                )
 
         def bookmark_to_cypher(bookmark: BookMark, parent_id: str):
             if bookmark.title in config.ignore_page:
@@ -317,7 +622,7 @@ class Document:
             )
             # 创建章节和上级章节 (书籍) 关联, 所以不写类别
             cyphers.append(
-                f'MATCH (n1 {{id: "{parent_id}"}}) MATCH (n2:章节 {{id: "{bookmark.id}"}}) CREATE (n1)-[:子章节 {{id: "3:{shortuuid.uuid()}"}}]->(n2)'
+                f'MATCH (n1 {{id: "{parent_id}"}}) MATCH (n2:章节 {{id: "{bookmark.id}"}}) CREATE (n1)-[:子章节 {{id: "{relation_id(parent_id, "子章节", bookmark.id)}"}}]->(n2)'
             )
             for sub in bookmark.subs:
                 match sub:
@@ -325,7 +630,7 @@ class Document:
                         bookmark_to_cypher(sub, bookmark.id)
                     case KPEntity():
                         cyphers.append(
-                            f'MATCH (n1:章节 {{id: "{bookmark.id}"}}) MATCH (n2:知识点 {{id: "{sub.id}"}}) CREATE (n1)-[:包含知识点 {{id: "3:{shortuuid.uuid()}"}}]->(n2)'
+                            f'MATCH (n1:章节 {{id: "{bookmark.id}"}}) MATCH (n2:知识点 {{id: "{sub.id}"}}) CREATE (n1)-[:包含知识点 {{id: "{relation_id(bookmark.id, "包含知识点", sub.id)}"}}]->(n2)'
                         )
 
         for i, bookmark in enumerate(self.bookmarks):
@@ -341,7 +646,7 @@ class Document:
         relations = []
         entity_attributes = []
 
-        def add_relation(x_id, x_type, x_name, y_id, y_type ,y_name, relation, relation_id=None):
+        def add_relation(x_id, x_type, x_name, y_id, y_type ,y_name, relation, id_=None):
             relations.append({
                 'x_id': x_id,
                 'x_type': x_type,
@@ -350,7 +655,7 @@ class Document:
                 'y_type': y_type,
                 'y_name': y_name,
                 'relation': relation,
-                'relation_id': relation_id or f'3:{shortuuid.uuid()}'
+                'relation_id': id_ or relation_id(x_id, relation, y_id)
             })
 
         def dfs(node: Union[Document, BookMark, KPEntity]):
@@ -369,11 +674,11 @@ class Document:
                             case KPEntity():
                                 add_relation(node.id, '章节', node.title, sub.id, '知识点', sub.name, '提到知识点')
                         dfs(sub)
-                case KPEntity():
-                    for relation in node.relations:
-                        add_relation(node.id, '知识点', node.name, relation.tail.id, '知识点', relation.tail.name, relation.type, relation.id)
 
         dfs(self)
+        # 知识点之间的关系从注册表中获取, 同一知识点出现在多个章节时不会重复
+        for kp, relation in self.knowledgepoints.relations():
+            add_relation(kp.id, '知识点', kp.name, relation.tail.id, '知识点', relation.tail.name, relation.type, relation.id)
 
         for kp in self.knowledgepoints:
             attribute = {
@@ -441,17 +746,23 @@ class Document:
             resource_map (ResourceMap): 资源映射关系
         """
         title, resource = resource_map.bookmark_title, resource_map.resource
-        bookmarks: list[BookMark] = []
-        titles = title.split("|")
-        for bk in self.flatten_bookmarks():
-            if bk.title in titles:
-                bookmarks.append(bk)
-        if len(bookmarks) > 0:
-            for bookmark in bookmarks:
-                bookmark.resource.append(resource)
-                # 为下面的知识点实体设置Resource Slice
-                for kp in bookmark.get_kps():
-                    slices = resource.get_slices(kp.name)
-                    logger.success(f'{kp.name}: {slices}')
-                    if slices:
-                        kp.resourceSlices.extend(slices)
+        index = self.bookmark_index
+        bookmarks = {
+            bookmark.id: bookmark
+            for bookmark in sorted((bookmark for title_ in title.split("|") for bookmark in index.get_by_title(title_)),
+                                   key=lambda bookmark: index.positions[bookmark.id])
+        }
+        for bookmark in bookmarks.values():
+            bookmark.resource.append(resource)
+            # 为下面的知识点实体设置Resource Slice
+            for kp in index.get_kps(bookmark):
+                slices = resource.get_slices(kp.name)
+                logger.success(f'{kp.name}: {slices}')
+                if slices:
+                    kp.resourceSlices.extend(slices)
+
+
+def _normalize_value(value) -> str:
+    """ 规范化属性值, 忽略全半角、大小写、空白字符和句末标点
+    """
+    return normalize_name(str(value)).rstrip('。.;；')
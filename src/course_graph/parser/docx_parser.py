@@ -7,8 +7,8 @@
 from .type import BookMark, PageIndex
 from .parser import Parser
 from .type import Content, ContentType
+from .ids import document_id, set_bookmark_ids
 import docx
-import shortuuid
 from xml.dom.minidom import parseString
 
 
@@ -39,7 +39,7 @@ class DOCXParser(Parser):
                 title = phar.text
                 bookmarks.append(
                     BookMark(
-                        id='1:' + str(shortuuid.uuid()) + f':{level}',
+                        id='',  # 建立书签树之后按路径设置
                         title=title,
                         page_start=PageIndex(index=0,
                                              anchor=(0, 0)),  # 无需设置起始页码和结束页码
@@ -57,6 +57,7 @@ class DOCXParser(Parser):
             stack.append(bookmark)
 
         stack.reverse()
+        set_bookmark_ids(stack, document_id(self.file_path))
         return stack
 
     def get_contents(self, bookmark: BookMark) -> list[Content]:
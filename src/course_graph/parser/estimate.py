@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/14
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/estimate.py
+# Description: 不调用大模型估算知识抽取的调用次数、token 数和耗时
+
+from dataclasses import dataclass, field
+from ..llm import ONTOLOGY
+from ..llm.prompt import ExtractPromptGenerator
+from ..llm.tokenizer import estimate_messages_tokens
+from .consistency import SelfConsistencySampler
+from .extract import NER_RETRIES
+
+# 各阶段每次生成的平均输出 token 数 (经验值), best_attr 为每个属性
+COMPLETION_TOKENS = {
+    'ner': 80,
+    'ae': 60,  # 每个实体
+    're': 40,  # 每个实体
+    'joint': 300,
+    'best_attr': 60,
+}
+
+
+@dataclass
+class StageEstimate:
+    """ 单个阶段的估算结果, 采用自我一致性并开启提前停止时实际值在 min 与 max 之间
+    """
+    min_calls: int = 0  # 请求次数
+    max_calls: int = 0
+    min_prompt_tokens: int = 0
+    max_prompt_tokens: int = 0
+    min_completion_tokens: int = 0
+    max_completion_tokens: int = 0
+    seconds: float = 0  # 按最大值计算的单线程耗时
+
+    def add(self, calls: tuple[int, int], prompt_tokens: tuple[int, int],
+            completion_tokens: tuple[int, int], seconds: float) -> None:
+        self.min_calls += calls[0]
+        self.max_calls += calls[1]
+        self.min_prompt_tokens += prompt_tokens[0]
+        self.max_prompt_tokens += prompt_tokens[1]
+        self.min_completion_tokens += completion_tokens[0]
+        self.max_completion_tokens += completion_tokens[1]
+        self.seconds += seconds
+
+
+@dataclass
+class ExtractionEstimate:
+    """ 知识抽取的估算结果
+    """
+    chapters: int = 0  # 需要抽取的章节数
+    chunks: int = 0  # 片段数
+    stages: dict[str, StageEstimate] = field(default_factory=dict)  # 阶段 (ner/ae/re/joint/best_attr) -> 估算结果
+    seconds: float = 0  # 预计耗时 (秒)
+
+    @property
+    def max_calls(self) -> int:
+        return sum(stage.max_calls for stage in self.stages.values())
+
+    @property
+    def max_tokens(self) -> int:
+        return sum(stage.max_prompt_tokens + stage.max_completion_tokens for stage in self.stages.values())
+
+
+class ExtractionEstimator:
+
+    def __init__(self,
+                 prompt: ExtractPromptGenerator,
+                 sampler: SelfConsistencySampler = None,
+                 joint: bool = False,
+                 supports_n: bool = False,
+                 entities_per_chunk: int = 5,
+                 attrs_per_entity: float = 0.5,
+                 attr_batch_size: int = 20,
+                 completion_tokens: dict[str, int] = None,
+                 tokens_per_second: float = 30,
+                 prefill_tokens_per_second: float = 2000) -> None:
+        """ 按照与真实抽取相同的提示词模板估算每个片段的调用次数和 token 数。
+        实体数量和需要总结的属性数量在抽取之前无法得知, 使用给定的平均值; 输出 token 数使用经验值
+
+        Args:
+            prompt (ExtractPromptGenerator): 使用的提示词类
+            sampler (SelfConsistencySampler, optional): 自我一致性采样器, 不指定时不采用自我一致性策略. Defaults to None.
+            joint (bool, optional): 一次调用同时抽取实体、属性和关系. Defaults to False.
+            supports_n (bool, optional): 服务是否支持一次请求返回多个回答. Defaults to False.
+            entities_per_chunk (int, optional): 每个片段平均抽取的实体数. Defaults to 5.
+            attrs_per_entity (float, optional): 平均每个抽取到的实体需要调用 LLM 总结的属性数. Defaults to 0.5.
+            attr_batch_size (int, optional): 属性总结时每次调用总结的属性数量. Defaults to 20.
+            completion_tokens (dict[str, int], optional): 覆盖 COMPLETION_TOKENS 中的经验值. Defaults to None.
+            tokens_per_second (float, optional): 单个请求的生成速度. Defaults to 30.
+            prefill_tokens_per_second (float, optional): 单个请求的预填充速度. Defaults to 2000.
+        """
+        self.prompt = prompt
+        self.sampler = sampler
+        self.joint = joint
+        self.supports_n = supports_n
+        self.entities_per_chunk = entities_per_chunk
+        self.attrs_per_entity = attrs_per_entity
+        self.attr_batch_size = max(1, attr_batch_size)
+        self.completion_tokens = {**COMPLETION_TOKENS, **(completion_tokens or {})}
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.names = [f'实体{i}' for i in range(entities_per_chunk)]  # 占位实体名称
+        self.estimate = ExtractionEstimate()
+
+    def _draws(self) -> tuple[int, int, int]:
+        """ 一次采样投票的最少、最多生成次数以及最多的批次数, 与 SelfConsistencySampler.sample 的采样过程一致
+
+        Returns:
+            tuple[int, int, int]: 最少生成次数, 最多生成次数, 最多批次数
+        """
+        sampler = self.sampler
+        if sampler is None:
+            return 1, 1, 1
+        first = min(sampler.samples, int(sampler.samples * sampler.top) + 1) if sampler.early_stop else sampler.samples
+        most = max(sampler.samples, sampler.max_samples or 0)
+        # 第一批之后最坏情况下每次只追加一个
+        return first, most, 1 + most - first
+
+    def _stage(self, stage: str, messages: tuple[str, str], completion: int, sampled: bool = False, times: int = 1,
+               retries: int = 0) -> None:
+        """ 记录某个阶段的调用
+
+        Args:
+            stage (str): 阶段
+            messages (tuple[str, str]): 提示词和系统指令
+            completion (int): 每次生成的输出 token 数
+            sampled (bool, optional): 是否采用自我一致性采样. Defaults to False.
+            times (int, optional): 相同调用的次数. Defaults to 1.
+            retries (int, optional): 根据回答最多重新请求的次数, 只计入最大值. Defaults to 0.
+        """
+        message, instruction = messages
+        tokens = estimate_messages_tokens([{'role': 'system', 'content': instruction},
+                                           {'role': 'user', 'content': message}])
+        least, most, batches = self._draws() if sampled else (1, 1, 1)
+        most, batches = most * (1 + retries), batches * (1 + retries)
+        # 支持 n 参数时每批只发送一次请求 (只需一次预填充), 否则每次生成都是一次请求; 同一批内的生成并行执行
+        calls = (1, batches) if self.supports_n else (least, most)
+        seconds = batches * (tokens / self.prefill_tokens_per_second + completion / self.tokens_per_second)
+        self.estimate.stages.setdefault(stage, StageEstimate()).add(
+            (calls[0] * times, calls[1] * times),
+            (calls[0] * tokens * times, calls[1] * tokens * times),
+            (least * completion * times, most * completion * times),
+            seconds * times)
+
+    def add_chunk(self, content: str) -> None:
+        """ 估算一个片段的抽取
+
+        Args:
+            content (str): 片段内容
+        """
+        self.estimate.chunks += 1
+        if self.joint:
+            self._stage('joint', self.prompt.get_joint_prompt(content), self.completion_tokens['joint'], sampled=True)
+            return
+        n = len(self.names)
+        # 不采用自我一致性且没有约束解码时, 实体过多会重新请求, 与 extract_chunk 一致
+        retries = NER_RETRIES if self.sampler is None and self.prompt.get_ner_schema() is None else 0
+        self._stage('ner', self.prompt.get_ner_prompt(content), self.completion_tokens['ner'], sampled=True, retries=retries)
+        if n > 0:
+            self._stage('ae', self.prompt.get_ae_prompt(content, self.names), self.completion_tokens['ae'] * n)
+        if n > 1:
+            self._stage('re', self.prompt.get_re_prompt(content, self.names), self.completion_tokens['re'] * n, sampled=True)
+
+    def add_attributes(self) -> None:
+        """ 按已估算的片段数估算属性总结, 在所有片段之后调用
+        """
+        pending = round(self.estimate.chunks * len(self.names) * self.attrs_per_entity)
+        if pending == 0:
+            return
+        attrs = list(ONTOLOGY.attributes.keys()) or ['定义']
+        values = ['属性值' * 10] * 3  # 占位属性值
+        batch = min(pending, self.attr_batch_size)
+        items = [(self.names[i % len(self.names)], attrs[i % len(attrs)], values) for i in range(batch)]
+        if batch > 1:
+            try:
+                messages = self.prompt.get_best_attrs_prompt(items)
+            except NotImplementedError:
+                batch = 1
+        if batch == 1:
+            messages = self.prompt.get_best_attr_prompt(*items[0])
+        # 最后一个批次不满时按满批次估算
+        self._stage('best_attr', messages, self.completion_tokens['best_attr'] * batch, times=-(-pending // batch))
+
+    def project(self, workers: int = 1, requests_per_minute: float = None) -> ExtractionEstimate:
+        """ 估算总耗时: 单线程耗时按并发数均摊, 并且不低于请求配额限制的耗时
+
+        Args:
+            workers (int, optional): 并发抽取的线程数. Defaults to 1.
+            requests_per_minute (float, optional): 服务的请求配额. Defaults to None.
+
+        Returns:
+            ExtractionEstimate: 估算结果
+        """
+        seconds = sum(stage.seconds for stage in self.estimate.stages.values()) / max(1, workers)
+        if requests_per_minute:
+            seconds = max(seconds, self.estimate.max_calls / requests_per_minute * 60)
+        self.estimate.seconds = seconds
+        return self.estimate
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/09
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/extract.py
+# Description: 使用大模型抽取单个片段中的实体、属性和关系
+
+from ..llm import LLM
+from ..llm.prompt import ExtractPromptGenerator
+from .type import Extraction
+from .consistency import SelfConsistencySampler
+from loguru import logger
+import random
+
+NER_RETRIES = 3  # 不采用自我一致性且没有约束解码时, 实体数量过多最多重新请求的次数
+
+
+def extract_chunk(llm: LLM,
+                  prompt: ExtractPromptGenerator,
+                  content: str,
+                  sampler: SelfConsistencySampler = None,
+                  joint: bool = False) -> Extraction:
+    """ 抽取单个片段, 只调用大模型, 不修改文档状态, 也不修改 LLM 对象, 可以多线程并发调用
+
+    Args:
+        llm (LLM): 指定 LLM
+        prompt (ExtractPromptGenerator): 使用的提示词类
+        content (str): 片段内容
+        sampler (SelfConsistencySampler, optional): 自我一致性采样器, 不指定时不采用自我一致性策略. Defaults to None.
+        joint (bool, optional): 一次调用同时抽取实体、属性和关系. Defaults to False.
+
+    Returns:
+        Extraction: 抽取结果
+    """
+    if joint:
+        return _extract_chunk_joint(llm, prompt, content, sampler)
+
+    # 实体抽取
+    message, instruction = prompt.get_ner_prompt(content)
+    schema = prompt.get_ner_schema()
+    if sampler is None:
+        # 默认策略：实体生成数量过多则重试，否则随机选择5个 (约束解码时数量已由 schema 限制, 无需重试)
+        retry = 0
+        while True:
+            resp = llm.chat(message, tag='ner', schema=schema, instruction=instruction)
+            entities: dict = prompt.post_process(resp) or {}
+            if all(len(value) < 8 for value in entities.values()) or retry >= NER_RETRIES or schema is not None:
+                break
+            retry += 1
+        for entity_type, entity_list in entities.items():
+            if len(entity_list) > 10:
+                entities[entity_type] = random.sample(entity_list, 5)
+    else:
+        # 自我一致性验证: 这里的自我一致性是要求每种类型中提及的实体超过一定数量
+        def draw(k: int) -> list[dict]:
+            results = []
+            for resp in llm.chat_n(message, k, tag='ner', schema=schema, instruction=instruction):
+                logger.info(f'采样: ' + resp)
+                results.append(_as(prompt.post_process(resp), dict))
+                logger.info(f'获取知识点实体: ' + str(results[-1]))
+            return results
+
+        accepted, _ = sampler.sample(draw, _entity_candidates)
+        entities = _entities(accepted)
+    logger.success(f'最终获取知识点实体: ' + str(entities))
+    extraction = Extraction(entities=entities)
+    names = extraction.names()
+
+    # 属性抽取
+    if len(names) > 0:
+        message, instruction = prompt.get_ae_prompt(content, names)  # 只使用 name
+        resp = llm.chat(message, tag='ae', schema=prompt.get_ae_schema(names), instruction=instruction)
+        extraction.attributes = prompt.post_process(resp) or {}
+        logger.success(f'获取知识点属性: ' + str(extraction.attributes))
+
+    # 关系抽取
+    if len(names) > 1:
+        message, instruction = prompt.get_re_prompt(content, names)
+        schema = prompt.get_re_schema(names)
+        if sampler is None:
+            resp = llm.chat(message, tag='re', schema=schema, instruction=instruction)
+            relations: list = prompt.post_process(resp) or []
+        else:
+            def draw(k: int) -> list[list]:
+                results = []
+                for resp in llm.chat_n(message, k, tag='re', schema=schema, instruction=instruction):
+                    logger.info(f'采样: ' + resp)
+                    results.append(_as(prompt.post_process(resp), list))
+                    logger.info(f'获取关系三元组: ' + str(results[-1]))
+                return results
+
+            accepted, _ = sampler.sample(draw, _relation_candidates)
+            relations = [dict(relation) for relation in accepted]
+        extraction.relations = relations
+        logger.success(f'最终获取关系三元组: ' + str(relations))
+
+    return extraction
+
+
+def _extract_chunk_joint(llm: LLM,
+                         prompt: ExtractPromptGenerator,
+                         content: str,
+                         sampler: SelfConsistencySampler | None) -> Extraction:
+    """ 一次调用同时抽取实体、属性和关系
+    """
+    message, instruction = prompt.get_joint_prompt(content)
+    schema = prompt.get_joint_schema()
+
+    def draw(k: int) -> list[dict]:
+        results = []
+        for resp in llm.chat_n(message, k, tag='joint', schema=schema, instruction=instruction):
+            logger.info(f'采样: ' + resp)
+            results.append(_as(prompt.post_process(resp), dict))
+        return results
+
+    if sampler is None:
+        result = draw(1)[0]
+        extraction = Extraction(entities=result.get('entities') or {},
+                                attributes=result.get('attributes') or {},
+                                relations=result.get('relations') or [])
+    else:
+        # 实体和关系一起投票, 全部确定后才停止采样
+        accepted, results = sampler.sample(
+            draw, lambda r: [('entity', *c) for c in _entity_candidates(_as(r.get('entities'), dict))] +
+            [('relation', c) for c in _relation_candidates(_as(r.get('relations'), list))])
+        extraction = Extraction(entities=_entities([c[1:] for c in accepted if c[0] == 'entity']),
+                                relations=[dict(c[1]) for c in accepted if c[0] == 'relation'])
+        # 属性值不参与投票, 采用第一次给出的值
+        for name in extraction.names():
+            for r in results:
+                if isinstance(attr := _as(r.get('attributes'), dict).get(name), dict):
+                    extraction.attributes[name] = attr
+                    break
+    logger.success(f'最终获取抽取结果: ' + str(extraction))
+    return extraction
+
+
+def _as(value, cls: type):
+    """ 解析结果类型不符时返回空值
+    """
+    return value if isinstance(value, cls) else cls()
+
+
+def _entity_candidates(entities: dict) -> list[tuple[str, str]]:
+    return [(entity_type, name) for entity_type, names in entities.items() if isinstance(names, list)
+            for name in names if isinstance(name, str)]
+
+
+def _relation_candidates(relations: list) -> list[frozenset]:
+    return [frozenset(relation.items()) for relation in relations
+            if isinstance(relation, dict) and all(isinstance(v, str) for v in relation.values())]
+
+
+def _entities(candidates: list[tuple[str, str]]) -> dict[str, list[str]]:
+    entities: dict[str, list[str]] = {}
+    for entity_type, name in candidates:
+        entities.setdefault(entity_type, []).append(name)
+    return entities
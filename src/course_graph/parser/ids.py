@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/18
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/ids.py
+# Description: 由内容确定的 id, 同一文档重复运行得到相同的图谱 id
+
+import hashlib
+import os
+from functools import lru_cache
+from .registry import name_keys
+from .type import BookMark
+
+# id 前缀: 0 文档, 1 书签 (章节), 2 知识点, 3 关系
+_SEP = '\x1f'
+
+
+def stable_id(prefix: str, *parts: str) -> str:
+    """ 由若干字符串确定的 id: 前缀 + 96 位 blake2b 摘要 (十六进制)
+
+    Args:
+        prefix (str): id 前缀, 例如 '2:'
+        *parts (str): 确定 id 的内容
+
+    Returns:
+        str: id
+    """
+    return prefix + hashlib.blake2b(_SEP.join(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path: str, mtime: int, size: int) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def document_id(path: str) -> str:
+    """ 文档 id, 由文件内容确定, 文件没有修改时只计算一次
+
+    Args:
+        path (str): 文件路径
+
+    Returns:
+        str: id
+    """
+    stat = os.stat(path)
+    return '0:' + _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def set_bookmark_ids(bookmarks: list[BookMark], document: str) -> None:
+    """ 设置书签树中所有书签的 id, 由文档 id 和书签路径 (各级标题, 同级同名书签的序号) 确定, 保留 ':{level}' 后缀
+
+    Args:
+        bookmarks (list[BookMark]): 顶级书签
+        document (str): 文档 id
+    """
+    def visit(siblings: list[BookMark], path: tuple[str, ...]) -> None:
+        seen: dict[str, int] = {}
+        for bookmark in siblings:
+            if not isinstance(bookmark, BookMark):
+                continue
+            n = seen[bookmark.title] = seen.get(bookmark.title, -1) + 1
+            path_ = path + (f'{bookmark.title}#{n}',)
+            bookmark.id = stable_id('1:', document, *path_) + f':{bookmark.level}'
+            visit(bookmark.subs, path_)
+
+    visit(bookmarks, ())
+
+
+def entity_id(document: str, name: str) -> str:
+    """ 知识点 id, 由文档 id 和规范化的知识点名称确定。名称带有英文别名时使用去掉别名的名称,
+    "损失函数（loss function）" 与 "损失函数" 得到相同的 id, 与哪个写法先被合并无关
+
+    Args:
+        document (str): 文档 id
+        name (str): 知识点名称
+
+    Returns:
+        str: id
+    """
+    keys = name_keys(name)
+    return stable_id('2:', document, keys[1] if len(keys) > 2 else keys[0])
+
+
+def relation_id(head: str, relation: str, tail: str) -> str:
+    """ 关系 id, 由 (头实体 id, 关系类型, 尾实体 id) 确定, 也用于章节之间以及章节与知识点之间的关系
+
+    Args:
+        head (str): 头实体 id
+        relation (str): 关系类型
+        tail (str): 尾实体 id
+
+    Returns:
+        str: id
+    """
+    return stable_id('3:', head, relation, tail)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/12
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/journal.py
+# Description: 片段粒度的追加写抽取日志, 用于断点恢复
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict
+from loguru import logger
+from .type import Extraction
+
+
+def content_hash(content: str) -> str:
+    """ 片段内容的哈希值
+
+    Args:
+        content (str): 片段内容
+
+    Returns:
+        str: 哈希值
+    """
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ExtractionJournal:
+
+    def __init__(self, path: str) -> None:
+        """ 追加写的抽取日志 (JSONL): 每个片段抽取完成后立即写入一行, 每个章节合并完成后写入一行。
+        写入加锁, 多个抽取线程可以同时写入; 意外中断时最后一行可能不完整, 读取时忽略
+
+        Args:
+            path (str): 日志文件路径
+        """
+        self.path = path
+        self.chunks: dict[tuple[int, int], tuple[str, Extraction]] = {}  # (书签序号, 片段序号) -> (内容哈希, 抽取结果)
+        self.chapters: dict[int, tuple[str, int]] = {}  # 书签序号 -> (书签标题, 片段数)
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self._replay()
+        self.file = open(path, 'a', encoding='utf-8')
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')  # 不完整的最后一行单独成行, 避免与新记录连在一起
+
+    def _replay(self) -> None:
+        """ 读取已有日志
+        """
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record: dict = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f'忽略不完整的日志记录: {line[:100]}')
+                    continue
+                if 'chunk' in record:
+                    self.chunks[record['bookmark'], record['chunk']] = (
+                        record['hash'],
+                        Extraction(entities=record['entities'],
+                                   attributes=record['attributes'],
+                                   relations=record['relations']))
+                else:
+                    self.chapters[record['bookmark']] = (record['title'], record['chunks'])
+        logger.info(f'读取抽取日志: {len(self.chapters)} 个章节, {len(self.chunks)} 个片段')
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def get_chunk(self, bookmark: int, chunk: int, content: str) -> Extraction | None:
+        """ 获取已记录的片段抽取结果, 片段内容发生变化时返回 None
+
+        Args:
+            bookmark (int): 书签序号
+            chunk (int): 片段序号
+            content (str): 片段内容
+
+        Returns:
+            Extraction | None: 抽取结果
+        """
+        if (record := self.chunks.get((bookmark, chunk))) and record[0] == content_hash(content):
+            return record[1]
+        return None
+
+    def get_chapter(self, bookmark: int, title: str) -> list[tuple[str, Extraction]] | None:
+        """ 获取已完成章节的所有片段抽取结果, 无需重新读取和切分章节内容
+
+        Args:
+            bookmark (int): 书签序号
+            title (str): 书签标题, 与记录不一致时视为未完成
+
+        Returns:
+            list[tuple[str, Extraction]] | None: 按片段顺序的 (内容哈希, 抽取结果), 章节未完成时为 None
+        """
+        if (chapter := self.chapters.get(bookmark)) is None or chapter[0] != title:
+            return None
+        if any((bookmark, i) not in self.chunks for i in range(chapter[1])):
+            return None
+        return [self.chunks[bookmark, i] for i in range(chapter[1])]
+
+    def add_chunk(self, bookmark: int, chunk: int, content: str, extraction: Extraction) -> None:
+        """ 记录片段抽取结果
+
+        Args:
+            bookmark (int): 书签序号
+            chunk (int): 片段序号
+            content (str): 片段内容
+            extraction (Extraction): 抽取结果
+        """
+        self.chunks[bookmark, chunk] = (content_hash(content), extraction)
+        self._write({'bookmark': bookmark, 'chunk': chunk, 'hash': content_hash(content), **asdict(extraction)})
+
+    def add_chapter(self, bookmark: int, title: str, chunks: int) -> None:
+        """ 记录章节完成
+
+        Args:
+            bookmark (int): 书签序号
+            title (str): 书签标题
+            chunks (int): 片段数
+        """
+        self.chapters[bookmark] = (title, chunks)
+        self._write({'bookmark': bookmark, 'title': title, 'chunks': chunks})
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> 'ExtractionJournal':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
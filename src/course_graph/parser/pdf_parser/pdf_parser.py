@@ -20,6 +20,7 @@ import os
 import shutil
 from course_graph_ext import get_list_from_string, find_longest_consecutive_sequence
 from ..type import BookMark, PageIndex
+from ..ids import document_id, set_bookmark_ids
 
 
 class PDFParser(Parser):
@@ -130,7 +131,7 @@ class PDFParser(Parser):
             Image.fromarray(img).save(file_path)
             prompt_, instruction = self.vl_prompt.get_catalogue_prompt()
             vlm.instruction = instruction
-            res = vlm.chat(file_path, prompt_)
+            res = vlm.chat(file_path, prompt_, tag='catalogue')
             if res.startswith('是'):
                 catalogue.append(index)
         shutil.rmtree(cache_path)
@@ -151,7 +152,7 @@ class PDFParser(Parser):
         lines_without_index = [line[0] for line in lines]
         prompt, instruction = self.parser_prompt.get_outline_prompt(lines_without_index)
         llm.instruction = instruction
-        res = llm.chat(prompt)
+        res = llm.chat(prompt, tag='outline')
         r2 = get_list_from_string(res)
 
         outline: list = []
@@ -184,7 +185,7 @@ class PDFParser(Parser):
                 [content.content for content in page.contents]).strip()
             prompt, instruction = self.parser_prompt.get_directory_prompt(text_contents)
             llm.instruction = instruction
-            res = llm.chat(prompt).replace("，", ",")
+            res = llm.chat(prompt, tag='outline').replace("，", ",")
             lines.extend(get_list_from_string(res))
         self._set_outline(lines, offset, llm)
 
@@ -215,7 +216,7 @@ class PDFParser(Parser):
             page -= 1  # 从0开始
             level -= 1  # 从0开始
             bookmarks.append(
-                BookMark(id='1:' + str(shortuuid.uuid()) + f':{level}',
+                BookMark(id='',  # 建立书签树之后按路径设置
                          title=title,
                          page_start=PageIndex(index=page, anchor=anchor),
                          page_end=PageIndex(index=0, anchor=(0, 0)),
@@ -243,6 +244,7 @@ class PDFParser(Parser):
         set_page_end(stack)
         stack[-1].set_page_end(
             PageIndex(index=self._pdf.page_count - 1, anchor=(-1, -1)))
+        set_bookmark_ids(stack, document_id(self.file_path))
 
         return stack
 
@@ -394,7 +396,7 @@ class PDFParser(Parser):
                         try:
                             prompt_, instruction_ = self.parser_prompt.get_ocr_aided_prompt(res)
                             self.llm.instruction = instruction_
-                            res = self.llm.chat(prompt_)
+                            res = self.llm.chat(prompt_, tag='ocr_fix')
                         finally:
                             pass  # 使用大模型矫正这一步不是必须的
                     block_['text'] = res
@@ -403,7 +405,7 @@ class PDFParser(Parser):
             if file_path := save_block(block_, img, idx):
                 prompt, instruction = self.vl_prompt.get_ocr_prompt()
                 self.vlm.instruction = instruction
-                block_['text'] = self.vlm.chat(file_path, prompt)
+                block_['text'] = self.vlm.chat(file_path, prompt, tag='ocr')
 
         for idx, block in enumerate(blocks):
             type_ = block['type']
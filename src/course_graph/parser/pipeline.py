@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/15
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/pipeline.py
+# Description: 解析与抽取重叠执行的生产者/消费者流水线, 以及片段抽取的调度
+
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterator
+from loguru import logger
+from .dedup import NearDuplicateIndex
+from .journal import ExtractionJournal, content_hash
+from .type import BookMark, ChunkFailure, Extraction
+
+
+@dataclass
+class StageStats:
+    """ 流水线单个阶段的统计
+    """
+    workers: int
+    items: int = 0  # 处理数量
+    busy: float = 0  # 处理时间总和 (秒)
+    blocked: float = 0  # 等待队列的时间总和 (秒), 解析阶段为队列已满 (背压), 抽取阶段为队列为空
+
+    def utilisation(self, elapsed: float) -> float:
+        """ 利用率: 处理时间占所有线程可用时间的比例
+
+        Args:
+            elapsed (float): 流水线运行时间 (秒)
+
+        Returns:
+            float: 利用率
+        """
+        return self.busy / (elapsed * self.workers) if elapsed > 0 else 0
+
+
+class ExtractionPipeline:
+
+    def __init__(self,
+                 parse: Callable[[BookMark], list[str]],
+                 extract: Callable[[int, int, str], Extraction],
+                 parse_workers: int = 1,
+                 extract_workers: int = 1,
+                 queue_size: int = None) -> None:
+        """ 解析线程按书签顺序提前读取并切分章节, 片段放入有界队列, 由抽取线程取出调用 LLM。
+        队列已满时解析线程阻塞, 避免解析远远领先于抽取占用大量内存; 总耗时接近解析和抽取中较慢的一个而不是两者之和
+
+        Args:
+            parse (Callable[[BookMark], list[str]]): 读取并切分一个章节, 返回片段内容
+            extract (Callable[[int, int, str], Extraction]): 抽取一个片段, 参数为书签序号、片段序号和片段内容
+            parse_workers (int, optional): 解析线程数, 大于 1 时要求解析器可以并发调用. Defaults to 1.
+            extract_workers (int, optional): 抽取线程数. Defaults to 1.
+            queue_size (int, optional): 队列中最多等待抽取的片段数, 默认为抽取线程数的 2 倍. Defaults to None.
+        """
+        self.parse = parse
+        self.extract = extract
+        self.parse_workers = max(1, parse_workers)
+        self.extract_workers = max(1, extract_workers)
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size or 2 * self.extract_workers)
+        self.parse_stats = StageStats(self.parse_workers)
+        self.extract_stats = StageStats(self.extract_workers)
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.parsed = threading.Event()  # 所有章节都已解析并放入队列
+        self.start: float | None = None
+        self.elapsed: float = 0
+        self.executor: ThreadPoolExecutor | None = None
+        self.threads: list[threading.Thread] = []
+
+    def _put(self, item: tuple) -> None:
+        """ 放入队列, 队列已满时阻塞, 流水线停止时放弃
+        """
+        begin = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        with self.lock:
+            self.parse_stats.blocked += time.perf_counter() - begin
+
+    def _parse(self, index: int, bookmark: BookMark) -> tuple[list[str], list[Future]]:
+        """ 解析一个章节并将其片段放入队列
+        """
+        begin = time.perf_counter()
+        contents = self.parse(bookmark)
+        with self.lock:
+            self.parse_stats.items += 1
+            self.parse_stats.busy += time.perf_counter() - begin
+        futures = [Future() for _ in contents]
+        for i, (content, future) in enumerate(zip(contents, futures)):
+            self._put((index, i, content, future))
+        return contents, futures
+
+    def _consume(self) -> None:
+        """ 抽取线程: 从队列中取出片段抽取, 直到所有章节都已解析且队列为空
+        """
+        while not self.stop.is_set():
+            begin = time.perf_counter()
+            try:
+                index, i, content, future = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                with self.lock:
+                    self.extract_stats.blocked += time.perf_counter() - begin
+                if self.parsed.is_set() and self.queue.empty():
+                    return
+                continue
+            start = time.perf_counter()
+            with self.lock:
+                self.extract_stats.blocked += start - begin
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.extract(index, i, content))
+            except BaseException as e:
+                future.set_exception(e)
+            with self.lock:
+                self.extract_stats.items += 1
+                self.extract_stats.busy += time.perf_counter() - start
+
+    def run(self, chapters: list[tuple[int, BookMark]]) -> Iterator[tuple[list[str], list[Future]]]:
+        """ 启动流水线, 按输入顺序返回每个章节的片段和抽取结果
+
+        Args:
+            chapters (list[tuple[int, BookMark]]): (书签序号, 书签)
+
+        Returns:
+            Iterator[tuple[list[str], list[Future]]]: 片段内容, 每个片段的抽取结果
+        """
+        self.start = time.perf_counter()
+        self.executor = ThreadPoolExecutor(max_workers=self.parse_workers)
+        # 按书签顺序提交, 最先合并的章节最先解析
+        futures = [self.executor.submit(contextvars.copy_context().run, self._parse, index, bookmark)
+                   for index, bookmark in chapters]
+        remaining = [len(futures)]
+
+        def done(_: Future) -> None:
+            with self.lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    self.parsed.set()
+
+        if not futures:
+            self.parsed.set()
+        for future in futures:
+            future.add_done_callback(done)
+        # 每个线程使用各自的上下文副本 (同一个上下文不能在多个线程中同时进入)
+        self.threads = [threading.Thread(target=contextvars.copy_context().run, args=(self._consume,), daemon=True)
+                        for _ in range(self.extract_workers)]
+        for thread in self.threads:
+            thread.start()
+        for future in futures:
+            yield future.result()
+
+    def close(self) -> None:
+        """ 停止流水线并输出各阶段的利用率, 未完成的片段不再抽取
+        """
+        self.stop.set()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        for thread in self.threads:
+            thread.join()
+        while not self.queue.empty():  # 停止后队列中剩余的片段
+            self.queue.get_nowait()[3].cancel()
+        if self.start is not None:
+            self.elapsed = time.perf_counter() - self.start
+            logger.info(f'流水线: 耗时 {self.elapsed:.1f}s, '
+                        f'解析 {self.parse_stats.items} 个章节, 利用率 {self.parse_stats.utilisation(self.elapsed):.0%}, '
+                        f'背压等待 {self.parse_stats.blocked:.1f}s; '
+                        f'抽取 {self.extract_stats.items} 个片段, 利用率 {self.extract_stats.utilisation(self.elapsed):.0%}, '
+                        f'空闲等待 {self.extract_stats.blocked:.1f}s')
+
+
+class ChunkScheduler:
+
+    def __init__(self,
+                 extract: Callable[[str], Extraction],
+                 parse: Callable[[list[BookMark]], list[list[str]]],
+                 workers: int = 1,
+                 parse_workers: int = 0,
+                 queue_size: int = None,
+                 records: dict[str, Extraction] = None,
+                 journal: ExtractionJournal = None,
+                 dedup: NearDuplicateIndex = None) -> None:
+        """ 片段调度: 决定每个片段的抽取结果从哪里来 (片段记录、抽取日志、近似重复的片段或者调用 LLM),
+        在哪里执行 (当前线程、线程池或者与解析重叠的流水线), 并按书签和片段顺序返回结果。保证:
+        片段按书签顺序登记到近似重复索引, 先出现的片段作为原片段 (parse_workers 大于 1 时取决于线程调度);
+        抽取结果先写入抽取日志, 再交给调用方合并; 日志中已完成的章节不再读取和切分
+
+        Args:
+            extract (Callable[[str], Extraction]): 调用 LLM 抽取一个片段
+            parse (Callable[[list[BookMark]], list[list[str]]]): 读取并切分若干章节
+            workers (int, optional): 抽取线程数, 为 1 时在当前线程中按顺序抽取. Defaults to 1.
+            parse_workers (int, optional): 大于 0 时解析与抽取重叠执行. Defaults to 0.
+            queue_size (int, optional): 重叠执行时队列中最多等待抽取的片段数. Defaults to None.
+            records (dict[str, Extraction], optional): 内容哈希 -> 之前的抽取结果 (增量抽取). Defaults to None.
+            journal (ExtractionJournal, optional): 抽取日志. Defaults to None.
+            dedup (NearDuplicateIndex, optional): 近似重复片段索引. Defaults to None.
+        """
+        self.extract_chunk = extract
+        self.parse = parse
+        self.workers = workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.records = records or {}
+        self.journal = journal
+        self.dedup = dedup
+        # 近似重复索引中登记的片段: 作为原片段、等待抽取结果的片段, 以及近似重复片段对应的原片段抽取结果
+        self.pending: dict[tuple[int, int], Future] = {}
+        self.originals: dict[tuple[int, int], Future] = {}
+        self.executor: ThreadPoolExecutor | None = None
+        self.pipeline: ExtractionPipeline | None = None
+        self.errors: dict[int, Exception] = {}  # 书签序号 -> 读取或切分章节时的异常
+        self.changed = 0  # 没有之前抽取结果的片段数
+        self.hits = dedup.hits if dedup is not None else 0
+
+    def cached(self, index: int, i: int, content: str) -> Extraction | None:
+        """ 片段记录或抽取日志中的结果
+        """
+        if (extraction := self.records.get(content_hash(content))) is not None:
+            return extraction  # 内容没有变化的片段
+        return self.journal.get_chunk(index, i, content) if self.journal is not None else None
+
+    def _claim(self, index: int, i: int, content: str) -> None:
+        """ 登记到近似重复索引: 找到近似重复的片段时记录其抽取结果, 否则作为原片段等待抽取
+        """
+        future = Future()
+        if (original := self.dedup.get_or_add(content, future)) is not None:
+            self.originals[index, i] = original
+        else:
+            self.pending[index, i] = future
+
+    def _register(self, index: int, contents: list[str]) -> None:
+        """ 登记一个章节中需要抽取的片段
+        """
+        for i, content in enumerate(contents):
+            if self.cached(index, i, content) is None:
+                self._claim(index, i, content)
+
+    def extract(self, index: int, i: int, content: str) -> Extraction:
+        """ 获取一个片段的抽取结果, 可以多线程并发调用
+
+        Args:
+            index (int): 书签序号
+            i (int): 片段序号
+            content (str): 片段内容
+
+        Returns:
+            Extraction: 抽取结果
+        """
+        if (extraction := self.cached(index, i, content)) is not None:
+            return extraction
+        if self.dedup is not None and (index, i) not in self.pending and (index, i) not in self.originals:
+            self._claim(index, i, content)
+        if (original := self.originals.pop((index, i), None)) is not None:
+            extraction = original.result()  # 近似重复的片段复用已有的抽取结果 (可能仍在抽取中)
+        else:
+            future = self.pending.pop((index, i), None)
+            try:
+                extraction = self.extract_chunk(content)
+            except BaseException as e:
+                if future is not None:
+                    self.dedup.discard(future)  # 失败的原片段从索引中移除, 之后的近似重复片段重新抽取
+                    future.set_exception(e)
+                raise
+            if future is not None:
+                future.set_result(extraction)
+        if self.journal is not None:
+            self.journal.add_chunk(index, i, content, extraction)  # 片段完成后立即写入
+        return extraction
+
+    def _submit(self, chapters: list[tuple[int, list[str]]]) -> dict[tuple[int, int], Future]:
+        """ 将所有片段提交到线程池
+        """
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        if self.dedup is not None:
+            for index, contents in chapters:  # 按书签顺序登记, 哪个片段作为原片段与线程调度无关
+                self._register(index, contents)
+        # 最长的章节最先提交, 避免最后只剩一个长章节在运行; 近似重复的片段最后提交,
+        # 开始执行时原片段都已开始抽取, 等待原片段的线程不会占满线程池
+        futures: dict[tuple[int, int], Future] = {}
+        for index, contents in sorted(chapters, key=lambda chapter: -sum(map(len, chapter[1]))):
+            for i, content in enumerate(contents):
+                if (index, i) not in self.originals:
+                    futures[index, i] = self.executor.submit(contextvars.copy_context().run, self.extract, index, i, content)
+        for index, contents in chapters:
+            for i, content in enumerate(contents):
+                if (index, i) in self.originals:
+                    futures[index, i] = self.executor.submit(contextvars.copy_context().run, self.extract, index, i, content)
+        return futures
+
+    def _parse_one(self, index: int, bookmark: BookMark) -> list[str]:
+        """ 读取并切分一个章节, 失败时记录异常并返回空列表, 不影响其余章节
+        """
+        try:
+            contents = self.parse([bookmark])[0]
+        except Exception as e:
+            logger.error(f'章节读取失败: {bookmark.title}: {e!r}')
+            self.errors[index] = e
+            return []
+        if self.dedup is not None and self.parse_workers == 1:
+            self._register(index, contents)  # 单个解析线程按书签顺序登记并放入队列, 原片段总是先于近似重复片段被取出
+        return contents
+
+    def _parse_all(self, chapters: list[tuple[int, BookMark]]) -> dict[int, list[str]]:
+        """ 一次读取并切分所有章节, 有章节失败时逐个章节重新读取
+        """
+        try:
+            return dict(zip((index for index, _ in chapters), self.parse([bookmark for _, bookmark in chapters])))
+        except Exception:
+            return {index: self._parse_one(index, bookmark) for index, bookmark in chapters}
+
+    def run(self, chapters: list[tuple[int, BookMark]]) \
+            -> Iterator[tuple[int, BookMark, list[tuple[str, Extraction]] | None, list[str], list[Callable[[], Extraction]]]]:
+        """ 按书签顺序返回每个章节的结果, 读取失败的章节没有片段, 异常记录在 errors 中
+
+        Args:
+            chapters (list[tuple[int, BookMark]]): (书签序号, 书签)
+
+        Returns:
+            Iterator[tuple[int, BookMark, list[tuple[str, Extraction]] | None, list[str], list[Callable[[], Extraction]]]]:
+                书签序号, 书签, 日志中已完成章节的 (内容哈希, 抽取结果) (否则为 None), 片段内容, 获取每个片段抽取结果的函数
+        """
+        replays = {index: self.journal.get_chapter(index, bookmark.title) if self.journal is not None else None
+                   for index, bookmark in chapters}
+        todo = [(index, bookmark) for index, bookmark in chapters if replays[index] is None]
+        stream, contents = None, {}
+        if self.parse_workers > 0:
+            # 解析与抽取重叠执行: 解析线程提前读取后续章节, 抽取线程从有界队列中取出片段
+            indices = {bookmark.id: index for index, bookmark in todo}
+            self.pipeline = ExtractionPipeline(lambda bookmark: self._parse_one(indices[bookmark.id], bookmark),
+                                               self.extract, self.parse_workers, self.workers, self.queue_size)
+            stream = self.pipeline.run(todo)
+        else:
+            contents = self._parse_all(todo)
+        futures = self._submit(list(contents.items())) if self.workers > 1 and stream is None else {}
+
+        for index, bookmark in chapters:
+            if (replay := replays[index]) is not None:
+                yield index, bookmark, replay, [], []
+                continue
+            if stream is not None:
+                contents_, results = next(stream)
+                getters = [result.result for result in results]
+            else:
+                contents_ = contents[index]
+                getters = [futures[index, i].result if self.executor is not None else
+                           (lambda index=index, i=i, content=content: self.extract(index, i, content))
+                           for i, content in enumerate(contents_)]
+            self.changed += sum(content_hash(content) not in self.records for content in contents_)
+            yield index, bookmark, None, contents_, getters
+
+    def retry(self, failures: list[ChunkFailure], workers: int) -> Iterator[tuple[ChunkFailure, Future]]:
+        """ 以较低的并发数重新抽取失败的片段 (不使用片段记录、日志和近似重复的片段), 成功的片段写入日志并重新加入近似重复索引
+
+        Args:
+            failures (list[ChunkFailure]): 失败的片段
+            workers (int): 并发线程数
+
+        Returns:
+            Iterator[tuple[ChunkFailure, Future]]: 按输入顺序返回每个片段的抽取结果
+        """
+        def retry(failure: ChunkFailure) -> Extraction:
+            extraction = self.extract_chunk(failure.content)
+            if self.journal is not None:
+                self.journal.add_chunk(failure.index, failure.chunk, failure.content, extraction)
+            if self.dedup is not None:
+                future = Future()
+                future.set_result(extraction)
+                self.dedup.get_or_add(failure.content, future)
+            return extraction
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, retry, failure) for failure in failures]
+            yield from zip(failures, futures)
+
+    def complete(self, index: int, bookmark: BookMark, chunks: list[tuple[str, Extraction | None]]) -> None:
+        """ 章节的所有片段都已合并之后记录到抽取日志, 有失败的片段时不记录
+
+        Args:
+            index (int): 书签序号
+            bookmark (BookMark): 书签
+            chunks (list[tuple[str, Extraction | None]]): 章节的片段记录, 失败的片段为 None
+        """
+        if self.journal is not None and all(extraction is not None for _, extraction in chunks):
+            self.journal.add_chapter(index, bookmark.title, len(chunks))
+
+    def close(self) -> None:
+        """ 停止抽取, 未完成的片段不再抽取
+        """
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        if self.pipeline is not None:
+            self.pipeline.close()
+        for future in self.pending.values():  # 登记之后没有抽取的片段, 避免共享索引的其它文档等待
+            self.dedup.discard(future)
+            future.cancel()
+        self.pending.clear()
+        if self.dedup is not None:
+            logger.info(f'近似重复片段: 复用 {self.dedup.hits - self.hits} 次, '
+                        f'累计复用率 {self.dedup.skip_rate:.1%} (阈值 {self.dedup.threshold})')
+
+    def __enter__(self) -> 'ChunkScheduler':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/11
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/registry.py
+# Description: 知识点实体注册表, 按规范化名称索引
+
+import re
+import unicodedata
+from typing import Iterable, Iterator
+from .entity import KPEntity, KPRelation
+from .utils import Journaled
+
+_SPACE = re.compile(r'\s+')
+# NFKC 之后全角括号已经转换为半角
+_ALIAS = re.compile(r'^(.+?)[(\[【]([^()\[\]【】]+)[)\]】]$')
+# 只有拉丁字母的括号内容视为别名 (通常为英文名称或缩写), 其他括号内容 (如 "梯度（导数）") 不作为独立的索引键
+_LATIN = re.compile(r'^[A-Za-z0-9 .\-]+$')
+
+
+def normalize_name(name: str) -> str:
+    """ 规范化实体名称: 全角转半角, 忽略大小写和空白字符
+
+    Args:
+        name (str): 实体名称
+
+    Returns:
+        str: 规范化后的名称
+    """
+    return _SPACE.sub('', unicodedata.normalize('NFKC', name).casefold())
+
+
+def name_keys(name: str) -> list[str]:
+    """ 实体名称的所有索引键, 例如 "损失函数（loss function）" 的索引键为
+    "损失函数(lossfunction)", "损失函数" 和 "lossfunction"; 括号中不是英文别名时只有完整名称和括号前的名称
+
+    Args:
+        name (str): 实体名称
+
+    Returns:
+        list[str]: 索引键, 第一个为完整名称
+    """
+    key = normalize_name(name)
+    if match := _ALIAS.match(key):
+        if _LATIN.match(match.group(2)):
+            return [key, match.group(1), match.group(2)]
+        return [key, match.group(1)]
+    return [key]
+
+
+class KPRegistry(Journaled):
+
+    def __init__(self, kps: Iterable[KPEntity] = ()) -> None:
+        """ 知识点实体注册表: 保持添加顺序, 按规范化名称 (包括括号中的别名) O(1) 查找实体,
+        并为每个实体维护 (关系类型, 尾实体 id) 集合用于关系去重。
+        通过注册表进行的修改 (添加实体、关系和属性值) 记录在撤销日志中, 可以按事务回滚
+
+        Args:
+            kps (Iterable[KPEntity], optional): 初始实体. Defaults to ().
+        """
+        Journaled.__init__(self)
+        self._kps: list[KPEntity] = []
+        self._index: dict[str, KPEntity] = {}
+        self._ids: dict[str, KPEntity] = {}
+        self._relations: dict[str, set[tuple[str, str]]] = {}
+        for kp in kps:
+            self.add(kp)
+
+    def __setstate__(self, state: dict) -> None:
+        """ 兼容没有 id 索引时保存的注册表
+        """
+        self.__dict__.update(state)
+        if '_ids' not in state:
+            self._ids = {kp.id: kp for kp in self._kps}
+
+    def __iter__(self) -> Iterator[KPEntity]:
+        return iter(self._kps)
+
+    def __len__(self) -> int:
+        return len(self._kps)
+
+    def __getitem__(self, index: int) -> KPEntity:
+        return self._kps[index]
+
+    def get(self, name: str) -> KPEntity | None:
+        """ 按名称查找实体, 依次尝试完整名称、括号前的名称和括号中的别名
+
+        Args:
+            name (str): 实体名称
+
+        Returns:
+            KPEntity | None: 找到的实体
+        """
+        if not isinstance(name, str):
+            return None
+        for key in name_keys(name):
+            if kp := self._index.get(key):
+                return kp
+        return None
+
+    def get_by_id(self, id_: str) -> KPEntity | None:
+        """ 按 id 查找实体
+
+        Args:
+            id_ (str): 实体 id
+
+        Returns:
+            KPEntity | None: 找到的实体
+        """
+        return self._ids.get(id_)
+
+    def add(self, kp: KPEntity) -> None:
+        """ 添加实体, 已经被占用的索引键保持指向原实体
+
+        Args:
+            kp (KPEntity): 知识点实体
+        """
+        self._kps.append(kp)
+        keys = [key for key in name_keys(kp.name) if key not in self._index]
+        for key in keys:
+            self._index[key] = kp
+        self._ids[kp.id] = kp
+        self._relations[kp.id] = {(relation.type, relation.tail.id) for relation in kp.relations}
+
+        def undo():
+            self._kps.pop()
+            for key in keys:
+                del self._index[key]
+            del self._ids[kp.id]
+            del self._relations[kp.id]
+
+        self._record(undo)
+
+    append = add
+
+    def has_relation(self, head: KPEntity, relation_type: str, tail: KPEntity) -> bool:
+        """ 判断关系是否已经存在
+
+        Args:
+            head (KPEntity): 头实体
+            relation_type (str): 关系类型
+            tail (KPEntity): 尾实体
+
+        Returns:
+            bool: 是否存在
+        """
+        return (relation_type, tail.id) in self._relations.get(head.id, ())
+
+    def add_relation(self, head: KPEntity, relation: KPRelation) -> bool:
+        """ 添加关系, 重复的关系不会被添加
+
+        Args:
+            head (KPEntity): 头实体
+            relation (KPRelation): 关系
+
+        Returns:
+            bool: 是否添加
+        """
+        if self.has_relation(head, relation.type, relation.tail):
+            return False
+        head.relations.append(relation)
+        self._relations.setdefault(head.id, set()).add((relation.type, relation.tail.id))
+
+        def undo():
+            head.relations.pop()
+            self._relations[head.id].discard((relation.type, relation.tail.id))
+
+        self._record(undo)
+        return True
+
+    def add_attribute(self, kp: KPEntity, name: str, value) -> None:
+        """ 为实体添加一个属性值
+
+        Args:
+            kp (KPEntity): 知识点实体
+            name (str): 属性名称
+            value (Any): 属性值
+        """
+        created = name not in kp.attributes
+        kp.attributes.setdefault(name, []).append(value)
+
+        def undo():
+            kp.attributes[name].pop()
+            if created:
+                del kp.attributes[name]
+
+        self._record(undo)
+
+    def relations(self) -> Iterator[tuple[KPEntity, KPRelation]]:
+        """ 遍历所有关系
+
+        Returns:
+            Iterator[tuple[KPEntity, KPRelation]]: (头实体, 关系)
+        """
+        for kp in self._kps:
+            for relation in kp.relations:
+                yield kp, relation
+
+    def merge(self, mapping: dict[str, KPEntity]) -> None:
+        """ 合并重复的实体: 重复实体的属性值、资源切片和关系并入保留的实体, 指向重复实体的关系改为指向保留的实体,
+        重复实体的索引键改为指向保留的实体 (之后抽取到同名实体时直接复用保留的实体)。不记录撤销日志, 不能在事务中调用
+
+        Args:
+            mapping (dict[str, KPEntity]): 重复实体 id -> 保留的实体
+        """
+        if not mapping:
+            return
+
+        def resolve(kp: KPEntity) -> KPEntity:
+            while kp.id in mapping:
+                kp = mapping[kp.id]
+            return kp
+
+        for kp in self._kps:
+            if kp.id not in mapping:
+                continue
+            target = resolve(kp)
+            for name, values in kp.attributes.items():
+                target.attributes.setdefault(name, []).extend(values)
+            for name, value in kp.best_attributes.items():
+                target.best_attributes.setdefault(name, value)
+            target.resourceSlices.extend(sl for sl in kp.resourceSlices if sl not in target.resourceSlices)
+            target.relations.extend(kp.relations)
+        self._kps = [kp for kp in self._kps if kp.id not in mapping]
+        self._ids = {kp.id: kp for kp in self._kps}
+        self._index = {key: resolve(kp) for key, kp in self._index.items()}
+        self._relations = {}
+        for kp in self._kps:
+            relations, seen = [], set()
+            for relation in kp.relations:
+                relation.tail = resolve(relation.tail)
+                if relation.tail.id == kp.id or (relation.type, relation.tail.id) in seen:
+                    continue  # 合并之后的自环和重复关系
+                seen.add((relation.type, relation.tail.id))
+                relations.append(relation)
+            kp.relations = relations
+            self._relations[kp.id] = seen
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/13
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: course_graph/parser/storage.py
+# Description: Document 的紧凑序列化格式, 支持按需加载
+
+from __future__ import annotations
+import importlib
+import itertools
+import struct
+from typing import TYPE_CHECKING, Any, Iterable
+import msgpack
+from .type import BookMark, Extraction, PageIndex
+from .entity import KPEntity, KPRelation
+from .registry import KPRegistry
+from ..resource import PPTX, Resource, Slice
+from ..llm.prompt import VLPromptGenerator
+
+if TYPE_CHECKING:
+    from .document import Document
+    from .parser import Parser
+
+# 文件格式: MAGIC | 头部长度 (uint32, 小端) | 头部 | 各个分段
+# 头部: {'version': VERSION, 'sections': {分段名称: [偏移, 长度]}}, 偏移从头部结束处开始计算
+# 实体、关系、书签和资源之间通过行号引用:
+#   document:  [id, name, file_path, checkpoint]
+#   resources: [[类路径 ('模块:类名'), 对象属性]], 不能直接编码的属性值保存为 {'__class__': 类路径, '__state__': 属性}
+#   bookmarks: [[id, title, [起始页, 锚点], [结束页, 锚点], level, 父书签行号 (顶级为 -1), [资源行号], [实体行号]]], 先序遍历
+#   entities:  每行单独编码后依次拼接, 一行为 [id, name, type, attributes, best_attributes, [[文件路径, start, end]]]
+#   relations: 每个实体 (头实体) 一行, 单独编码后依次拼接, 一行为 [[id, type, 尾实体行号]]
+#   entities_index / relations_index: 每行在分段中的起始偏移 (uint64, 小端), 最后一个为分段长度; 按行号读取时只解码需要的行
+#   chunks:    [[书签 id, [[内容哈希, entities, attributes, relations]]]], 增量抽取使用的片段记录
+# 版本 1: entities 和 relations 为整体编码的表 (关系一行为 [id, 头实体行号, type, 尾实体行号]), 资源只支持 PPTX
+MAGIC = b'CGDOC'
+VERSION = 2
+_OFFSET = struct.Struct('<Q')
+
+
+def _class_path(cls: type) -> str:
+    return f'{cls.__module__}:{cls.__qualname__}'
+
+
+def _load_class(path: str) -> type:
+    module, qualname = path.split(':')
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _pack_state(obj: Any) -> dict:
+    """ 对象的属性: 可以直接编码的值原样保存, 其他对象 (例如提示词类) 保存为类路径及其属性, 都不行时忽略 (例如打开的文件)
+    """
+    state = obj.__getstate__() if hasattr(obj, '__getstate__') else vars(obj)
+    packed = {}
+    for key, value in (state or {}).items():
+        try:
+            msgpack.packb(value, use_bin_type=True)
+            packed[key] = value
+        except (TypeError, ValueError):
+            if hasattr(value, '__dict__'):
+                packed[key] = {'__class__': _class_path(type(value)), '__state__': _pack_state(value)}
+    return packed
+
+
+def _unpack_state(obj: Any, state: dict) -> Any:
+    state = {key: _unpack_state(_new(value['__class__']), value['__state__'])
+             if isinstance(value, dict) and value.keys() == {'__class__', '__state__'} else value
+             for key, value in state.items()}
+    if (setstate := getattr(obj, '__setstate__', None)) is not None:
+        setstate(state)  # 例如 PPTX 在这里重置未打开的文件
+    else:
+        obj.__dict__.update(state)
+    return obj
+
+
+def _new(path: str) -> Any:
+    cls = _load_class(path)
+    return cls.__new__(cls)  # 不调用 __init__, 不打开文件
+
+
+def _rows(rows: list[bytes]) -> tuple[bytes, bytes]:
+    """ 拼接单独编码的行, 返回分段和每行的偏移
+    """
+    offsets = itertools.accumulate(map(len, rows), initial=0)
+    return b''.join(rows), b''.join(_OFFSET.pack(offset) for offset in offsets)
+
+
+def dump_document(document: Document, path: str) -> None:
+    """ 保存 Document, 不包含 parser
+
+    Args:
+        document (Document): 文档
+        path (str): 保存路径
+    """
+    resources: list[Resource] = []
+    resource_rows: dict[int, int] = {}
+    entity_rows = {kp.id: row for row, kp in enumerate(document.knowledgepoints)}
+
+    def resource_row(resource: Resource) -> int:
+        if id(resource) not in resource_rows:
+            resource_rows[id(resource)] = len(resources)
+            resources.append(resource)
+        return resource_rows[id(resource)]
+
+    bookmarks = []
+
+    def add_bookmark(bookmark: BookMark, parent: int) -> None:
+        row = len(bookmarks)
+        bookmarks.append([
+            bookmark.id, bookmark.title,
+            [bookmark.page_start.index, bookmark.page_start.anchor],
+            [bookmark.page_end.index, bookmark.page_end.anchor],
+            bookmark.level, parent,
+            [resource_row(resource) for resource in bookmark.resource],
+            [entity_rows[sub.id] for sub in bookmark.subs if isinstance(sub, KPEntity)]
+        ])
+        for sub in bookmark.subs:
+            if isinstance(sub, BookMark):
+                add_bookmark(sub, row)
+
+    for bookmark in document.bookmarks:
+        add_bookmark(bookmark, -1)
+
+    entities, entities_index = _rows([msgpack.packb([
+        kp.id, kp.name, kp.type, kp.attributes, kp.best_attributes,
+        [[sl.file_path, sl.start, sl.end] for sl in kp.resourceSlices]
+    ], use_bin_type=True) for kp in document.knowledgepoints])
+    relations, relations_index = _rows([msgpack.packb([
+        [relation.id, relation.type, entity_rows[relation.tail.id]] for relation in kp.relations
+    ], use_bin_type=True) for kp in document.knowledgepoints])
+    tables = {
+        'document': [document.id, document.name, document.file_path, document.checkpoint],
+        'resources': [[_class_path(type(resource)), _pack_state(resource)] for resource in resources],
+        'bookmarks': bookmarks,
+        'chunks': [[bookmark_id, [[hash_, extraction.entities, extraction.attributes, extraction.relations]
+                                  for hash_, extraction in chunks]]
+                   for bookmark_id, chunks in document.chunk_records.items()],
+    }
+    sections = {name: msgpack.packb(table, use_bin_type=True) for name, table in tables.items()}
+    sections.update(entities=entities, entities_index=entities_index,
+                    relations=relations, relations_index=relations_index)
+    offsets, offset = {}, 0
+    for name, blob in sections.items():
+        offsets[name] = [offset, len(blob)]
+        offset += len(blob)
+    header = msgpack.packb({'version': VERSION, 'sections': offsets}, use_bin_type=True)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for blob in sections.values():
+            f.write(blob)
+
+
+def _anchor(anchor: list | None) -> tuple | None:
+    return tuple(anchor) if anchor is not None else None
+
+
+def is_document_file(path: str) -> bool:
+    """ 判断文件是否为该格式 (而不是旧版本的 pickle)
+
+    Args:
+        path (str): 文件路径
+
+    Returns:
+        bool: 是否为该格式
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class DocumentFile:
+
+    def __init__(self, path: str) -> None:
+        """ 读取 dump_document 保存的文件, 各个分段在使用时才读取和解码, 实体和关系可以按行号只读取需要的行
+
+        Args:
+            path (str): 文件路径
+
+        Raises:
+            ValueError: 不是该格式的文件或版本过高
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} 不是 Document 文件')
+            length, = struct.unpack('<I', f.read(4))
+            header = msgpack.unpackb(f.read(length))
+        self.version: int = header['version']
+        if self.version > VERSION:
+            raise ValueError(f'不支持的文件版本: {self.version}, 当前版本: {VERSION}')
+        self.sections: dict[str, list[int]] = header['sections']
+        self.base = len(MAGIC) + 4 + length
+
+    def _section(self, name: str) -> list:
+        """ 只读取和解码一个分段
+        """
+        offset, length = self.sections[name]
+        with open(self.path, 'rb') as f:
+            f.seek(self.base + offset)
+            return msgpack.unpackb(f.read(length), strict_map_key=False)
+
+    def _rows(self, name: str, rows: Iterable[int] | None = None) -> dict[int, Any]:
+        """ 读取和解码逐行编码的分段, 指定行号时只读取这些行
+
+        Args:
+            name (str): 分段名称
+            rows (Iterable[int] | None, optional): 行号. Defaults to None.
+
+        Returns:
+            dict[int, Any]: 行号到行
+        """
+        offset, length = self.sections[name]
+        with open(self.path, 'rb') as f:
+            if rows is None:
+                f.seek(self.base + offset)
+                unpacker = msgpack.Unpacker(max_buffer_size=max(length, 1), strict_map_key=False)
+                unpacker.feed(f.read(length))
+                return dict(enumerate(unpacker))
+            index, _ = self.sections[name + '_index']
+            result = {}
+            for row in sorted(rows):
+                f.seek(self.base + index + row * _OFFSET.size)
+                start, end = struct.unpack('<2Q', f.read(2 * _OFFSET.size))
+                f.seek(self.base + offset + start)
+                result[row] = msgpack.unpackb(f.read(end - start), strict_map_key=False)
+            return result
+
+    def _resources(self) -> list[Resource]:
+        resources = []
+        for row in self._section('resources'):
+            if self.version == 1:  # [类型, 文件路径, 页面描述], 只有 PPTX
+                type_, file_path, index_maps = row
+                row = [_class_path(PPTX), {'file_path': file_path, 'index_maps': index_maps,
+                                           'vl_prompt': {'__class__': _class_path(VLPromptGenerator), '__state__': {}}}]
+            path, state = row
+            resources.append(_unpack_state(_new(path), state))
+        return resources
+
+    def _bookmark_tree(self) -> tuple[list[BookMark], list[BookMark], list[list]]:
+        """ 构建书签树, subs 中只包含子书签
+
+        Returns:
+            tuple[list[BookMark], list[BookMark], list[list]]: 顶级书签, 按行号排列的所有书签, 书签表
+        """
+        resources = self._resources()
+        table = self._section('bookmarks')
+        roots, rows = [], []
+        for id_, title, (start, start_anchor), (end, end_anchor), level, parent, resource, _ in table:
+            bookmark = BookMark(id=id_,
+                                title=title,
+                                page_start=PageIndex(start, _anchor(start_anchor)),
+                                page_end=PageIndex(end, _anchor(end_anchor)),
+                                level=level,
+                                subs=[],
+                                resource=[resources[row] for row in resource])
+            (roots if parent == -1 else rows[parent].subs).append(bookmark)
+            rows.append(bookmark)
+        return roots, rows, table
+
+    def _entities(self, rows: set[int] | None = None) -> dict[int, KPEntity]:
+        """ 构建实体以及实体之间的关系, 指定行号时只读取和解码这些实体及其关系
+
+        Args:
+            rows (set[int] | None, optional): 只构建指定行号的实体及其之间的关系. Defaults to None.
+
+        Returns:
+            dict[int, KPEntity]: 行号到实体
+        """
+        if self.version == 1:
+            table = self._section('entities')
+            records = {row: table[row] for row in (range(len(table)) if rows is None else rows)}
+            relations: dict[int, list] = {}
+            for id_, head, type_, tail in self._section('relations'):
+                relations.setdefault(head, []).append([id_, type_, tail])
+        else:
+            records = self._rows('entities', rows)
+            relations = self._rows('relations', rows)
+        entities = {
+            row: KPEntity(id=id_,
+                          name=name,
+                          type=type_,
+                          attributes=attributes,
+                          best_attributes=best_attributes,
+                          resourceSlices=[Slice(file_path, start, end) for file_path, start, end in slices])
+            for row, (id_, name, type_, attributes, best_attributes, slices) in records.items()
+        }
+        for head, entity in entities.items():
+            for id_, type_, tail in relations.get(head, ()):
+                if tail in entities:
+                    entity.relations.append(KPRelation(id=id_, type=type_, tail=entities[tail]))
+        return entities
+
+    def get_bookmarks(self) -> list[BookMark]:
+        """ 只加载书签树, 不加载知识点
+
+        Returns:
+            list[BookMark]: 顶级书签
+        """
+        return self._bookmark_tree()[0]
+
+    def get_chapter(self, title: str) -> BookMark | None:
+        """ 只加载一个章节的子图: 章节及其子书签、其中的知识点以及这些知识点之间的关系 (不包含指向章节外知识点的关系)
+
+        Args:
+            title (str): 章节标题或 id
+
+        Returns:
+            BookMark | None: 章节, 不存在时为 None
+        """
+        _, rows, table = self._bookmark_tree()
+        start = next((row for row, bookmark in enumerate(rows) if title in (bookmark.title, bookmark.id)), None)
+        if start is None:
+            return None
+        # 先序遍历中子孙书签紧跟在该书签之后
+        chapter = {start}
+        for row in range(start + 1, len(table)):
+            if table[row][5] not in chapter:
+                break
+            chapter.add(row)
+        entities = self._entities({entity for row in chapter for entity in table[row][7]})
+        for row in chapter:
+            rows[row].subs.extend(entities[entity] for entity in table[row][7])
+        return rows[start]
+
+    def get_document(self, parser: Parser) -> Document:
+        """ 加载完整的 Document
+
+        Args:
+            parser (Parser): 对应的解析器
+
+        Returns:
+            Document: 文档
+        """
+        from .document import Document
+        roots, rows, table = self._bookmark_tree()
+        entities = self._entities()
+        for row, bookmark in enumerate(rows):
+            bookmark.subs.extend(entities[entity] for entity in table[row][7])
+
+        document = Document.__new__(Document)
+        document.id, document.name, document.file_path, document.checkpoint = self._section('document')
+        document.parser = parser
+        document.bookmarks = roots
+        document.knowledgepoints = KPRegistry(entities[row] for row in range(len(entities)))
+        document.chunk_records = {
+            bookmark_id: [(hash_, Extraction(entities, attributes, relations))
+                          for hash_, entities, attributes, relations in chunks]
+            for bookmark_id, chunks in (self._section('chunks') if 'chunks' in self.sections else [])
+        }
+        return document
+
+
+def load_document(path: str, parser: Parser) -> Document:
+    """ 加载 Document
+
+    Args:
+        path (str): 文件路径
+        parser (Parser): 对应的解析器
+
+    Returns:
+        Document: 文档
+    """
+    return DocumentFile(path).get_document(parser)
+
@@ -6,9 +6,10 @@
 
 from dataclasses import dataclass
 from .entity import KPEntity
+from .registry import normalize_name
 from ..resource import Resource
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 class ContentType(Enum):
@@ -93,3 +94,99 @@ class BookMark:
 \t subs=[\t{s}]'''
         else:
             return  f'BookMark(title="{self.title}", ...)'
+
+
+class BookmarkIndex:
+
+    def __init__(self, bookmarks: list[BookMark]) -> None:
+        """ 书签索引: 先序遍历顺序、id 到书签、规范化标题到书签、父书签以及叶子书签 (没有子书签)。
+        书签树结构改变后需要重新构建
+
+        Args:
+            bookmarks (list[BookMark]): 顶级书签
+        """
+        self.flat: list[BookMark] = []
+        self.positions: dict[str, int] = {}  # id -> 先序遍历位置
+        self.ends: dict[str, int] = {}  # id -> 子树结束位置 (不包含)
+        self.parents: dict[str, BookMark | None] = {}
+        self.titles: dict[str, list[BookMark]] = {}
+        self.leaves: list[BookMark] = []
+
+        def visit(bookmark: BookMark, parent: BookMark | None) -> None:
+            self.positions[bookmark.id] = len(self.flat)
+            self.flat.append(bookmark)
+            self.parents[bookmark.id] = parent
+            self.titles.setdefault(normalize_name(bookmark.title), []).append(bookmark)
+            children = [sub for sub in bookmark.subs if isinstance(sub, BookMark)]
+            if not children:
+                self.leaves.append(bookmark)
+            for child in children:
+                visit(child, bookmark)
+            self.ends[bookmark.id] = len(self.flat)
+
+        for bookmark in bookmarks:
+            visit(bookmark, None)
+
+    def get(self, id_: str) -> BookMark | None:
+        """ 通过 id 获取书签
+        """
+        position = self.positions.get(id_)
+        return self.flat[position] if position is not None else None
+
+    def get_by_title(self, title: str) -> list[BookMark]:
+        """ 通过标题获取书签 (忽略全半角、大小写和空白字符)
+        """
+        return self.titles.get(normalize_name(title), [])
+
+    def get_kps(self, bookmark: BookMark) -> list[KPEntity]:
+        """ 获取书签下的所有知识点实体, 子孙书签在先序遍历中连续, 无需递归
+
+        Args:
+            bookmark (BookMark): 书签
+
+        Returns:
+            list[KPEntity]: 实体列表
+        """
+        return [
+            sub for node in self.flat[self.positions[bookmark.id]:self.ends[bookmark.id]]
+            for sub in node.subs if isinstance(sub, KPEntity)
+        ]
+
+
+@dataclass
+class Extraction:
+    """ 单个片段的抽取结果, 只包含名称, 尚未合并为知识点实体
+    """
+    entities: dict[str, list[str]] = field(default_factory=dict)  # {'entity_type': ['entity1', 'entity2']}
+    attributes: dict[str, dict[str, str]] = field(default_factory=dict)  # {'entity1': {'attribute1': 'value'}}
+    relations: list[dict[str, str]] = field(default_factory=list)  # [{'head':'', 'relation':'', 'tail':''}]
+
+    def names(self) -> list[str]:
+        """ 片段中的实体名称 (去重并保持顺序)
+
+        Returns:
+            list[str]: 实体名称
+        """
+        return list(dict.fromkeys(name for entity_list in self.entities.values() for name in entity_list))
+
+
+@dataclass
+class ChunkFailure:
+    """ 抽取或合并失败的片段, 或者读取失败的章节
+    """
+    index: int  # 书签序号
+    bookmark: BookMark
+    chunk: int  # 片段序号, 章节读取失败时为 -1
+    content: str
+    error: str
+
+
+@dataclass
+class ExtractionReport:
+    """ 单个文档的抽取结果统计
+    """
+    succeeded: int = 0  # 成功的片段数 (包括重试成功的片段)
+    retried: int = 0  # 重试的片段数
+    failed: int = 0  # 重试之后仍然失败的片段数, 包括读取失败的章节
+    attr_failed: int = 0  # 总结失败、沿用第一个属性值的属性数
+    failures: list[ChunkFailure] = field(default_factory=list)  # 最终失败的片段
@@ -6,9 +6,50 @@
 
 import copy
 from functools import wraps
+from typing import Callable
+
+
+class Journaled:
+    """ 支持撤销日志的对象: 事务中的每次修改记录一个撤销操作, 回滚时逆序执行, 提交时丢弃,
+    开销只与事务中的修改数量有关。支持嵌套事务
+    """
+
+    def __init__(self) -> None:
+        self._undo: list[Callable[[], None]] = []
+        self._marks: list[int] = []
+
+    def begin(self) -> None:
+        """ 开始事务
+        """
+        self._marks.append(len(self._undo))
+
+    def commit(self) -> None:
+        """ 提交事务
+        """
+        self._marks.pop()
+        if not self._marks:
+            self._undo.clear()
+
+    def rollback(self) -> None:
+        """ 回滚事务中的所有修改
+        """
+        mark = self._marks.pop()
+        while len(self._undo) > mark:
+            self._undo.pop()()
+
+    def _record(self, undo: Callable[[], None]) -> None:
+        """ 记录一次修改的撤销操作, 不在事务中时不记录
+
+        Args:
+            undo (Callable[[], None]): 撤销操作
+        """
+        if self._marks:
+            self._undo.append(undo)
+
 
 def instance_method_transactional(*instance_variables):
     """  装饰实例方法, 指定实例属性名称, 在方法抛出异常的时候回滚对这些属性的更改, 然后继续抛出异常。
+    Journaled 属性使用撤销日志回滚, 其他属性在调用前深拷贝
 
     Args:
         *variables (str): 需要回滚的变量名称
@@ -16,13 +57,26 @@ def instance_method_transactional(*instance_variables):
     def decorator(func):
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            original_state = {var: copy.deepcopy(getattr(self, var)) for var in instance_variables}
-            
+            journals: list[Journaled] = []
+            original_state = {}
+            for var in instance_variables:
+                value = getattr(self, var)
+                if isinstance(value, Journaled):
+                    value.begin()
+                    journals.append(value)
+                else:
+                    original_state[var] = copy.deepcopy(value)
+
             try:
-                return func(self, *args, **kwargs)
+                result = func(self, *args, **kwargs)
             except Exception as e:
+                for journal in journals:
+                    journal.rollback()
                 for var, value in original_state.items():
                     setattr(self, var, value)
                 raise e
+            for journal in journals:
+                journal.commit()
+            return result
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
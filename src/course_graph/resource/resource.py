@@ -97,24 +97,32 @@ class PPTX(Resource):
             vl_prompt (VLPromptGenerator, optional): 图文理解模型提示词. Defaults to VLPromptGenerator().
         """
         super().__init__(pptx_path)
-        self.pptx = Presentation(pptx_path)
+        self._pptx = None
         self.vl_prompt = vl_prompt
         # 每一页对应的描述
         self.index_maps: dict[int, str] = dict()
 
+    @property
+    def pptx(self) -> Presentation:
+        """ 使用时才打开文件
+        """
+        if self._pptx is None:
+            self._pptx = Presentation(self.file_path)
+        return self._pptx
+
     def __getstate__(self):
         """ 自定义序列化方法
         """
         state = self.__dict__.copy()
-        # 移除 parser 属性
-        del state['pptx']
+        # 移除 pptx 属性, 反序列化后使用时重新打开
+        state.pop('_pptx', None)
         return state
 
     def __setstate__(self, state):
         """ 自定义反序列化方法
         """
         self.__dict__.update(state)
-        self.pptx = Presentation(state['file_path'])
+        self._pptx = None
 
     def get_slices(self, keyword: str) -> list[Slice]:
         """ 通过关键词获取切片
@@ -143,11 +151,11 @@ class PPTX(Resource):
             if idx == 0:
                 prompt_, instruction = self.vl_prompt.get_ie_prompt()
                 model.instruction = instruction
-                res = model.chat(img, prompt_)
+                res = model.chat(img, prompt_, tag='resource')
             else:
                 prompt_, instruction = self.vl_prompt.get_context_ie_prompt(res)  # 之前的回答作为上文信息，可以更好理解本张图片
                 model.instruction = instruction
-                res = model.chat([imgs[idx - 1], img], prompt_)
+                res = model.chat([imgs[idx - 1], img], prompt_, tag='resource')
             # 页数从1开始
             self.index_maps[idx + 1] = res
         # 删除缓存文件夹
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/conftest.py
+# Description: 测试配置, 从 src 目录导入 course_graph
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
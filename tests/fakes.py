@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/fakes.py
+# Description: 测试使用的解析器、提示词和大模型: 片段中 【名称】 标出的词作为知识点, 相邻的知识点之间有关系
+
+import json
+import re
+import threading
+from course_graph.llm import LLM
+from course_graph.llm.prompt import ExtractPromptGenerator
+from course_graph.parser import BookMark, Parser
+from course_graph.parser.ids import document_id, set_bookmark_ids
+from course_graph.parser.type import Content, ContentType, PageIndex
+from course_graph.resource import Resource, Slice
+
+_NAME = re.compile(r'【(.+?)】')
+
+
+class FakeParser(Parser):
+
+    def __init__(self, file_path: str, chapters: dict[str, list[str]]) -> None:
+        """ 一个顶级章节, 每个小节的内容由 chapters 给出
+
+        Args:
+            file_path (str): 文档路径, 文件需要存在 (用于计算文档 id)
+            chapters (dict[str, list[str]]): 小节标题 -> 段落
+        """
+        super().__init__(file_path)
+        self.chapters = chapters
+        self.broken: set[str] = set()  # 读取时抛出异常的小节
+        self.reads: list[str] = []
+
+    def close(self) -> None:
+        pass
+
+    def get_bookmarks(self) -> list[BookMark]:
+        subs = [BookMark(id='', title=title, page_start=PageIndex(i, None), page_end=PageIndex(i, None),
+                         level=2, subs=[], resource=[])
+                for i, title in enumerate(self.chapters)]
+        root = BookMark(id='', title='第一章', page_start=PageIndex(0, None),
+                        page_end=PageIndex(len(subs), None), level=1, subs=subs, resource=[])
+        set_bookmark_ids([root], document_id(self.file_path))
+        return [root]
+
+    def get_contents(self, bookmark: BookMark) -> list[Content]:
+        self.reads.append(bookmark.title)
+        if bookmark.title in self.broken:
+            raise OSError(f'无法读取: {bookmark.title}')
+        return [Content(ContentType.Text, 'text', text, (0, 0, 0, 0)) for text in self.chapters[bookmark.title]]
+
+
+class FakePrompt(ExtractPromptGenerator):
+    """ 提示词即片段内容, 模型输出为 JSON
+    """
+
+    def get_ner_prompt(self, content: str) -> tuple[str, str]:
+        return content, 'ner'
+
+    def get_re_prompt(self, content: str, entities: list[str]) -> tuple[str, str]:
+        return json.dumps(entities, ensure_ascii=False), 're'
+
+    def get_ae_prompt(self, content: str, entities: list[str]) -> tuple[str, str]:
+        return json.dumps(entities, ensure_ascii=False), 'ae'
+
+    def get_best_attr_prompt(self, entity: str, attr: str, values: list[str]) -> tuple[str, str]:
+        return json.dumps(values, ensure_ascii=False), 'best_attr'
+
+    def get_joint_prompt(self, content: str) -> tuple[str, str]:
+        return content, 'joint'
+
+    def post_process(self, response: str) -> list | dict:
+        return json.loads(response)
+
+
+class FakeLLM(LLM):
+
+    def __init__(self, fail: dict[str, int] = None) -> None:
+        """ 按规则回答的大模型
+
+        Args:
+            fail (dict[str, int], optional): 包含该文本的片段前若干次抽取抛出异常. Defaults to None.
+        """
+        super().__init__()
+        self.model = 'fake'
+        self.fail = dict(fail or {})
+        self.calls: list[str] = []
+        self.lock = threading.Lock()
+
+    def _answer(self, message: str, instruction: str) -> str:
+        with self.lock:
+            self.calls.append(instruction)
+            for text, times in self.fail.items():
+                if text in message and times > 0:
+                    self.fail[text] = times - 1
+                    raise ConnectionError(f'模型调用失败: {text}')
+        if instruction == 'best_attr':
+            return min(json.loads(message))
+        if instruction in ('ner', 'joint'):
+            names = list(dict.fromkeys(_NAME.findall(message)))
+            if instruction == 'ner':
+                return json.dumps({'概念': names}, ensure_ascii=False)
+            return json.dumps({'entities': {'概念': names},
+                               'attributes': {name: {'定义': f'{name}的定义'} for name in names},
+                               'relations': [{'head': head, 'relation': '相关', 'tail': tail}
+                                             for head, tail in zip(names, names[1:])]}, ensure_ascii=False)
+        names = json.loads(message)
+        if instruction == 'ae':
+            return json.dumps({name: {'定义': f'{name}的定义'} for name in names}, ensure_ascii=False)
+        return json.dumps([{'head': head, 'relation': '相关', 'tail': tail}
+                           for head, tail in zip(names, names[1:])], ensure_ascii=False)
+
+    def chat(self, message: str, tag: str = None, schema: dict = None, instruction: str = None) -> str:
+        return self._answer(message, instruction)
+
+    def chat_n(self, message: str, n: int, tag: str = None, schema: dict = None, instruction: str = None) -> list[str]:
+        return [self._answer(message, instruction) for _ in range(n)]
+
+
+class Video(Resource):
+
+    def __init__(self, file_path: str, chapters: dict[int, str]) -> None:
+        """ PPTX 以外的资源类型
+        """
+        super().__init__(file_path)
+        self.chapters = chapters
+        self.prompt = FakePrompt()
+
+    def get_slices(self, keyword: str) -> list[Slice]:
+        return [Slice(self.file_path, start, start) for start, text in self.chapters.items() if keyword in text]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_attributes.py
+# Description: 属性总结测试: 批次失败时沿用第一个属性值并计入抽取结果统计
+
+import json
+import pytest
+
+try:
+    from course_graph.parser.config import config
+    from fakes import FakeLLM, FakeParser, FakePrompt
+    from test_extraction import CHAPTERS
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+
+class DefiningLLM(FakeLLM):
+    """ 属性值带上所在的片段, 出现在多个片段中的知识点有多个不同的属性值
+    """
+
+    def _answer(self, message: str, instruction: str) -> str:
+        resp = super()._answer(message, instruction)
+        if instruction != 'joint':
+            return resp
+        res = json.loads(resp)
+        res['attributes'] = {name: {'定义': f'{name}: {message}'} for name in res['attributes']}
+        return json.dumps(res, ensure_ascii=False)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'chunk_tokens', 20)
+
+
+def test_failed_summaries_fall_back_to_the_first_value(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    document = FakeParser(str(path), CHAPTERS).get_document()
+    # 动量的属性总结总是失败, 其余属性正常总结
+    llm = DefiningLLM(fail={'"动量: ': 100})
+    report = document.set_knowledgepoints_by_llm(llm, FakePrompt(), joint=True, workers=4, attr_batch_size=1)
+    assert report.attr_failed == 1
+    assert (report.failed, report.failures) == (0, [])
+    summarized = {kp.name: kp for kp in document.knowledgepoints if len(set(kp.attributes['定义'])) > 1}
+    assert set(summarized) == {'梯度', '梯度下降', '动量', '学习率', '正则化'}
+    for name, kp in summarized.items():
+        values = kp.attributes['定义']
+        expected = values[0] if name == '动量' else min(values)
+        assert kp.best_attributes['定义'] == expected
+    assert llm.calls.count('best_attr') == len(summarized)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_canonical.py
+# Description: 知识点规范化测试: 合并同义知识点, 之后的增量抽取沿用保留的知识点
+
+import numpy as np
+import pytest
+
+try:
+    from course_graph.parser import KPCanonicalizer
+    from course_graph.parser.config import config
+    from fakes import FakeLLM, FakeParser, FakePrompt
+    from test_extraction import CHAPTERS
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+SYNONYMS = {'Momentum': '动量'}
+BOOK = {**CHAPTERS, '1.4 优化器': ['【Adam】结合了【Momentum】和自适应【学习率】。']}
+
+
+class FakeEmbedder:
+    """ 同义的名称得到相同的向量, 其余名称的向量两两正交
+    """
+
+    def __init__(self) -> None:
+        self.dims: dict[str, int] = {}
+
+    def encode(self, texts: list[str], **kwargs) -> np.ndarray:
+        vectors = np.zeros((len(texts), 64), dtype='float32')
+        for row, text in enumerate(texts):
+            name = text.split(':')[0]
+            vectors[row, self.dims.setdefault(SYNONYMS.get(name, name), len(self.dims))] = 1
+        return vectors
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'chunk_tokens', 20)
+
+
+def test_incremental_run_reuses_the_kept_entity(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    parser = FakeParser(str(path), BOOK)
+    document = parser.get_document()
+    document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True, canonicalizer=KPCanonicalizer(FakeEmbedder()))
+    momentum = document.knowledgepoints.get('动量')
+    assert document.knowledgepoints.get('Momentum') is momentum
+    optimiser = document.bookmarks[0].subs[3]
+    assert momentum in optimiser.subs
+    assert len({kp.id for kp in document.knowledgepoints}) == len(document.knowledgepoints)
+
+    # 学习率一节变化, 其余片段 (包括提到 Momentum 的片段) 沿用之前的抽取结果
+    parser.chapters = {**BOOK, '1.2 学习率': ['【学习率】决定【梯度下降】和【动量】的步长。']}
+    document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True, incremental=True)
+    ids = [kp.id for kp in document.knowledgepoints]
+    assert len(set(ids)) == len(ids)
+    assert 'Momentum' not in [kp.name for kp in document.knowledgepoints]
+    kept = document.knowledgepoints.get_by_id(momentum.id)
+    assert kept.name == '动量'
+    assert kept in optimiser.subs and kept in document.bookmarks[0].subs[1].subs
+    # 关系的尾实体都是注册表中的知识点
+    assert all(document.knowledgepoints.get_by_id(relation.tail.id) is relation.tail
+               for _, relation in document.knowledgepoints.relations())
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/19
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_consistency.py
+# Description: 自我一致性采样器测试
+
+import importlib.util
+import os
+
+# 直接加载模块, 不导入 course_graph 包 (包的导入依赖模型等重量级依赖)
+_spec = importlib.util.spec_from_file_location(
+    'consistency', os.path.join(os.path.dirname(__file__), '..', 'src', 'course_graph', 'parser', 'consistency.py'))
+consistency = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(consistency)
+
+
+def make_draw(outputs: list[list[str]]):
+    it = iter(outputs)
+
+    def draw(k: int) -> list[list[str]]:
+        return [next(it) for _ in range(k)]
+
+    return draw
+
+
+def test_votes_accumulate_across_batches():
+    sampler = consistency.SelfConsistencySampler(samples=5, top=0.5, early_stop=True)
+    outputs = [['a', 'b'], ['a'], ['b', 'c'], ['a', 'c'], ['a']]
+    accepted, results = sampler.sample(make_draw(outputs), lambda result: result)
+    assert accepted == ['a']
+    assert len(results) == 5
+
+
+def test_all_agree_stops_early():
+    sampler = consistency.SelfConsistencySampler(samples=5, top=0.5, early_stop=True)
+    accepted, results = sampler.sample(make_draw([['a', 'a']] * 5), lambda result: result)
+    assert accepted == ['a']
+    assert len(results) == 3
+    assert sampler.stats.saved == 2
+
+
+def test_max_samples_keeps_counting():
+    sampler = consistency.SelfConsistencySampler(samples=4, top=0.5, early_stop=False, max_samples=6)
+    outputs = [['a'], ['a'], ['b'], ['b'], ['a'], ['a']]
+    accepted, results = sampler.sample(make_draw(outputs), lambda result: result)
+    assert len(results) == 6
+    assert accepted == ['a']
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_estimate.py
+# Description: 抽取估算测试: 最大调用次数是真实调用次数的上界
+
+import pytest
+
+try:
+    from loguru import logger
+    from course_graph.parser.estimate import ExtractionEstimator
+    from fakes import FakeLLM, FakeParser, FakePrompt
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+# 每个片段都有 8 个以上的实体, 不采用自我一致性时实体抽取会重新请求
+CHAPTERS = {
+    '1.1 概念': ['、'.join(f'【概念{i}】' for i in range(10)) + '。'],
+    '1.2 方法': ['、'.join(f'【方法{i}】' for i in range(9)) + '。'],
+}
+
+
+def test_max_calls_include_ner_retries(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    document = FakeParser(str(path), CHAPTERS).get_document()
+    estimate = document.estimate_extraction(prompt=FakePrompt())
+    llm = FakeLLM()
+    document.set_knowledgepoints_by_llm(llm, FakePrompt())
+    extraction_calls = len([call for call in llm.calls if call != 'best_attr'])
+    assert extraction_calls == 2 * 6  # 每个片段: 实体抽取 1 + 3 次, 属性抽取和关系抽取各 1 次
+    assert estimate.stages['ner'].max_calls == 8
+    assert estimate.stages['ner'].min_calls == 2
+    assert estimate.max_calls >= len(llm.calls)
+
+
+def test_no_ner_retries_with_sampler_or_schema():
+    class SchemaPrompt(FakePrompt):
+        def get_ner_schema(self) -> dict:
+            return {'type': 'object'}
+
+    estimator = ExtractionEstimator(SchemaPrompt())
+    estimator.add_chunk('片段')
+    assert estimator.estimate.stages['ner'].max_calls == 1
+
+
+def test_warns_when_parser_calls_models(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    parser = FakeParser(str(path), CHAPTERS)
+    parser.llm = FakeLLM()
+    warnings = []
+    sink = logger.add(warnings.append, level='WARNING')
+    try:
+        parser.get_document().estimate_extraction(prompt=FakePrompt())
+    finally:
+        logger.remove(sink)
+    assert any('llm' in message for message in warnings)
+    assert parser.llm.calls == []
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_extraction.py
+# Description: 知识抽取调度测试: 顺序、并发和流水线执行的结果一致
+
+import pytest
+
+try:
+    from course_graph.parser import Document, NearDuplicateIndex
+    from course_graph.parser.config import config
+    from fakes import FakeLLM, FakeParser, FakePrompt
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+CHAPTERS = {
+    '1.1 梯度': ['【梯度】是【导数】的推广。', '【梯度下降】沿【梯度】的反方向更新参数。', '【动量】累积历史【梯度】。'],
+    '1.2 学习率': ['【学习率】决定【梯度下降】的步长。'],
+    '1.3 正则化': ['【正则化】用于防止【过拟合】。', '【权重衰减】是一种【正则化】方法。'],
+    '1.4 优化器': ['【Adam】结合了【动量】和自适应【学习率】。'],
+}
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'chunk_tokens', 20)  # 每个章节切分为多个片段
+
+
+def extract(tmp_path, chapters: dict[str, list[str]] = CHAPTERS, **kwargs) -> tuple[Document, FakeLLM]:
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    document = FakeParser(str(path), chapters).get_document()
+    llm = FakeLLM()
+    document.set_knowledgepoints_by_llm(llm, FakePrompt(), joint=True, **kwargs)
+    return document, llm
+
+
+def snapshot(document: Document) -> dict:
+    return {
+        'subs': [(b.title, [sub.id for sub in b.subs]) for b in document.flatten_bookmarks()],
+        'entities': [(kp.id, kp.name, kp.attributes, [(relation.type, relation.tail.name) for relation in kp.relations])
+                     for kp in document.knowledgepoints],
+        'chunks': document.chunk_records,
+    }
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'workers': 4},
+    {'workers': 4, 'parse_workers': 1},
+    {'workers': 2, 'parse_workers': 3, 'queue_size': 1},
+])
+def test_parallel_matches_sequential(tmp_path, kwargs):
+    expected = snapshot(extract(tmp_path)[0])
+    assert sum(len(chunks) for chunks in expected['chunks'].values()) > len(CHAPTERS)
+    assert snapshot(extract(tmp_path, **kwargs)[0]) == expected
+
+
+# 第五节是第一节的近似重复
+DUPLICATED = {**CHAPTERS, '1.5 复习': ['【梯度】是【导数】的推广!', '【梯度下降】沿【梯度】的反方向更新参数!', '【动量】累积历史【梯度】!']}
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'workers': 4}, {'workers': 4, 'parse_workers': 1}])
+def test_dedup_reuses_earlier_chunks(tmp_path, kwargs):
+    expected, llm = extract(tmp_path, DUPLICATED)
+    dedup = NearDuplicateIndex(threshold=0.7)
+    document, deduped = extract(tmp_path, DUPLICATED, dedup=dedup, **kwargs)
+    assert len(deduped.calls) == len(llm.calls) - 3
+    assert dedup.hits == 3
+    # 原片段总是先出现的片段, 复习一节复用第一节的抽取结果
+    first, review = document.bookmarks[0].subs[0], document.bookmarks[0].subs[4]
+    assert [extraction for _, extraction in document.chunk_records[review.id]] == \
+        [extraction for _, extraction in document.chunk_records[first.id]]
+    assert snapshot(document)['entities'] == snapshot(expected)['entities']
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'workers': 4}, {'workers': 2, 'parse_workers': 2}])
+def test_unreadable_chapter_is_reported(tmp_path, kwargs):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    parser = FakeParser(str(path), CHAPTERS)
+    parser.broken.add('1.2 学习率')
+    document = parser.get_document()
+    report = document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True, **kwargs)
+    broken = document.bookmarks[0].subs[1]
+    assert [(failure.bookmark.title, failure.chunk) for failure in report.failures] == [('1.2 学习率', -1)]
+    assert 'OSError' in report.failures[0].error
+    assert report.failed == 1
+    assert broken.subs == [] and broken.id not in document.chunk_records
+    assert len(document.chunk_records) == len(CHAPTERS) - 1
+    assert '正则化' in [kp.name for kp in document.knowledgepoints]
+
+
+def test_failed_chunks_are_retried(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    document = FakeParser(str(path), CHAPTERS).get_document()
+    # 学习率一节的片段失败一次, 重试成功; 正则化一节的第二个片段总是失败
+    llm = FakeLLM(fail={'【学习率】决定': 1, '【权重衰减】': 100})
+    report = document.set_knowledgepoints_by_llm(llm, FakePrompt(), joint=True, workers=4)
+    chunks = sum(len(chunks) for chunks in snapshot(extract(tmp_path)[0])['chunks'].values())
+    assert (report.retried, report.failed) == (2, 1)
+    assert report.succeeded == chunks - 1
+    assert [failure.content for failure in report.failures] == ['【权重衰减】是一种【正则化】方法。']
+    assert '学习率' in [kp.name for kp in document.knowledgepoints]
+    assert '权重衰减' not in [kp.name for kp in document.knowledgepoints]
+    regularisation = document.bookmarks[0].subs[2]
+    assert len(document.chunk_records[regularisation.id]) == 1
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_hedge.py
+# Description: 对冲请求测试
+
+import threading
+import time
+import pytest
+
+try:
+    from course_graph.llm import LLM
+    from course_graph.llm.hedge import Hedging
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+
+class ScriptedLLM(LLM):
+
+    def __init__(self, hedging: Hedging, hedge: float = 0.02) -> None:
+        """ 原请求的延迟由每次请求指定, 对冲请求的延迟固定, 取消时立即中止
+        """
+        super().__init__()
+        self.hedging = hedging
+        self.hedge = hedge
+        self.sent = 0
+        self.cancelled = 0
+
+    def request(self, latency: float):
+        self.sent = 0
+        return self._create_hedged(latency=latency)
+
+    def _hedge_target(self, latency: float):
+        self.sent += 1
+        latency, cancelled = latency if self.sent == 1 else self.hedge, threading.Event()
+
+        def send():
+            if cancelled.wait(latency):
+                raise ConnectionError('请求已中止')
+            return latency
+
+        def cancel():
+            self.cancelled += 1
+            cancelled.set()
+
+        return send, cancel
+
+
+def test_slow_primaries_keep_the_delay():
+    hedging = Hedging(quantile=0.5, window=20, min_samples=5)
+    for _ in range(20):
+        hedging.observe(0.05)
+    # 一半的原请求很慢, 总是被对冲请求取代; 它们的延迟也要计入统计, 否则对冲等待时间会降到快速请求的延迟
+    llm = ScriptedLLM(hedging)
+    for _ in range(20):
+        llm.request(0.01)
+        llm.request(0.3)
+    assert hedging.delay() >= 0.05
+    assert llm.cancelled == 20
+    assert hedging.stats.hedge_wins == 20
+    assert hedging.stats.hedge_rate == 0.5
+
+
+def test_primary_wins_cancels_the_hedge():
+    hedging = Hedging(quantile=0.5, window=20, min_samples=1)
+    hedging.observe(0.02)
+    llm = ScriptedLLM(hedging, hedge=0.5)
+    start = time.time()
+    assert llm.request(0.05) == 0.05
+    assert time.time() - start < 0.4
+    assert llm.cancelled == 1
+    assert hedging.stats.hedge_wins == 0
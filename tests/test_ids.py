@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_ids.py
+# Description: 由内容确定的 id 测试
+
+import pytest
+
+try:
+    from course_graph.parser import BookMark
+    from course_graph.parser.ids import document_id, entity_id, relation_id, set_bookmark_ids
+    from course_graph.parser.type import PageIndex
+    from fakes import FakeLLM, FakeParser, FakePrompt
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+
+def bookmark(title: str, level: int, subs: list = None) -> BookMark:
+    return BookMark(id='', title=title, page_start=PageIndex(0, None), page_end=PageIndex(0, None),
+                    level=level, subs=subs or [], resource=[])
+
+
+def test_document_id_depends_on_content(tmp_path):
+    a, b, c = tmp_path / 'a.pdf', tmp_path / 'b.pdf', tmp_path / 'c.pdf'
+    a.write_bytes(b'book')
+    b.write_bytes(b'book')
+    c.write_bytes(b'other')
+    assert document_id(str(a)) == document_id(str(b)) != document_id(str(c))
+    assert document_id(str(a)).startswith('0:')
+
+
+def test_bookmark_ids_follow_the_title_path():
+    def tree() -> list[BookMark]:
+        return [bookmark('第一章', 1, [bookmark('习题', 2), bookmark('习题', 2)]), bookmark('第二章', 1, [bookmark('习题', 2)])]
+
+    first, second = tree(), tree()
+    set_bookmark_ids(first, '0:doc')
+    set_bookmark_ids(second, '0:doc')
+    ids = [sub.id for root in first for sub in [root, *root.subs]]
+    assert ids == [sub.id for root in second for sub in [root, *root.subs]]
+    assert len(set(ids)) == len(ids)  # 同级同名、不同父章节的同名书签 id 不同
+    assert all(id_.startswith('1:') for id_ in ids)
+    assert first[0].id.endswith(':1') and first[0].subs[0].id.endswith(':2')
+    set_bookmark_ids(second, '0:other')
+    assert second[0].id != first[0].id
+
+
+def test_entity_and_relation_ids():
+    assert entity_id('0:doc', '损失函数（Loss Function）') == entity_id('0:doc', '损失函数') == entity_id('0:doc', ' 损失函数')
+    assert entity_id('0:doc', '梯度（导数）') != entity_id('0:doc', '梯度')
+    assert entity_id('0:doc', '梯度') != entity_id('0:other', '梯度')
+    assert relation_id('2:a', '相关', '2:b') == relation_id('2:a', '相关', '2:b') != relation_id('2:b', '相关', '2:a')
+
+
+def test_repeated_runs_give_the_same_graph_ids(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    chapters = {'1.1 梯度': ['【梯度下降】沿【梯度】的反方向更新参数。'], '1.2 学习率': ['【学习率】决定【梯度下降】的步长。']}
+
+    def ids() -> list[str]:
+        document = FakeParser(str(path), chapters).get_document()
+        document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True)
+        return [document.id, *(b.id for b in document.flatten_bookmarks()),
+                *(kp.id for kp in document.knowledgepoints),
+                *(relation.id for kp in document.knowledgepoints for relation in kp.relations)]
+
+    first = ids()
+    assert first == ids()
+    assert len(set(first)) == len(first)
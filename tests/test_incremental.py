@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_incremental.py
+# Description: 增量抽取测试: 只重新抽取变化的片段, 保留未变化知识点的 id、资源切片和最佳属性值
+
+import pytest
+
+try:
+    from course_graph.parser.config import config
+    from course_graph.resource import Slice
+    from fakes import FakeLLM, FakeParser, FakePrompt
+    from test_extraction import CHAPTERS, snapshot
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'chunk_tokens', 20)
+
+
+def test_only_changed_chunks_are_extracted(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    parser = FakeParser(str(path), CHAPTERS)
+    document = parser.get_document()
+    document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True)
+    before = {kp.name: kp for kp in document.knowledgepoints}
+    before['梯度'].resourceSlices.append(Slice('lecture.pptx', 1, 2))
+    before['梯度'].best_attributes['定义'] = '人工确认的定义'
+
+    # 修改正则化一节的第二个片段
+    parser.chapters = {**CHAPTERS, '1.3 正则化': ['【正则化】用于防止【过拟合】。', '【L2正则化】是一种【正则化】方法。']}
+    llm = FakeLLM()
+    document.set_knowledgepoints_by_llm(llm, FakePrompt(), joint=True, incremental=True)
+    assert llm.calls.count('joint') == 1
+    after = {kp.name: kp for kp in document.knowledgepoints}
+    assert '权重衰减' not in after and 'L2正则化' in after  # 只由被删除片段贡献的知识点被移除
+    assert all(after[name].id == kp.id for name, kp in before.items() if name != '权重衰减')
+    assert after['梯度'].resourceSlices == [Slice('lecture.pptx', 1, 2)]
+    assert after['梯度'].best_attributes['定义'] == '人工确认的定义'
+
+    expected = FakeParser(str(path), parser.chapters).get_document()
+    expected.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True)
+    assert snapshot(document)['subs'] == snapshot(expected)['subs']
+    assert snapshot(document)['chunks'] == snapshot(expected)['chunks']
+
+
+def test_failed_incremental_run_keeps_previous_graph(tmp_path):
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    parser = FakeParser(str(path), CHAPTERS)
+    document = parser.get_document()
+    document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True)
+    expected = snapshot(document)
+
+    class InterruptedLLM(FakeLLM):
+        def _answer(self, message: str, instruction: str) -> str:
+            raise KeyboardInterrupt
+
+    parser.chapters = {**CHAPTERS, '1.4 优化器': ['【Adam】结合了【动量】和【RMSProp】。']}
+    with pytest.raises(KeyboardInterrupt):
+        document.set_knowledgepoints_by_llm(InterruptedLLM(), FakePrompt(), joint=True, incremental=True)
+    assert snapshot(document) == expected
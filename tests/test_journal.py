@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_journal.py
+# Description: 抽取日志测试: 中断之后从日志恢复
+
+import pytest
+
+try:
+    from course_graph.parser.config import config
+    from fakes import FakeLLM, FakeParser, FakePrompt
+    from test_extraction import CHAPTERS, snapshot
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+
+class InterruptedLLM(FakeLLM):
+
+    def __init__(self, text: str) -> None:
+        """ 抽取到包含该文本的片段时中断运行
+        """
+        super().__init__()
+        self.text = text
+
+    def _answer(self, message: str, instruction: str) -> str:
+        if self.text in message:
+            raise KeyboardInterrupt
+        return super()._answer(message, instruction)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, 'chunk_tokens', 20)
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    return str(path)
+
+
+def resume(path: str, journal: str) -> tuple[FakeParser, FakeLLM, dict]:
+    with pytest.raises(KeyboardInterrupt):  # 正则化一节的第二个片段中断
+        FakeParser(path, CHAPTERS).get_document().set_knowledgepoints_by_llm(
+            InterruptedLLM('【权重衰减】'), FakePrompt(), joint=True, journal=journal)
+    parser, llm = FakeParser(path, CHAPTERS), FakeLLM()
+    document = parser.get_document()
+    document.set_knowledgepoints_by_llm(llm, FakePrompt(), joint=True, journal=journal)
+    return parser, llm, snapshot(document)
+
+
+def test_resume_skips_completed_chapters_and_chunks(path, tmp_path):
+    expected = FakeParser(path, CHAPTERS).get_document()
+    expected.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True)
+    parser, llm, resumed = resume(path, str(tmp_path / 'journal.jsonl'))
+    assert parser.reads == ['1.3 正则化', '1.4 优化器']  # 已完成的章节不再读取
+    assert llm.calls.count('joint') == 2  # 正则化一节的第一个片段从日志恢复
+    assert resumed == snapshot(expected)
+
+
+def test_resume_ignores_truncated_last_line(path, tmp_path):
+    journal = tmp_path / 'journal.jsonl'
+    journal.write_text('{"bookmark": 0, "chunk": 0, "hash": "', encoding='utf-8')  # 写入中断的记录
+    _, llm, _ = resume(path, str(journal))
+    assert llm.calls.count('joint') == 2
+    lines = journal.read_text(encoding='utf-8').splitlines()
+    assert lines[0].endswith('"hash": "') and all(line.endswith('}') for line in lines[1:])
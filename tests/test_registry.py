@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_registry.py
+# Description: 知识点注册表测试: 名称规范化、别名索引和关系去重
+
+import pytest
+
+try:
+    from course_graph.parser.entity import KPEntity, KPRelation
+    from course_graph.parser.registry import KPRegistry, name_keys, normalize_name
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+
+def kp(name: str) -> KPEntity:
+    return KPEntity(id=name, name=name, type='概念')
+
+
+def test_normalize_name():
+    assert normalize_name('Ｌｏｓｓ  Function') == 'lossfunction'
+    assert normalize_name('损失函数（Loss）') == '损失函数(loss)'
+
+
+def test_name_keys_index_only_latin_aliases():
+    assert name_keys('损失函数（Loss Function）') == ['损失函数(lossfunction)', '损失函数', 'lossfunction']
+    assert name_keys('梯度（导数）') == ['梯度(导数)', '梯度']
+    assert name_keys('梯度') == ['梯度']
+
+
+def test_get_by_full_name_prefix_and_alias():
+    registry = KPRegistry([kp('损失函数（Loss Function）')])
+    target = registry[0]
+    for name in ('损失函数(loss function)', '损失函数', 'LOSS FUNCTION', '损失函数 '):
+        assert registry.get(name) is target
+    assert registry.get('梯度') is None
+    assert registry.get(None) is None
+    assert registry.get_by_id(target.id) is target
+
+
+def test_first_entity_keeps_shared_keys():
+    registry = KPRegistry([kp('梯度'), kp('梯度（导数）')])
+    assert registry.get('梯度') is registry[0]
+    assert registry.get('梯度（导数）') is registry[1]
+    assert len(registry) == 2
+
+
+def test_relations_are_deduplicated():
+    registry = KPRegistry([kp('梯度'), kp('导数')])
+    head, tail = registry
+    assert registry.add_relation(head, KPRelation('r1', '相关', tail))
+    assert not registry.add_relation(head, KPRelation('r2', '相关', tail))
+    assert registry.add_relation(head, KPRelation('r3', '包含', tail))
+    assert [relation.id for _, relation in registry.relations()] == ['r1', 'r3']
+    assert registry.has_relation(head, '相关', tail) and not registry.has_relation(tail, '相关', head)
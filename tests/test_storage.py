@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_storage.py
+# Description: 紧凑序列化格式的读写测试
+
+import pytest
+
+try:
+    from course_graph.parser import Document, DocumentFile
+    from fakes import FakeLLM, FakeParser, FakePrompt, Video
+except ImportError as e:
+    pytest.skip(f'缺少依赖: {e}', allow_module_level=True)
+
+CHAPTERS = {
+    '1.1 梯度': ['【梯度】是【导数】的推广。', '【梯度下降】沿【梯度】的反方向更新参数。'],
+    '1.2 学习率': ['【学习率】决定【梯度下降】的步长。'],
+    '1.3 正则化': ['【正则化】用于防止【过拟合】。'],
+}
+
+
+@pytest.fixture
+def document(tmp_path) -> Document:
+    path = tmp_path / 'book.pdf'
+    path.write_bytes(b'book')
+    document = FakeParser(str(path), CHAPTERS).get_document()
+    document.set_knowledgepoints_by_llm(FakeLLM(), FakePrompt(), joint=True)
+    document.bookmarks[0].subs[0].resource.append(Video(str(tmp_path / 'lecture.mp4'), {3: '梯度下降的演示'}))
+    return document
+
+
+def snapshot(document: Document) -> dict:
+    return {
+        'bookmarks': [(b.id, b.title, [sub.id for sub in b.subs]) for b in document.flatten_bookmarks()],
+        'entities': [(kp.id, kp.name, kp.type, kp.attributes, kp.best_attributes,
+                      [(relation.id, relation.type, relation.tail.id) for relation in kp.relations])
+                     for kp in document.knowledgepoints],
+        'chunks': document.chunk_records,
+    }
+
+
+def test_round_trip(document, tmp_path):
+    path = str(tmp_path / 'book.cgdoc')
+    document.dump(path)
+    loaded = Document.load(path, document.parser)
+    assert snapshot(loaded) == snapshot(document)
+    assert loaded.id == document.id
+    video = loaded.bookmarks[0].subs[0].resource[0]
+    assert isinstance(video, Video)
+    assert video.chapters == {3: '梯度下降的演示'}
+    assert isinstance(video.prompt, FakePrompt)
+    assert video.get_slices('梯度下降')[0].start == 3
+
+
+def test_get_chapter_decodes_only_its_entities(document, tmp_path):
+    path = str(tmp_path / 'book.cgdoc')
+    document.dump(path)
+    file = DocumentFile(path)
+    chapter = file.get_chapter('1.3 正则化')
+    assert [kp.name for kp in chapter.subs] == ['正则化', '过拟合']
+    assert [relation.tail.name for relation in chapter.subs[0].relations] == ['过拟合']
+
+    # 破坏其它章节的实体行: 加载单个章节不受影响, 完整加载则失败
+    offset, _ = file.sections['entities']
+    with open(path, 'r+b') as f:
+        f.seek(file.base + offset)
+        f.write(b'\xc1')  # msgpack 中不会出现的字节
+    assert [kp.name for kp in DocumentFile(path).get_chapter('1.3 正则化').subs] == ['正则化', '过拟合']
+    with pytest.raises(Exception):
+        Document.load(path, document.parser)
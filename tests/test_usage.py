@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Create Date: 2024/12/20
+# Author: wangtao <wangtao.cpu@gmail.com>
+# File Name: tests/test_usage.py
+# Description: 调用统计测试: 计数不依赖保留的调用记录
+
+import importlib.util
+import os
+import pytest
+
+# 直接加载模块, 不导入 course_graph 包 (包的导入依赖模型等重量级依赖)
+_spec = importlib.util.spec_from_file_location(
+    'usage', os.path.join(os.path.dirname(__file__), '..', 'src', 'course_graph', 'llm', 'usage.py'))
+usage = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(usage)
+
+
+def test_summary_counts_calls_beyond_retained_records():
+    tracker = usage.UsageTracker(max_records=10)
+    tracker.set_price('m1', 1, 2)
+    with tracker.scope(document='书'):
+        for _ in range(100):
+            tracker.record('m1', 100, 10, 0.5, tag='ner')
+        for _ in range(50):
+            tracker.record('m2', 200, 20, 1.0, tag='re')
+    tracker.record('m1', 100, 10, 0.5)
+    assert len(tracker.records) == 10
+    assert tracker.records[-1].tag == 'other' and tracker.records[-1].document is None
+
+    total = tracker.total()
+    assert (total.calls, total.prompt_tokens, total.completion_tokens) == (151, 20100, 2010)
+    assert total.latency == 100.5
+    assert total.cost == pytest.approx(101 * 0.12)
+
+    by_tag = tracker.summary(by=('tag',), document='书')
+    assert {key: summary.calls for key, summary in by_tag.items()} == {('ner',): 100, ('re',): 50}
+    assert by_tag['re',].cost == 0  # 没有设置价格
+    assert tracker.total(model='m1').calls == 101
+
+    tracker.set_price('m2', 1, 1)  # 费用按当前价格计算
+    assert tracker.total(model='m2').cost == pytest.approx(50 * 0.22)
+    assert 'course_graph_llm_calls_total{model="m1",tag="ner",document="书"} 100' in tracker.to_prometheus()
+
+    tracker.reset()
+    assert tracker.total().calls == 0 and len(tracker.records) == 0